@@ -0,0 +1,190 @@
+'''
+The Circuit Breaker module keeps the health of each matrix provider across
+invocations of a warm process, so once a provider is rate limited or failing
+matrices are estimated right away instead of waiting on calls that would fail
+'''
+import os
+import threading
+import time
+import requests
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from exceptions import GraphHopperLimitError, GraphHopperServerError
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_FAILURE_WINDOW_SECONDS = 10
+DEFAULT_COOLDOWN_SECONDS = 30
+DEFAULT_HALF_OPEN_PROBES = 1
+
+
+def _status_code(error):
+    additional_info = getattr(error, 'additional_info', None) or {}
+    return additional_info.get('status_code', 0)
+
+
+def is_provider_failure(error):
+    '''
+    Checks if error means the provider is unavailable (rate limit, server error,
+    connection error or timeout, of requests or httpx) rather than a problem
+    with the requested matrix
+    '''
+    if isinstance(error, (
+        GraphHopperLimitError, GraphHopperServerError,
+        requests.exceptions.ConnectionError, requests.exceptions.Timeout
+    )):
+        return True
+    # Connection errors and timeouts of the HTTP/2 client
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return True
+    return _status_code(error) == 429 or _status_code(error) >= 500
+
+
+def is_rate_limit(error):
+    '''
+    Checks if error is a rate limit answer of the provider
+    '''
+    return isinstance(error, GraphHopperLimitError) or _status_code(error) == 429
+
+
+class CircuitBreaker:
+    '''
+    CircuitBreaker lets calls through while closed and opens when:
+    - the provider answers with a rate limit, until its reported reset time
+    - failure_threshold failures happen within failure_window seconds, for cooldown seconds
+    Once open time is over it is half-open: up to half_open_probes calls go through,
+    a successful probe closes it and a failed one opens it again
+    '''
+    def __init__(
+        self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        failure_window=DEFAULT_FAILURE_WINDOW_SECONDS, cooldown=DEFAULT_COOLDOWN_SECONDS,
+        half_open_probes=DEFAULT_HALF_OPEN_PROBES
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.cooldown = cooldown
+        self.half_open_probes = half_open_probes
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = []
+        self.open_until = 0
+        self.probes = 0
+        self.rejected = 0
+
+    def allow_request(self, now=None):
+        '''
+        Checks if a call to the provider can be sent. Calls allowed while half-open
+        are probes and must report their outcome (record_success, record_failure or release)
+        '''
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.state == OPEN and now >= self.open_until:
+                self.state = HALF_OPEN
+                self.probes = 0
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and self.probes < self.half_open_probes:
+                self.probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def is_open(self, now=None):
+        '''
+        Checks if calls are being rejected, without taking a half-open probe
+        '''
+        now = time.time() if now is None else now
+        with self.lock:
+            return self.state == OPEN and now < self.open_until
+
+    def record_success(self):
+        '''
+        Reports a call answered by the provider
+        '''
+        with self.lock:
+            # Calls sent before the breaker opened do not close it
+            if self.state != OPEN:
+                self.state = CLOSED
+                self.failures = []
+                self.probes = 0
+
+    def record_failure(self, reset_at=None, rate_limited=False, now=None):
+        '''
+        Reports a failed call, reset_at is the epoch time the provider
+        reported its rate limit will be reset. It only applies to rate limited calls,
+        other failures keep the breaker open for cooldown seconds
+        '''
+        now = time.time() if now is None else now
+        with self.lock:
+            self.failures = [
+                failure for failure in self.failures if now - failure < self.failure_window
+            ] + [now]
+            if (
+                self.state == HALF_OPEN or rate_limited
+                or len(self.failures) >= self.failure_threshold
+            ):
+                self.state = OPEN
+                self.open_until = max(
+                    self.open_until,
+                    reset_at if rate_limited and reset_at else now + self.cooldown
+                )
+                self.failures = []
+                self.probes = 0
+
+    def release(self):
+        '''
+        Reports a call that ended without telling anything about the provider health
+        '''
+        with self.lock:
+            if self.state == HALF_OPEN and self.probes > 0:
+                self.probes -= 1
+
+    def stats(self):
+        '''
+        Returns the breaker state, when an open breaker will let probes through
+        and the calls rejected since it was created
+        '''
+        with self.lock:
+            return {
+                'breaker_state': self.state,
+                'breaker_open_until': self.open_until if self.state == OPEN else None,
+                'breaker_rejected': self.rejected
+            }
+
+
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_circuit_breaker(name):
+    '''
+    Returns the process-wide circuit breaker of the matrix provider called name.
+    Failure threshold, failure window, cooldown and half-open probes can be set with the
+    CIRCUIT_BREAKER_FAILURES, CIRCUIT_BREAKER_WINDOW, CIRCUIT_BREAKER_COOLDOWN
+    and CIRCUIT_BREAKER_PROBES environment variables
+    '''
+    with _BREAKERS_LOCK:
+        if name not in _BREAKERS:
+            _BREAKERS[name] = CircuitBreaker(
+                name,
+                failure_threshold=max(int(
+                    os.environ.get('CIRCUIT_BREAKER_FAILURES', DEFAULT_FAILURE_THRESHOLD)
+                ), 1),
+                failure_window=float(
+                    os.environ.get('CIRCUIT_BREAKER_WINDOW', DEFAULT_FAILURE_WINDOW_SECONDS)
+                ),
+                cooldown=float(
+                    os.environ.get('CIRCUIT_BREAKER_COOLDOWN', DEFAULT_COOLDOWN_SECONDS)
+                ),
+                half_open_probes=max(int(
+                    os.environ.get('CIRCUIT_BREAKER_PROBES', DEFAULT_HALF_OPEN_PROBES)
+                ), 1)
+            )
+        return _BREAKERS[name]
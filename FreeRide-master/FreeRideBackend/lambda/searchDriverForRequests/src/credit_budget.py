@@ -0,0 +1,128 @@
+'''
+The Credit Budget module accounts the routing credits spent by each location per hour,
+as reported by the matrix provider, and downgrades the lower value matrix calls
+to estimated matrices as a location gets close to its hourly budget
+(see the routingCreditBudget location setting), so final matches keep the credits left.
+Spent credits are counted by each process, so a location running in n processes
+can spend up to n times its budget. The account's remaining credits reported
+by the provider are shared by every process: once they fall under the account reserve
+(ROUTING_CREDIT_RESERVE) lower value calls are downgraded for every location
+'''
+import os
+import threading
+import time
+
+# Call types from lowest to highest value, each one is downgraded once the location
+# has spent its share of the hourly budget
+CALL_TYPE_BUDGET_SHARES = {
+    # Time matrices of candidate drivers other than the best ranked one
+    'candidate': 0.6,
+    # Time matrices refreshing a driver's route ETAs
+    'route_update': 0.85,
+    # Time matrices of the best ranked candidate driver
+    'final_match': 1.0
+}
+CALL_TYPES = list(CALL_TYPE_BUDGET_SHARES.keys())
+# Hours of consumption kept for each location
+HISTORY_HOURS = 24
+# Account credits kept for final matches, 0 disables the account floor
+DEFAULT_CREDIT_RESERVE = 0
+# Seconds the account's remaining credits are used after the provider reported them
+REMAINING_MAX_AGE_SECONDS = 3600
+
+
+class CreditAccountant:
+    '''
+    CreditAccountant keeps the credits spent and calls downgraded
+    by location, hour and call type, and the account's remaining credits
+    '''
+    def __init__(self, reserve=DEFAULT_CREDIT_RESERVE):
+        self.lock = threading.Lock()
+        # {location_id: {hour: {'credits': {call_type: n}, 'downgraded': {call_type: n}}}}
+        self.usage = {}
+        self.reserve = reserve
+        self.remaining = None
+        self.remaining_at = None
+
+    def __hour_usage(self, location_id, now):
+        hour = int(now // 3600)
+        location_usage = self.usage.setdefault(str(location_id), {})
+        for old_hour in [key for key in location_usage if key <= hour - HISTORY_HOURS]:
+            del location_usage[old_hour]
+        return location_usage.setdefault(hour, {
+            'credits': {call_type: 0 for call_type in CALL_TYPES},
+            'downgraded': {call_type: 0 for call_type in CALL_TYPES}
+        })
+
+    def __above_floor(self, call_type, now):
+        # Each call type keeps its share of the reserve for the higher value calls
+        if not self.reserve or self.remaining is None:
+            return True
+        if now - self.remaining_at > REMAINING_MAX_AGE_SECONDS:
+            return True
+        return self.remaining >= self.reserve * (1 - CALL_TYPE_BUDGET_SHARES[call_type])
+
+    def allow(self, location_id, call_type, budget, now=None, record_stats=True):
+        '''
+        Checks if a call_type call of location_id can be sent with budget credits per hour
+        (0 for unlimited) and the account's remaining credits, counting the call
+        as downgraded if not (and record_stats)
+        '''
+        now = time.time() if now is None else now
+        with self.lock:
+            hour_usage = self.__hour_usage(location_id, now)
+            spent = sum(hour_usage['credits'].values())
+            if self.__above_floor(call_type, now) and (
+                not budget or spent < budget * CALL_TYPE_BUDGET_SHARES[call_type]
+            ):
+                return True
+            if record_stats:
+                hour_usage['downgraded'][call_type] += 1
+            return False
+
+    def record(self, location_id, call_type, credits, remaining=None, now=None):
+        '''
+        Records the credits spent by a call_type call of location_id and
+        the account's remaining credits, if reported
+        '''
+        now = time.time() if now is None else now
+        with self.lock:
+            self.__hour_usage(location_id, now)['credits'][call_type] += credits
+            if remaining is not None:
+                self.remaining = remaining
+                self.remaining_at = now
+
+    def stats(self, location_id, now=None):
+        '''
+        Returns the credits spent and calls downgraded in the current hour
+        by call type for location_id, and the account's remaining credits
+        '''
+        now = time.time() if now is None else now
+        with self.lock:
+            hour_usage = self.__hour_usage(location_id, now)
+            return {
+                'credits_hour': sum(hour_usage['credits'].values()),
+                'credits_by_type': dict(hour_usage['credits']),
+                'downgraded_by_type': dict(hour_usage['downgraded']),
+                'credits_remaining': self.remaining
+            }
+
+
+_ACCOUNTANT = None
+_ACCOUNTANT_LOCK = threading.Lock()
+
+
+def get_credit_accountant():
+    '''
+    Returns the process-wide credit accountant,
+    the account reserve can be set with the ROUTING_CREDIT_RESERVE environment variable
+    '''
+    # pylint: disable=global-statement
+    global _ACCOUNTANT
+    # pylint: enable=global-statement
+    with _ACCOUNTANT_LOCK:
+        if _ACCOUNTANT is None:
+            _ACCOUNTANT = CreditAccountant(
+                reserve=float(os.environ.get('ROUTING_CREDIT_RESERVE', DEFAULT_CREDIT_RESERVE))
+            )
+        return _ACCOUNTANT
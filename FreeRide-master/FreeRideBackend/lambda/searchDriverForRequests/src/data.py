@@ -3,28 +3,38 @@ The Data module provides the tools to build necessary matrices and additional da
 in order to run TSP with the proper constraint information
 '''
 import os
+import functools
 import traceback
-import json
-import requests
+import numpy as np
 import sentry_sdk
 
 from conversion import feetToMeters
-from exceptions import (
-    GraphHopperServerError, GraphHopperLimitError, GraphHopperDefaultError,
-    GraphHopperProfileError, GraphHopperMatrixError
-)
+from matrix_cache import get_matrix_cache, coordinate_key, missing_blocks
+from matrix_providers import get_matrix_provider
+from matrix_coalescer import get_matrix_coalescer
+from http_client import get_http_client
+from credit_budget import get_credit_accountant
+from travel_estimator import get_travel_estimator
+from circuit_breaker import get_circuit_breaker, is_provider_failure, is_rate_limit
+from exceptions import GraphHopperProfileError, GraphHopperMatrixError
 import route
 import utils
 
+# Most distinct points fetched in a single batched matrix request
+MATRIX_BATCH_MAX_POINTS = int(os.environ.get('MATRIX_BATCH_MAX_POINTS', 80))
+# Geodesic distance matrices on the WGS-84 'ellipsoid' or the faster 'haversine' sphere
+DISTANCE_MATRIX_MODE = os.environ.get('DISTANCE_MATRIX_MODE', 'ellipsoid')
+
 
 class DataModel:
     '''
-    DataModel provides tools to create model and keeps track of excessive use of graphopper,
-    limiting any further use in the current run
+    DataModel provides tools to create model, matrix providers that are rate limited
+    or failing are skipped while their circuit breaker is open (see circuit_breaker)
     '''
-    def __init__(self, logger):
+    def __init__(self, logger, deadline=None):
         self.logger = logger
-        self.gh_limited = False
+        # Epoch time by which the request being processed should be answered
+        self.deadline = deadline
 
         try:
             self.default_vehicle_profile = os.environ['GH_VEHICLE_PROFILE']
@@ -41,25 +51,36 @@ class DataModel:
     def create_data_model(
         self, stops, typ="distance", done_plan=None, loc_opts=None,
         capacity_opts=None, location_id=None, vehicle_profile=None,
-        vehicle_profile_fallback=None
+        vehicle_profile_fallback=None, call_type='final_match', known_matrices=None,
+        route_info=None
     ):
         '''
         Receives stops, matrix type, fulfilled stops, location settings,
         passenger information (vehicle capacity, picked up passengers), 
-        location id (for error reporting) and vehicle profile and fallback strings
-        and creates matrices (n_stop x n_stop) of cost between all nodes
-        (distance_matrix and time_matrix) and additional calculated data for TSP constraints:
-        - pickups_deliveries: array with pickup and dropoff indexes for each ride
+        location id (for error reporting), vehicle profile and fallback strings,
+        time matrix call type (see credit_budget) and previously known time matrices
+        (each with the coordinates, distances, times and profile of a fetched matrix),
+        the preprocessing of stops and fulfilled stops (see route.index_stops,
+        built here if not given) and creates float32 matrices (n_stop x n_stop)
+        of cost between all nodes (distance_matrix and time_matrix) and additional calculated data for TSP constraints:
+        - stop_types, stop_statuses: int8 code of each node's stop type and status
+        (see route.STOP_TYPE_CODES and route.STOP_STATUS_CODES)
+        - demands: int32 ride, passenger and ada passenger change at each node
+        (picked up rides and passengers for the current location, see route.get_demands)
+        - pickups_deliveries: int32 pickup and dropoff indexes for each ride
         - pickup_dict: dictionary that matches dropoff indexes with pickup indexes
         - lone_dropoffs: array with ride id and dropoff index for those rides already picked-up
         - picked_up_passengers: used seat count for non-ada passengers
         - picked_up_ada_passengers: used seat count for ada passengers
-        - close_nodes: 
+        - close_nodes: int32 pickup, dropoff and close pickup indexes (see route.group_close_nodes)
         - ride_capacity: maximum number of rides that can be picked up without a dropoff
         - passenger_capacity: vehicle capacity for non-ada passengers
         - ada_passenger_capacity: vehicle capacity count for ada passengers
         - keep_first_stop: if first unfulfilled stop is close enough to keep as first action
-        And default data for TSP algorithm:
+        - fetched_matrix: time matrix between the distinct points as fetched,
+        for the known_matrices of later data models (not for the solver)
+        Arrays are only converted to lists and floats as results leave the data model
+        (see route.build_plan). And default data for TSP algorithm:
         - num_vehicles: 1 vehicle per driver
         - depot: index of starting point
         '''
@@ -71,8 +92,12 @@ class DataModel:
 
         data = {}
         data['nodes'] = stops
+        # Matrices are built between distinct points and expanded to every stop
+        unique_stops, point_index = self.__unique_stops(stops)
         if typ == "distance":
-            data['distance_matrix'] = self.__build_distance_matrix(stops)
+            data['distance_matrix'] = np.asarray(
+                self.__build_distance_matrix(unique_stops), dtype=np.float32
+            )
             data['profile'] = 'euclidean_dist'
         else:
             [
@@ -80,25 +105,35 @@ class DataModel:
                 data['time_matrix'],
                 data['profile']
              ] = self.__build_time_matrix(
-                 stops, location_id, vehicle_profile, vehicle_profile_fallback
+                 unique_stops, location_id, vehicle_profile, vehicle_profile_fallback,
+                 loc_opts['matrixProvider'], call_type, loc_opts['routingCreditBudget'],
+                 known_matrices=known_matrices
             )
+            data['distance_matrix'] = np.asarray(data['distance_matrix'], dtype=np.float32)
+            data['time_matrix'] = np.asarray(data['time_matrix'], dtype=np.float32)
+            if data['profile'] != 'euclidean':
+                data['fetched_matrix'] = {
+                    'coordinates': [stop['coordinates'] for stop in unique_stops],
+                    'distances': data['distance_matrix'].copy(),
+                    'times': data['time_matrix'].copy(),
+                    'profile': data['profile']
+                }
+            data['time_matrix'] = self.__expand_matrix(data['time_matrix'], point_index)
+        data['distance_matrix'] = self.__expand_matrix(data['distance_matrix'], point_index)
 
         # Make return to depot instantaneous (prevent TSP cycle)
-        for idx in range(len(data['distance_matrix'])):
-            data['distance_matrix'][idx][0] = 0
+        data['distance_matrix'][:, 0] = 0
 
         # Build data relevant for TSP constraints
-        [
-            data['pickups_deliveries'],
-            data['pickup_dict'],
-            data['lone_dropoffs'],
-            data['picked_up_passengers'],
-            data['picked_up_ada_passengers'],
-        ] = route.group_pickup_deliveries(stops)
+        if route_info is None:
+            route_info = route.index_stops(stops, done_plan)
+        for key in [
+            'stop_types', 'stop_statuses', 'demands', 'pickups_deliveries', 'pickup_dict',
+            'lone_dropoffs', 'picked_up_passengers', 'picked_up_ada_passengers'
+        ]:
+            data[key] = route_info[key]
         if done_plan and len(done_plan) > 0:
-            data['dropoff_stop_limit'] = route.get_stop_limit_for_picked_up(
-                done_plan, data['lone_dropoffs']
-            )
+            data['dropoff_stop_limit'] = route_info['dropoff_stop_limit']
         data['close_nodes'] = route.group_close_nodes(data)
         data['num_vehicles'] = 1
         data['depot'] = 0
@@ -114,149 +149,211 @@ class DataModel:
 
         return data
 
+    def prefetch_time_matrices(
+        self, stop_groups, location_id=None, vehicle_profile=None, vehicle_profile_fallback=None,
+        matrix_provider='graphhopper', credit_budget=0
+    ):
+        '''
+        Receives the stops of several time data models with the same vehicle profiles
+        and fetches the matrix between the distinct points of those with uncached cells
+        in a single request, so their create_data_model calls are served from the matrix cache.
+        Points are added by group up to MATRIX_BATCH_MAX_POINTS,
+        remaining groups fetch their own matrix in create_data_model.
+        Batches are candidate calls of the location's hourly credit_budget
+        '''
+        if not vehicle_profile:
+            vehicle_profile = self.default_vehicle_profile
+        if not vehicle_profile_fallback:
+            vehicle_profile_fallback = self.default_vehicle_profile_fallback
+
+        provider = get_matrix_provider(matrix_provider, location_id)
+        if get_circuit_breaker(provider.name).is_open():
+            return
+        matrix_cache = get_matrix_cache()
+        cache_profile = provider.cache_profile(vehicle_profile)
+        batch_stops = {}
+        batch_groups = 0
+        for stops in stop_groups:
+            coordinates = [stop['coordinates'] for stop in self.__unique_stops(stops)[0]]
+            if not matrix_cache.lookup(coordinates, cache_profile, record_stats=False)[2]:
+                continue
+            new_stops = {
+                coordinate_key(coordinate): {'coordinates': coordinate}
+                for coordinate in coordinates if coordinate_key(coordinate) not in batch_stops
+            }
+            if len(batch_stops) + len(new_stops) > MATRIX_BATCH_MAX_POINTS:
+                continue
+            batch_stops.update(new_stops)
+            batch_groups += 1
+
+        # A single data model fetches its own matrix
+        # and a batch that does not fit in the cache would not be reused
+        if batch_groups < 2 or len(batch_stops) ** 2 > matrix_cache.max_size:
+            return
+        self.__build_time_matrix(
+            list(batch_stops.values()), location_id, vehicle_profile, vehicle_profile_fallback,
+            matrix_provider, 'candidate', credit_budget
+        )
+
+    def __unique_stops(self, stops):
+        '''
+        Returns the stops with distinct points (by coordinate key, see matrix_cache)
+        and the index of each stop's point. Stops of a fixed stop keep their own coordinates,
+        as used by the proximity checks (close nodes, first stop)
+        '''
+        unique_stops = []
+        point_indexes = {}
+        point_index = []
+        for stop in stops:
+            key = coordinate_key(stop['coordinates'])
+            if key not in point_indexes:
+                point_indexes[key] = len(unique_stops)
+                unique_stops += [stop]
+            point_index += [point_indexes[key]]
+        return [unique_stops, point_index]
+
+    def __expand_matrix(self, matrix, point_index):
+        if len(point_index) == len(matrix):
+            return matrix
+        return matrix[np.ix_(point_index, point_index)]
+
     def __build_distance_matrix(self, stops):
-        distance_matrix = list(
-            [
-                [utils.calc_dist(node_a['coordinates'], node_b['coordinates']) for node_b in stops]
-                for node_a in stops
-            ]
+        return utils.calc_dist_matrix(
+            [stop['coordinates'] for stop in stops], mode=DISTANCE_MATRIX_MODE
         )
-        return distance_matrix
+
+    def __fill_known_cells(self, coordinates, dist_matrix, time_matrix, known_matrices, vehicle):
+        # Known matrices are used as fetched, before return to depot is made instantaneous
+        keys = [coordinate_key(coordinate) for coordinate in coordinates]
+        for known in known_matrices or []:
+            if known['profile'] != vehicle:
+                continue
+            known_indexes = {
+                coordinate_key(coordinate): idx
+                for idx, coordinate in enumerate(known['coordinates'])
+            }
+            indexes = [known_indexes.get(key) for key in keys]
+            for row, known_row in enumerate(indexes):
+                if known_row is None:
+                    continue
+                for column, known_column in enumerate(indexes):
+                    if known_column is not None and dist_matrix[row][column] is None:
+                        dist_matrix[row][column] = known['distances'][known_row][known_column]
+                        time_matrix[row][column] = known['times'][known_row][known_column]
 
     def __build_time_matrix(
-            self, stops, location_id, vehicle_profile, vehicle_profile_fallback, try_number=0
+            self, stops, location_id, vehicle_profile, vehicle_profile_fallback,
+            matrix_provider='graphhopper', call_type='final_match', credit_budget=0,
+            try_number=0, known_matrices=None
         ):
         if try_number == 0:
             vehicle = vehicle_profile
         else:
             vehicle = vehicle_profile_fallback
 
-        points = {
-            "from_points": [stop['coordinates'][::-1] for stop in stops],
-            "to_points": [stop['coordinates'][::-1] for stop in stops],
-            "out_arrays": ["times", "distances"],
-            "vehicle": vehicle
-        }
+        rt_matrix = utils.runtime_start(self.logger, 'matrix_id')
 
-        params = {"key": os.environ['GH_API_KEY']}
-        headers = {'Content-type': 'application/json'}
+        # Only cells not fetched recently are requested from the provider
+        provider = get_matrix_provider(matrix_provider, location_id)
+        cache_profile = provider.cache_profile(vehicle)
+        coordinates = [stop['coordinates'] for stop in stops]
+        matrix_cache = get_matrix_cache()
+        dist_matrix, time_matrix, _, _ = matrix_cache.lookup(coordinates, cache_profile)
+        self.__fill_known_cells(coordinates, dist_matrix, time_matrix, known_matrices, vehicle)
 
-        rt_matrix = utils.runtime_start(self.logger, 'matrix_id')
+        # Cells between known points are not requested again
+        blocks = missing_blocks(dist_matrix)
+        if not blocks:
+            utils.runtime_stop(
+                self.logger, rt_matrix,
+                {'mode': "cache", 'vehicle_profile': vehicle, **matrix_cache.stats()}
+            )
+            return dist_matrix, time_matrix, vehicle
 
-        has_graphhoper_key = os.environ['GH_API_KEY'] != ""
-        if has_graphhoper_key and not self.gh_limited:
+        # Calls are skipped while the provider is rate limited or failing
+        # and lower value calls once the location is close to its credit budget
+        breaker = get_circuit_breaker(provider.name)
+        accountant = get_credit_accountant()
+        has_provider = provider.is_available()
+        provider_allowed = (
+            has_provider and accountant.allow(location_id, call_type, credit_budget)
+            and breaker.allow_request()
+        )
+        if provider_allowed:
             try:
-                req = requests.post(
-                    'https://graphhopper.com/api/1/matrix',
-                    headers=headers, json=points, params=params, timeout=30
-                )
-                rt_matrix_stop = utils.runtime_stop(
-                    self.logger, rt_matrix,
-                    {'mode': "gh", 'vehicle_profile': vehicle}
-                )
-                gh_time = rt_matrix_stop['runtime']
-
-                # GRAPHHOPPER REQUEST CREDITS
-                rate_headers = {}
-                if 'X-RateLimit-Limit' in req.headers:
-                    rate_headers['GH_X_RateLimit_Limit'] = req.headers['X-RateLimit-Limit']
-                if 'X-RateLimit-Remaining' in req.headers:
-                    rate_headers['GH_X_RateLimit_Remaining'] = req.headers['X-RateLimit-Remaining']
-                if 'X-RateLimit-Reset' in req.headers:
-                    rate_headers['GH_X_RateLimit_Reset'] = req.headers['X-RateLimit-Reset']
-                if 'X-RateLimit-Credits' in req.headers:
-                    rate_headers['GH_X_RateLimit_Credits'] = req.headers['X-RateLimit-Credits']
-                self.logger.info('GRAPHHOPPER REQUEST CREDITS')
-                self.logger.info(json.dumps(rate_headers))
+                for missing_rows, missing_columns in blocks:
+                    from_points = [coordinates[idx] for idx in missing_rows]
+                    to_points = [coordinates[idx] for idx in missing_columns]
+                    context = {
+                        'location': location_id, 'logger': self.logger, 'deadline': self.deadline,
+                        'allow_hedge': functools.partial(
+                            accountant.allow, location_id, call_type, credit_budget,
+                            record_stats=False
+                        )
+                    }
+                    try:
+                        [distances, times], fetch_stats = get_matrix_coalescer().fetch(
+                            provider, from_points, to_points, vehicle, context,
+                            MATRIX_BATCH_MAX_POINTS
+                        )
+                    finally:
+                        # Answered requests spend credits even if the fetch failed
+                        accountant.record(
+                            location_id, call_type, context.get('credits') or 0,
+                            context.get('credits_remaining')
+                        )
+                    breaker.record_success()
 
-                if req.status_code >= 500:
-                    raise GraphHopperServerError(
-                        req_info="[" + str(req.status_code) + "] " + req.text,
-                        body=points, time=gh_time
-                    )
-                elif req.status_code == 429:
-                    self.gh_limited = True
-                    raise GraphHopperLimitError(
-                        req_info="[" + str(req.status_code) + "] " + req.text,
-                        body=points, time=gh_time
+                    matrix_cache.store(from_points, to_points, cache_profile, distances, times)
+                    get_travel_estimator().calibrate(
+                        location_id, cache_profile, from_points, to_points, distances, times,
+                        mode=DISTANCE_MATRIX_MODE
                     )
+                    for row, from_idx in enumerate(missing_rows):
+                        for column, to_idx in enumerate(missing_columns):
+                            dist_matrix[from_idx][to_idx] = distances[row][column]
+                            time_matrix[from_idx][to_idx] = times[row][column]
 
-                json_response = req.json()
-
-                if req.status_code == 200:
-                    dist_matrix = json_response['distances']
-                    time_matrix = json_response['times']
-                    return dist_matrix, time_matrix, vehicle
-                elif (
-                    (
-                        req.status_code == 400
-                    ) and (
-                        try_number == 0
-                    ) and (
-                        "message" in json_response.keys()
-                    ) and (
-                        "profile" in json_response['message']
-                    )
-                ):
-                    additional_info = {
-                        'status_code': req.status_code,
-                        'message': json_response['message'],
-                        'vehicle': vehicle,
-                        'location': location_id
-                    }
-                    tags = {
-                        'location': location_id,
-                        'vehicle': vehicle
-                    }
-                    message = f"Profile {vehicle} cannot be used with this account"
-                    error = GraphHopperProfileError(message, additional_info, tags)
-                    self.logger.info(error)
-                    utils.handle_exception(error)
-                    return self.__build_time_matrix(
-                        stops, location_id, vehicle_profile, vehicle_profile_fallback, 1
-                    )
-                elif (
-                    (
-                        req.status_code == 400
-                    ) and (
-                        try_number == 0
-                    ) and (
-                        "hints" in json_response.keys()
-                    )
-                ):
-                    location_error_info = {
-                        'status_code': req.status_code,
-                        'message': json_response['message'],
-                        'location': location_id,
-                        'matrix': [stop['coordinates'][::-1] for stop in stops]
-                    }
-                    tags = {
-                        'location': location_id,
-                        'vehicle': vehicle
+                utils.runtime_stop(
+                    self.logger, rt_matrix,
+                    {
+                        'mode': "gh" if provider.name == 'graphhopper' else provider.name,
+                        'vehicle_profile': vehicle,
+                        'requested_cells': sum(
+                            len(missing_rows) * len(missing_columns)
+                            for missing_rows, missing_columns in blocks
+                        ),
+                        'requested_blocks': len(blocks),
+                        'call_type': call_type,
+                        **fetch_stats,
+                        **accountant.stats(location_id),
+                        **matrix_cache.stats(),
+                        **get_http_client().stats()
                     }
-                    self.logger.info(json.dumps(location_error_info))
-                    message = "Could not calculate matrix"
-                    error = GraphHopperMatrixError(message, location_error_info, tags)
-                    self.logger.info(error)
-                    utils.handle_exception(error)
+                )
+                return dist_matrix, time_matrix, vehicle
+            except (GraphHopperProfileError, GraphHopperMatrixError) as error:
+                breaker.record_success()
+                self.logger.info(error)
+                utils.runtime_stop(
+                    self.logger, rt_matrix, {'mode': "exception", 'exception': type(error).__name__}
+                )
+                utils.handle_exception(error)
+                # Try again with the fallback vehicle profile
+                if try_number == 0:
                     return self.__build_time_matrix(
-                        stops, location_id, vehicle_profile, vehicle_profile_fallback, 1
+                        stops, location_id, vehicle_profile, vehicle_profile_fallback,
+                        matrix_provider, call_type, credit_budget, 1, known_matrices
                     )
-                else:
-                    additional_info = {
-                        'status_code': req.status_code,
-                        'text': req.text,
-                        'points': points,
-                        'time': gh_time
-                    }
-                    tags = {
-                        'location': location_id,
-                        'vehicle': vehicle
-                    }
-                    raise GraphHopperDefaultError("Default error", additional_info, tags)
             # pylint: disable=broad-exception-caught
             except Exception as error:
             # pylint: enable=broad-exception-caught
+                if is_provider_failure(error):
+                    breaker.record_failure(
+                        getattr(error, 'reset_at', None), rate_limited=is_rate_limit(error)
+                    )
+                else:
+                    breaker.release()
                 self.logger.info(error)
                 utils.runtime_stop(
                     self.logger, rt_matrix, {'mode': "exception", 'exception': type(error).__name__}
@@ -264,12 +361,29 @@ class DataModel:
                 self.logger.debug(traceback.format_exc())
                 utils.handle_exception(error)
 
-        dist_matrix = self.__build_distance_matrix(stops)
-        m_per_second = 40000 / (60 * 60)
-        estimated_time_matrix = [[cell / m_per_second for cell in line] for line in dist_matrix]
+        # Cells still missing (not cached, known or fetched) are estimated
+        # from road distances and times with the location's calibrated factors
+        estimator = get_travel_estimator()
+        estimated_dist_matrix, estimated_time_matrix = estimator.estimate(
+            location_id, cache_profile, self.__build_distance_matrix(stops)
+        )
+        estimated_cells = 0
+        for row, dist_row in enumerate(dist_matrix):
+            for column, distance in enumerate(dist_row):
+                if distance is None:
+                    estimated_cells += 1
+                else:
+                    estimated_dist_matrix[row][column] = distance
+                    estimated_time_matrix[row][column] = time_matrix[row][column]
 
-        if not has_graphhoper_key or self.gh_limited:
+        if not provider_allowed:
             utils.runtime_stop(
-                self.logger, rt_matrix, {'mode': "euclidean", 'limited': self.gh_limited}
+                self.logger, rt_matrix,
+                {
+                    'mode': "euclidean", 'limited': has_provider, 'call_type': call_type,
+                    'estimated_cells': estimated_cells,
+                    **accountant.stats(location_id), **breaker.stats(),
+                    **estimator.stats(location_id, cache_profile)
+                }
             )
-        return dist_matrix, estimated_time_matrix, 'euclidean'
+        return estimated_dist_matrix, estimated_time_matrix, 'euclidean'
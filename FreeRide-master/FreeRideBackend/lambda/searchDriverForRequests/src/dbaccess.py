@@ -8,7 +8,10 @@ import sentry_sdk
 from pymongo import MongoClient
 from bson.objectid import ObjectId
 from exceptions import DatabaseLocationError
-from validator import valid_boolean, valid_sort_option
+from validator import (
+    valid_boolean, valid_sort_option, valid_search_profile, valid_ranking_engine,
+    valid_matrix_provider
+)
 from utils import runtime_start, runtime_stop
 
 LOCATION_SCHEMA_DEFAULTS = [
@@ -17,13 +20,22 @@ LOCATION_SCHEMA_DEFAULTS = [
     ['inversionRangeFeet', 2300, int],
     ['etaIncreaseLimit', 15, int],
     ['concurrentRideLimit', 3, int],
-    ['fleetEnabled', False, bool]
+    ['fleetEnabled', False, bool],
+    ['distanceSearchProfile', 'default', valid_search_profile],
+    ['timeSearchProfile', 'default', valid_search_profile],
+    ['routeUpdateSearchProfile', 'default', valid_search_profile],
+    ['softConstraintRelaxation', False, bool],
+    ['matrixProvider', 'graphhopper', valid_matrix_provider],
+    ['routingCreditBudget', 0, int]
 ]
 
 SETTINGS_SCHEMA_DEFAULTS = [
     ['driverLimitSort', 'closest', valid_sort_option],
     ['initialDriverLimit', 10, int],
     ['skipDistanceTSP', False, valid_boolean],
+    ['distanceRankingEngine', 'tsp', valid_ranking_engine],
+    ['multiVehicleTSP', False, valid_boolean],
+    ['tieredMatrixStrategy', False, valid_boolean],
     ['finalDriverLimit', 10, int]
 ]
 class DBAccess:
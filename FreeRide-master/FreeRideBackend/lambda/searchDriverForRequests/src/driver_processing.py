@@ -72,6 +72,15 @@ def get_eval(typ, route_info):
                     eta_increases += [(stop["cost"] - stop["initialEta"])]
         return eta_increases
 
+def get_detour(driver):
+    '''
+    Returns the detour (increase in route cost) of a driver plan,
+    or the cost to the first action for drivers without unfulfilled actions
+    '''
+    if sum(driver['old']['total_dist']) == 0:
+        return driver['new']['total_dist'][1]
+    return sum(driver['new']['total_dist']) - sum(driver['old']['total_dist'])
+
 def sort_drivers_by_ride_count(driver_list):
     '''
     Sorts driver list by increasing number of rides associated that are not yet fullfilled
@@ -96,12 +105,7 @@ def sort_drivers(typ, driver_list, location_cancel_time=10):
     '''
     # If typ is distance or time,
     # Sort increasing detour distance
-    cost_list = []
-    for driver in driver_list:
-        if sum(driver['old']['total_dist']) == 0:
-            cost_list += [driver['new']['total_dist'][1]]
-        else:
-            cost_list += [sum(driver['new']['total_dist']) - sum(driver['old']['total_dist'])]
+    cost_list = [get_detour(driver) for driver in driver_list]
 
     ordered_idx = np.argsort(cost_list)
     sorted_drivers = list(np.array(driver_list)[ordered_idx])
@@ -179,9 +183,13 @@ def apply_filter(
     elif typ == "fixed_stop_check":
         if "fixedStopId" not in request_actions[0].keys():
             return True
-        [
-            completed_fixed_stops, to_do_fixed_stops
-        ] = route.split_fixed_stops_by_status(old_plan['full_route'])
+        # Split in the route preprocessing (see route.preprocess_route) when available
+        if 'fixed_stops' in old_plan:
+            completed_fixed_stops, to_do_fixed_stops = old_plan['fixed_stops']
+        else:
+            [
+                completed_fixed_stops, to_do_fixed_stops
+            ] = route.split_fixed_stops_by_status(old_plan['full_route'])
         # If last done fixed-stop is the same as the request's pickup
         if len(completed_fixed_stops) > 0 and (
             completed_fixed_stops[-1] == request_actions[0]["fixedStopId"]
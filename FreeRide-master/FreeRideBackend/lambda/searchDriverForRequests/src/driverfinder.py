@@ -1,13 +1,18 @@
 '''
 The DriverFinder module contains the logic for driver matching and driver routes' ETA update
 '''
+import asyncio
 import copy
-from concurrent import futures
 import numpy as np
 
 from data import DataModel
+from matrix_providers import get_matrix_provider
+from route_state import get_route_state_store
+from travel_estimator import get_travel_estimator, shortlist
 import route
 import driver_processing as drivers
+import insertion
+import multi_vehicle
 import utils
 
 class DriverFinder:
@@ -15,27 +20,41 @@ class DriverFinder:
     DriverFinder class provides two main functions:
     - update_route: refreshes a driver route's action order and ETA
     - find_drivers: matches a request with the optimal driver
+    Both run on an event loop (see update_route_async and find_drivers_async),
+    where database queries and data model builds (with their matrix requests) run
+    on the blocking executor (see utils.run_blocking) and drivers' TSP runs wait
+    on the TSP worker pool concurrently
     '''
-    def __init__(self, db_client, logger):
+    def __init__(self, db_client, logger, deadline=None):
         self.db_client = db_client
         self.logger = logger
         self.location_id = ''
-        self.data_model = DataModel(logger)
+        self.data_model = DataModel(logger, deadline=deadline)
 
     def update_route(self, driver_id, route_stops):
         '''
         Receives a driver id with current actions (route_stops)
-        and returns a route with refreshed action order and ETAs
+        and returns a route with refreshed action order and ETAs.
+        Runs its own event loop for the call, so it cannot be called from a running
+        event loop (asyncio.run raises RuntimeError), use update_route_async there
+        '''
+        return asyncio.run(self.update_route_async(driver_id, route_stops))
+
+    async def update_route_async(self, driver_id, route_stops):
+        '''
+        Same as update_route, for callers running an event loop
         '''
         rt_route = utils.runtime_start(self.logger, 'route_update_id',{'driver_id': str(driver_id)})
 
         # Fetch driver info
-        driver = self.db_client.get_driver_vehicle(driver_id)
+        driver = await utils.run_blocking(self.db_client.get_driver_vehicle, driver_id)
 
         # Fetch active location information
         [longitude, latitude] = driver['currentLocation']['coordinates']
         self.location_id = str(driver['activeLocation'])
-        loc_opts = self.db_client.get_location_info(None, self.location_id)
+        loc_opts = await utils.run_blocking(
+            self.db_client.get_location_info, None, self.location_id
+        )
 
         # Get unfulfilled stops of route
         current_location = {
@@ -48,10 +67,15 @@ class DriverFinder:
             'ADApassengers': 0
         }
 
-        prefix_route, remaining_route, stops = route.get_unfulfilled_stops(
-            route_stops, current_location
-        )
+        route_info = route.preprocess_route(route_stops, current_location)
+        prefix_route, remaining_route, stops = [
+            route_info[key] for key in ['prefix_route', 'remaining_route', 'stops']
+        ]
 
+        # Route state is kept while the driver is online with waiting stops
+        route_states = get_route_state_store()
+        if len(stops) == 1 or not driver.get('isAvailable', True):
+            route_states.evict(driver_id)
         if len(stops) == 1:
             utils.runtime_stop(self.logger, rt_route, {'message': 'Empty route'})
             return {"plan": []}
@@ -64,28 +88,62 @@ class DriverFinder:
         vehicle_profile_fallback = (
             'vehicle_profile_fallback' in driver and driver['vehicle_profile_fallback']
         )
-        data_model = self.data_model.create_data_model(
+        data_model = await utils.run_blocking(
+            self.data_model.create_data_model,
             copy.deepcopy(stops), typ="time", loc_opts=loc_opts,
             done_plan=prefix_route, capacity_opts=capacity_opts,
             location_id=self.location_id, vehicle_profile=vehicle_profile,
-            vehicle_profile_fallback=vehicle_profile_fallback
+            vehicle_profile_fallback=vehicle_profile_fallback, call_type='route_update',
+            known_matrices=route_states.known_matrices(driver_id), route_info=route_info
         )
+        fetched_matrix = data_model.pop('fetched_matrix', None)
+        route_state = 'offline'
+        if driver.get('isAvailable', True):
+            route_state = route_states.update(driver_id, stops[1:], fetched_matrix)
+        data_model['search_profile'] = loc_opts['routeUpdateSearchProfile']
+        data_model['initial_route'] = route.get_initial_route(data_model)
+
+        hailed_passengers = (
+            capacity_opts['hailed_passenger_count'] + capacity_opts['hailed_ada_passenger_count']
+        )
+        soft_relaxation = loc_opts['softConstraintRelaxation']
+        if soft_relaxation:
+            # Constraints relaxed by the retries below are soft instead,
+            # so a single TSP run returns the least relaxed route
+            data_model['soft_constraints'] = []
+            if hailed_passengers:
+                data_model['soft_constraints'] += ['hailed_capacity']
+                data_model['strict_capacity'] = {
+                    'passenger_capacity': data_model['passenger_capacity'],
+                    'ada_passenger_capacity': data_model['ada_passenger_capacity']
+                }
+                [
+                    data_model['passenger_capacity'], data_model['ada_passenger_capacity']
+                ] = utils.build_capacity(utils.extract_capacity(driver, reset_hailed=True))
+            if 'dropoff_stop_limit' in data_model and len(data_model['dropoff_stop_limit']):
+                data_model['soft_constraints'] += ['dropoff_stop_limit']
 
         # Runs TSP algorithm to build new route with updated ETAs
         rt_tsp = utils.runtime_start(
             self.logger, 'tsp_id',
-            {'driver_id': str(driver_id), 'action_count': len(remaining_route)}
+            {
+                'driver_id': str(driver_id), 'action_count': len(remaining_route),
+                'route_state': route_state
+            }
+        )
+        context = {
+            'location': self.location_id, 'logger': self.logger,
+            'deadline': self.data_model.deadline
+        }
+        assignment, new_route, _ = await utils.tsp_handler_async(context, data_model, "time")
+        utils.runtime_stop(
+            self.logger, rt_tsp,
+            {'relaxed_constraints': data_model.get('relaxed_constraints', [])}
         )
-        context = {'location': self.location_id, 'logger': self.logger}
-        assignment, new_route, _ = utils.tsp_handler(context, data_model, "time")
-        utils.runtime_stop(self.logger, rt_tsp)
 
         # If route building failed,
         # try again ignoring hailed rides changes to capacity
-        hailed_passengers = (
-            capacity_opts['hailed_passenger_count'] + capacity_opts['hailed_ada_passenger_count']
-        )
-        if not assignment and hailed_passengers:
+        if not assignment and hailed_passengers and not soft_relaxation:
             # Create matrix and additional data necessary to run TSP algorithm
             # ignoring capacity changes due to current hailed rides
             capacity_opts = utils.extract_capacity(driver, reset_hailed=True)
@@ -98,11 +156,11 @@ class DriverFinder:
                 self.logger, 'tsp_id',
                 {'driver_id': str(driver_id), 'retry': 'Trying without hailed capacity limitation'}
             )
-            assignment, new_route, _ = utils.tsp_handler(context, data_model, "time")
+            assignment, new_route, _ = await utils.tsp_handler_async(context, data_model, "time")
             utils.runtime_stop(self.logger, rt_tsp)
 
         if (
-            not assignment
+            not assignment and not soft_relaxation
             and 'dropoff_stop_limit' in data_model and len(data_model['dropoff_stop_limit'])
         ):
             # Create matrix and additional data necessary to run TSP algorithm
@@ -114,7 +172,7 @@ class DriverFinder:
                 self.logger, 'tsp_id',
                 {'driver_id': str(driver_id), 'retry': 'Trying without hailed capacity limitation'}
             )
-            assignment, new_route, _ = utils.tsp_handler(context, data_model, "time")
+            assignment, new_route, _ = await utils.tsp_handler_async(context, data_model, "time")
             utils.runtime_stop(self.logger, rt_tsp)
 
         if not assignment:
@@ -129,21 +187,33 @@ class DriverFinder:
 
     def find_drivers(self, request_id='5cbbc72cf8143425df68fae1'):
         '''
-        Receives a request id and returns an optimal driver with generated route
+        Receives a request id and returns an optimal driver with generated route.
+        Runs its own event loop for the call, so it cannot be called from a running
+        event loop (asyncio.run raises RuntimeError), use find_drivers_async there
+        '''
+        return asyncio.run(self.find_drivers_async(request_id))
+
+    async def find_drivers_async(self, request_id='5cbbc72cf8143425df68fae1'):
+        '''
+        Same as find_drivers, for callers running an event loop
         '''
         self.logger.info("Finding driver for " + str(request_id))
 
         # Fetch request information
-        request_info = self.db_client.get_request(request_id)
+        request_info = await utils.run_blocking(self.db_client.get_request, request_id)
         request_actions = utils.build_request_actions(request_info)
 
         # Fetch location and global settings configuration
         self.location_id = str(request_info['location'])
-        loc_opts = self.db_client.get_location_info({}, self.location_id)
-        global_opts = self.db_client.get_settings_info()
+        loc_opts, global_opts = await asyncio.gather(
+            utils.run_blocking(self.db_client.get_location_info, {}, self.location_id),
+            utils.run_blocking(self.db_client.get_settings_info)
+        )
 
         # Fetch available drivers
-        available_drivers = self.db_client.get_driver_ride_list(request_info)
+        available_drivers = await utils.run_blocking(
+            self.db_client.get_driver_ride_list, request_info
+        )
         available_drivers = list(filter(drivers.check_waiting_stops_limit, available_drivers))
 
         # Split drivers into buckets by vehicle call order
@@ -185,7 +255,8 @@ class DriverFinder:
             )
 
             # If global settings option for distance TSP is active,
-            # run TSP for drivers to obtain increase in distance (detour)
+            # run TSP (or evaluate request insertion into current routes, as set by
+            # distanceRankingEngine) for drivers to obtain increase in distance (detour)
             # for sorting by increasing detour and limiting number of drivers to evaluate
             if not global_opts['skipDistanceTSP']:
                 ride_count_list = [
@@ -200,12 +271,28 @@ class DriverFinder:
                         'ride_count': ride_count
                     }
                 )
-                # Run TSP using distance and order available drivers by detour distance asc
-                sorted_drivers = self.__tsp(
-                    request_actions, driver_dict, list(driver_dict.keys()),
-                    typ="distance", loc_opts=loc_opts
+                # Order available drivers by detour distance asc
+                if global_opts['distanceRankingEngine'] == 'insertion':
+                    sorted_drivers, detours = insertion.rank_drivers(
+                        request_actions, list(driver_dict.values()), loc_opts,
+                        with_detours=True
+                    )
+                else:
+                    sorted_drivers, detours = await self.__tsp(
+                        request_actions, driver_dict, list(driver_dict.keys()),
+                        typ="distance", loc_opts=loc_opts, with_costs=True
+                    )
+
+                # If global settings option for tiered matrix strategy is active,
+                # only drivers whose estimated road detour is close to the best ones
+                # get a road matrix
+                if global_opts['tieredMatrixStrategy']:
+                    sorted_drivers = self.__shortlist(
+                        sorted_drivers, detours, driver_dict, loc_opts
+                    )
+                utils.runtime_stop(
+                    self.logger, rt_dist_tsp, {'ranked_drivers': len(sorted_drivers)}
                 )
-                utils.runtime_stop(self.logger, rt_dist_tsp)
 
                 if len(sorted_drivers) == 0:
                     bucket_rt = utils.runtime_stop(
@@ -235,9 +322,16 @@ class DriverFinder:
                 }
             )
 
-            best_drivers = self.__tsp(
-                request_actions, ten_dict, ten_pick, typ="time", loc_opts=loc_opts
-            )
+            # If global settings option for multi-vehicle TSP is active,
+            # a single solve with every driver as a vehicle picks the driver
+            if global_opts['multiVehicleTSP']:
+                best_drivers = await self.__multi_vehicle_tsp(
+                    request_actions, ten_dict, ten_pick, loc_opts
+                )
+            else:
+                best_drivers = await self.__tsp(
+                    request_actions, ten_dict, ten_pick, typ="time", loc_opts=loc_opts
+                )
             utils.runtime_stop(self.logger, rt_time_tsp)
 
             if len(best_drivers) == 0:
@@ -273,10 +367,23 @@ class DriverFinder:
         })
         return []
 
-    def __process_driver(self, driver_info, request_actions, typ, loc_opts, pool_id=''):
+    async def __process_driver(
+        self, driver_info, request_actions, typ, loc_opts, pool_id='', call_type='final_match'
+    ):
         rt_process_driver = utils.runtime_start(
             self.logger, 'process_driver_id', {'thread_pool_id': pool_id}
         )
+        driver_model = await self.__build_driver_model_async(
+            driver_info, request_actions, typ, loc_opts, call_type
+        )
+        processed_driver = await self.__solve_driver_model(driver_model, typ)
+        utils.runtime_stop(self.logger, rt_process_driver)
+        return processed_driver
+
+    def __driver_route(self, driver_info):
+        '''
+        Returns a copy of the driver's route stops and its current location stop
+        '''
         current_location = {
             'stopType': "current_location",
             'status': "done",
@@ -295,11 +402,80 @@ class DriverFinder:
             old_route = copy.deepcopy(driver_info['activeRoute']['stops'])
         else:
             old_route = []
+        return [old_route, current_location]
+
+    def __build_driver_stops(self, driver_info, request_actions):
+        old_route, current_location = self.__driver_route(driver_info)
 
         # Build route stops with unfulfilled stops of route and request actions
-        prefix_route, remaining_route, stops = route.get_unfulfilled_stops(
+        # and the constraint data of the driver's data model in a single pass
+        route_info = route.preprocess_route(
             old_route, current_location, request_actions=request_actions
         )
+        return [old_route, route_info]
+
+    def __shortlist(self, driver_ids, detours, driver_dict, loc_opts):
+        '''
+        Returns the drivers sorted by road detour, estimated by the travel estimator
+        calibrated for their location and vehicle profile, that may be close enough
+        to the best drivers given the deviation of the estimates (see travel_estimator.shortlist)
+        '''
+        estimator = get_travel_estimator()
+        estimated_detours = []
+        for driver_id, detour in zip(driver_ids, detours):
+            driver_info = driver_dict[driver_id]
+            vehicle_profile = (
+                'vehicle_profile' in driver_info and driver_info['vehicle_profile']
+            ) or self.data_model.default_vehicle_profile
+            cache_profile = get_matrix_provider(
+                loc_opts['matrixProvider'], self.location_id
+            ).cache_profile(vehicle_profile)
+            estimated_detours += [
+                estimator.estimate_detour(self.location_id, cache_profile, detour)
+            ]
+        return shortlist(driver_ids, estimated_detours)
+
+    def __call_type(self, rank):
+        '''
+        Returns the credit budget call type (see credit_budget) of the time matrix
+        of the driver at rank in the drivers sorted by the distance pass
+        '''
+        return 'final_match' if rank == 0 else 'candidate'
+
+    def __prefetch_matrices(self, request_actions, driver_infos, loc_opts):
+        '''
+        Fetches the time matrices of all drivers with the same vehicle profiles
+        in a single request, so building each driver's data model only slices
+        its matrix from the matrix cache
+        '''
+        stop_groups = {}
+        for driver_info in driver_infos:
+            vehicle_profiles = (
+                'vehicle_profile' in driver_info and driver_info['vehicle_profile'],
+                'vehicle_profile_fallback' in driver_info and driver_info['vehicle_profile_fallback']
+            )
+            # Only the stops are needed, not the constraint data of preprocess_route
+            old_route, current_location = self.__driver_route(driver_info)
+            stops = route.get_unfulfilled_stops(
+                old_route, current_location, request_actions=request_actions
+            )[2]
+            stop_groups.setdefault(vehicle_profiles, []).append(stops)
+
+        for (vehicle_profile, vehicle_profile_fallback), stops_list in stop_groups.items():
+            self.data_model.prefetch_time_matrices(
+                stops_list, location_id=self.location_id, vehicle_profile=vehicle_profile,
+                vehicle_profile_fallback=vehicle_profile_fallback,
+                matrix_provider=loc_opts['matrixProvider'],
+                credit_budget=loc_opts['routingCreditBudget']
+            )
+
+    def __build_driver_model(
+        self, driver_info, request_actions, typ, loc_opts, call_type='final_match'
+    ):
+        old_route, route_info = self.__build_driver_stops(driver_info, request_actions)
+        prefix_route, remaining_route, stops = [
+            route_info[key] for key in ['prefix_route', 'remaining_route', 'stops']
+        ]
 
         # Create matrix and additional data necessary to run TSP algorithm
         capacity_opts = utils.extract_capacity(driver_info)
@@ -307,64 +483,181 @@ class DriverFinder:
         vehicle_profile_fallback = (
             'vehicle_profile_fallback' in driver_info and driver_info['vehicle_profile_fallback']
         )
+        # Time matrices only fetch the cells missing from the driver's route state
+        route_states = get_route_state_store()
+        known_matrices = route_states.known_matrices(driver_info['_id']) if typ == "time" else None
         data_model = self.data_model.create_data_model(
             copy.deepcopy(stops), typ=typ, loc_opts=loc_opts,
             done_plan=prefix_route, capacity_opts=capacity_opts,
             location_id=self.location_id, vehicle_profile=vehicle_profile,
-            vehicle_profile_fallback=vehicle_profile_fallback
+            vehicle_profile_fallback=vehicle_profile_fallback, call_type=call_type,
+            known_matrices=known_matrices, route_info=route_info
+        )
+        # Only the driver's own waiting stops are kept, without the request's pickup and dropoff
+        route_states.update(
+            driver_info['_id'], stops[1:len(stops) - len(request_actions)],
+            data_model.pop('fetched_matrix', None)
         )
+        if typ == "distance":
+            data_model['search_profile'] = loc_opts['distanceSearchProfile']
+        else:
+            data_model['search_profile'] = loc_opts['timeSearchProfile']
+        data_model['initial_route'] = route.get_initial_route(
+            data_model, request_node_count=len(request_actions)
+        )
+        if loc_opts['softConstraintRelaxation']:
+            # Constraints relaxed by the retry in __solve_driver_model are soft instead,
+            # models without them stay plain (and eligible for the exact solver)
+            soft_constraints = []
+            if len(data_model.get('close_nodes', [])) > 0:
+                soft_constraints += ['close_nodes']
+            if data_model.get('keep_first_stop'):
+                soft_constraints += ['keep_first_stop']
+            if soft_constraints:
+                data_model['soft_constraints'] = soft_constraints
+        return [data_model, old_route, remaining_route, prefix_route, driver_info, route_info]
+
+    async def __build_driver_model_async(
+        self, driver_info, request_actions, typ, loc_opts, call_type='final_match'
+    ):
+        # Time models may request their matrix
+        if typ == "time":
+            return await utils.run_blocking(
+                self.__build_driver_model, driver_info, request_actions, typ, loc_opts, call_type
+            )
+        return self.__build_driver_model(driver_info, request_actions, typ, loc_opts)
+
+    async def __solve_driver_model(self, driver_model, typ):
+        data_model, old_route, remaining_route, prefix_route, driver_info, route_info = driver_model
 
         # Run TSP algorithm to build new route with request actions
         rt_tsp = utils.runtime_start(
             self.logger, 'tsp_id',
             {'driver_id': str(driver_info['_id']), 'action_count': len(remaining_route)}
         )
-        context = {'location': self.location_id, 'logger': self.logger}
-        [assignment, new_route, new_route_distances] = utils.tsp_handler(context, data_model, typ)
+        context = {
+            'location': self.location_id, 'logger': self.logger,
+            'deadline': self.data_model.deadline
+        }
+        [assignment, new_route, new_route_distances] = await utils.tsp_handler_async(
+            context, data_model, typ
+        )
         utils.runtime_stop(self.logger, rt_tsp)
 
         # If route building failed, try again
         # without keeping next action even if close (within location's inversionRangeFeet)
-        if not assignment:
+        if not assignment and 'soft_constraints' not in data_model:
             if 'close_nodes' in data_model:
                 del data_model['close_nodes']
             if 'keep_first_stop' in data_model:
                 del data_model['keep_first_stop']
-            assignment, new_route, new_route_distances = utils.tsp_handler(context, data_model, typ)
+            assignment, new_route, new_route_distances = await utils.tsp_handler_async(
+                context, data_model, typ
+            )
 
-        utils.runtime_stop(self.logger, rt_process_driver)
         return [
             data_model, assignment, old_route, remaining_route,
-            new_route, new_route_distances, prefix_route, driver_info
+            new_route, new_route_distances, prefix_route, driver_info, route_info
         ]
 
-    def __tsp(self, request_actions, driver_dict, driver_keys, typ="distance", loc_opts=None):
+    async def __tsp(
+        self, request_actions, driver_dict, driver_keys, typ="distance", loc_opts=None,
+        with_costs=False
+    ):
 
         # Run driver processing concurrently to build route with request actions for each one
         results = []
         rt_pool = utils.runtime_start(
             self.logger, 'thread_pool_id', {'type': typ, 'driver_number': len(driver_keys) }
         )
-        with futures.ThreadPoolExecutor(max_workers=10) as ex:
-            driver_infos = [driver_dict[key] for key in driver_keys]
-            n_drivers = len(driver_infos)
-            results = list(
-                ex.map(
-                    self.__process_driver, driver_infos,
-                    [request_actions] * n_drivers,
-                    [typ] * n_drivers,
-                    [loc_opts] * n_drivers,
-                    [rt_pool['thread_pool_id']] * n_drivers
-                )
+        driver_infos = [driver_dict[key] for key in driver_keys]
+        if typ == "time":
+            await utils.run_blocking(
+                self.__prefetch_matrices, request_actions, driver_infos, loc_opts
+            )
+        results = await asyncio.gather(*[
+            self.__process_driver(
+                driver_info, request_actions, typ, loc_opts, rt_pool['thread_pool_id'],
+                self.__call_type(rank)
             )
+            for rank, driver_info in enumerate(driver_infos)
+        ])
         utils.runtime_stop(self.logger, rt_pool)
 
+        return self.__evaluate_drivers(results, request_actions, typ, loc_opts, with_costs)
+
+    async def __multi_vehicle_tsp(self, request_actions, driver_dict, driver_keys, loc_opts):
+        '''
+        Time TSP for all drivers in a single multi-vehicle solve: the solver picks the driver
+        for the request actions and that driver's route is then solved on its own model,
+        starting from the multi-vehicle route, to apply every driver constraint.
+        If that driver is filtered out or would exceed the cancel time for the new rider,
+        the remaining drivers are solved one by one as in __tsp
+        '''
+        # Build driver data models concurrently
+        rt_pool = utils.runtime_start(
+            self.logger, 'thread_pool_id',
+            {'type': "time", 'driver_number': len(driver_keys), 'multi_vehicle': True}
+        )
+        driver_infos = [driver_dict[key] for key in driver_keys]
+        n_drivers = len(driver_infos)
+        await utils.run_blocking(self.__prefetch_matrices, request_actions, driver_infos, loc_opts)
+        driver_models = await asyncio.gather(*[
+            self.__build_driver_model_async(
+                driver_info, request_actions, "time", loc_opts, self.__call_type(rank)
+            )
+            for rank, driver_info in enumerate(driver_infos)
+        ])
+        utils.runtime_stop(self.logger, rt_pool)
+        if n_drivers == 0:
+            return []
+
+        merged_data_model, node_maps = multi_vehicle.merge_data_models(
+            [driver_model[0] for driver_model in driver_models], len(request_actions)
+        )
+        context = {
+            'location': self.location_id, 'logger': self.logger,
+            'deadline': self.data_model.deadline
+        }
+        rt_tsp = utils.runtime_start(
+            self.logger, 'tsp_id', {'driver_number': n_drivers, 'multi_vehicle': True}
+        )
+        assignment, routes, _ = await utils.tsp_handler_async(
+            context, merged_data_model, "time", search_profile=loc_opts['timeSearchProfile']
+        )
+        utils.runtime_stop(self.logger, rt_tsp)
+
+        results = []
+        remaining_models = driver_models
+        vehicle_id = multi_vehicle.get_request_vehicle(routes, node_maps) if assignment else None
+        if vehicle_id is not None:
+            driver_model = driver_models[vehicle_id]
+            driver_model[0]['initial_route'] = multi_vehicle.get_vehicle_order(
+                routes[vehicle_id], node_maps[vehicle_id]
+            )[1:]
+            results = [await self.__solve_driver_model(driver_model, "time")]
+            best_drivers = self.__evaluate_drivers(results, request_actions, "time", loc_opts)
+            if (
+                len(best_drivers) > 0
+                and drivers.get_eval("new_rider_wait", best_drivers[0]['new'])
+                <= loc_opts['cancelTime'] * 60
+            ):
+                return best_drivers
+            remaining_models = driver_models[:vehicle_id] + driver_models[vehicle_id + 1:]
+
+        self.logger.info("\t>>> Multi-vehicle TSP driver not accepted, solving each driver")
+        results += await asyncio.gather(*[
+            self.__solve_driver_model(driver_model, "time") for driver_model in remaining_models
+        ])
+        return self.__evaluate_drivers(results, request_actions, "time", loc_opts)
+
+    def __evaluate_drivers(self, results, request_actions, typ, loc_opts, with_costs=False):
         # Evaluate each driver
         route_list = []
         for processed_driver in results:
             [
                 data_model, assignment, old_route, remaining_route,
-                new_route, new_route_distances, prefix_route, driver_info
+                new_route, new_route_distances, prefix_route, driver_info, route_info
             ] = processed_driver
 
             # If unable to build route for driver, remove driver from candidates
@@ -386,7 +679,10 @@ class DriverFinder:
                     'old': {
                         'plan': remaining_route,
                         'total_dist': route_distances,
-                        'full_route': old_route
+                        'full_route': old_route,
+                        'fixed_stops': [
+                            route_info['completed_fixed_stops'], route_info['to_do_fixed_stops']
+                        ]
                     },
                     'profile': data_model['profile']
                 })
@@ -426,7 +722,7 @@ class DriverFinder:
                     route_list += [driver_plan]
 
         if len(route_list) == 0:
-            return []
+            return [[], []] if with_costs else []
         else:
             if len(route_list) == 1:
                 sorted_drivers = route_list
@@ -437,5 +733,10 @@ class DriverFinder:
 
         if typ == "time":
             return sorted_drivers
+        elif with_costs:
+            return [
+                [driver['id'] for driver in sorted_drivers],
+                [drivers.get_detour(driver) for driver in sorted_drivers]
+            ]
         else:
             return [driver['id'] for driver in sorted_drivers]
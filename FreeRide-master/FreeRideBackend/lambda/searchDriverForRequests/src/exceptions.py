@@ -6,11 +6,13 @@ contextual information compared to standard exceptions.
 
 class GraphHopperLimitError(Exception):
     """Exception for credit or rate limit errors raised by graphopper call"""
-    def __init__(self, req_info=None, body=None, time=0):
+    def __init__(self, req_info=None, body=None, time=0, reset_at=None):
         super(GraphHopperLimitError, self).__init__(req_info, body, time)
         self.body = body
         self.time = time
         self.req_info = req_info
+        # Epoch time the rate limit resets, if reported by the server
+        self.reset_at = reset_at
 
 class GraphHopperServerError(Exception):
     """Exception for server errors raised by graphopper call"""
@@ -65,3 +67,25 @@ class ExceptionWithContext(Exception):
         self.original_exception = original_exception
         self.additional_info = additional_info
         self.tags = tags
+
+class MatrixProviderError(Exception):
+    """Exception for errors raised by travel matrix providers other than graphhopper"""
+    def __init__(self, message, additional_info=None, tags=None):
+        super().__init__(message)
+        self.additional_info = additional_info
+        self.tags = tags
+
+class RequestBudgetError(Exception):
+    """Exception for calls made after the time budget of the request being processed ran out"""
+    def __init__(self, message, additional_info=None, tags=None):
+        super().__init__(message)
+        self.additional_info = additional_info
+        self.tags = tags
+
+class MatrixBatchError(Exception):
+    """Exception for callers that joined a merged matrix request sent by another caller
+    and failed with a provider failure, which only the sending caller reports"""
+    def __init__(self, message, additional_info=None, tags=None):
+        super().__init__(message)
+        self.additional_info = additional_info
+        self.tags = tags
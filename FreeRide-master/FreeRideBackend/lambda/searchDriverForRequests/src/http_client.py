@@ -0,0 +1,202 @@
+'''
+The HTTP client module keeps a process-wide pool of keep-alive connections
+to the routing engines, so matrix requests from every driver-processing thread
+reuse open connections instead of paying a new TCP and TLS handshake each time
+'''
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+
+from exceptions import RequestBudgetError
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# HTTP/2 of httpx needs the h2 package (httpx[http2])
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+# Same as the driver processing thread pools
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 30
+
+# Seconds the calling thread may wait for a free pooled connection, None waits until one is free
+_POOL_WAIT = threading.local()
+# Raised when no pooled connection is freed within the pool wait
+POOL_TIMEOUT_ERRORS = (EmptyPoolError,) + ((httpx.PoolTimeout,) if httpx is not None else ())
+
+
+class _PoolWaitMixin:
+    def urlopen(self, *args, pool_timeout=None, **kwargs):
+        if pool_timeout is None:
+            pool_timeout = getattr(_POOL_WAIT, 'timeout', None)
+        return super().urlopen(*args, pool_timeout=pool_timeout, **kwargs)
+
+
+class _PoolWaitHTTPConnectionPool(_PoolWaitMixin, HTTPConnectionPool):
+    pass
+
+
+class _PoolWaitHTTPSConnectionPool(_PoolWaitMixin, HTTPSConnectionPool):
+    pass
+
+
+class PoolWaitHTTPAdapter(HTTPAdapter):
+    '''
+    HTTPAdapter whose blocking pools wait for a free connection
+    at most the pool wait set by the calling thread (see HTTPClient.request)
+    '''
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _PoolWaitHTTPConnectionPool, 'https': _PoolWaitHTTPSConnectionPool
+        }
+
+
+class HTTPClient:
+    '''
+    HTTPClient wraps a session with at most pool_size connections per host,
+    HTTP/2 if requested and httpx with h2 is installed (requests otherwise).
+    Calls block while every connection of the host is in use,
+    and their timeouts and wait for a connection are capped by the deadline
+    of the request being processed
+    '''
+    def __init__(
+        self, pool_size=DEFAULT_POOL_SIZE, http2=False,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT
+    ):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http2 = http2 and httpx is not None and h2 is not None
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.request_count = 0
+
+        if self.http2:
+            self.session = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=pool_size, max_keepalive_connections=pool_size
+                )
+            )
+            self.adapter = None
+        else:
+            self.session = requests.Session()
+            self.adapter = PoolWaitHTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True
+            )
+            self.session.mount('https://', self.adapter)
+            self.session.mount('http://', self.adapter)
+
+    def timeouts(self, deadline=None):
+        '''
+        Returns the connect and read timeouts of a call, capped by the seconds left
+        until deadline (epoch time). Raises RequestBudgetError if deadline has passed
+        '''
+        connect_timeout, read_timeout = self.connect_timeout, self.read_timeout
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise RequestBudgetError(
+                    "Request time budget exhausted before HTTP call",
+                    {'exceeded_seconds': -remaining}
+                )
+            connect_timeout = min(connect_timeout, remaining)
+            read_timeout = min(read_timeout, remaining)
+        return [connect_timeout, read_timeout]
+
+    def request(self, method, url, deadline=None, **kwargs):
+        '''
+        Sends a request through the pooled session, timeouts are set from deadline
+        (see timeouts). Returns the response. Raises RequestBudgetError
+        if deadline passes while waiting for a free connection
+        '''
+        connect_timeout, read_timeout = self.timeouts(deadline)
+        pool_timeout = None if deadline is None else max(deadline - time.time(), 0)
+        if self.http2:
+            timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=pool_timeout)
+        else:
+            timeout = (connect_timeout, read_timeout)
+
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.request_count += 1
+        _POOL_WAIT.timeout = pool_timeout
+        try:
+            return self.session.request(method, url, timeout=timeout, **kwargs)
+        except POOL_TIMEOUT_ERRORS as error:
+            raise RequestBudgetError(
+                "Request time budget exhausted waiting for a pooled connection",
+                {'pool_size': self.pool_size}
+            ) from error
+        finally:
+            _POOL_WAIT.timeout = None
+            with self.lock:
+                self.in_flight -= 1
+
+    def get(self, url, deadline=None, **kwargs):
+        '''
+        Sends a GET request (see request)
+        '''
+        return self.request('GET', url, deadline=deadline, **kwargs)
+
+    def post(self, url, deadline=None, **kwargs):
+        '''
+        Sends a POST request (see request)
+        '''
+        return self.request('POST', url, deadline=deadline, **kwargs)
+
+    def stats(self):
+        '''
+        Returns pool utilization: calls in flight (now and at most), calls sent
+        and connections opened since the client was created
+        '''
+        connections = None
+        if self.adapter:
+            pools = self.adapter.poolmanager.pools
+            connections = sum(pools[key].num_connections for key in pools.keys())
+        with self.lock:
+            return {
+                'http_pool_size': self.pool_size,
+                'http_in_flight': self.in_flight,
+                'http_max_in_flight': self.max_in_flight,
+                'http_requests': self.request_count,
+                'http_connections': connections,
+                'http2': self.http2
+            }
+
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_http_client():
+    '''
+    Returns the process-wide HTTP client. Pool size, connect timeout and HTTP/2
+    can be set with the HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT and HTTP2 environment variables
+    '''
+    # pylint: disable=global-statement
+    global _CLIENT
+    # pylint: enable=global-statement
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = HTTPClient(
+                pool_size=max(int(os.environ.get('HTTP_POOL_SIZE', DEFAULT_POOL_SIZE)), 1),
+                http2=os.environ.get('HTTP2', 'false').lower() == 'true',
+                connect_timeout=float(
+                    os.environ.get('HTTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT)
+                )
+            )
+        return _CLIENT
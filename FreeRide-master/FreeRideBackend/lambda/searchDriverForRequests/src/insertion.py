@@ -0,0 +1,162 @@
+'''
+The Insertion module ranks drivers by the detour of inserting the request actions
+into their current routes, evaluating every candidate driver and every pickup/dropoff
+insertion position at once instead of running a TSP per driver
+'''
+import copy
+import numpy as np
+
+from conversion import feetToMeters
+import route
+import utils
+
+
+def build_driver_route(driver_info, loc_opts):
+    '''
+    Receives driver info and location settings and builds
+    the information needed to evaluate insertions for the driver:
+    - coordinates: current location followed by unfulfilled stops, in route order
+    - demands: ride, passenger and ada passenger change at each of those stops
+    (picked up rides and passengers for the current location)
+    - capacity: ride, passenger and ada passenger capacity
+    - keep_first_stop: if first unfulfilled stop is close enough to keep as first action
+    '''
+    current_location = {
+        'stopType': "current_location",
+        'status': "done",
+        'coordinates': driver_info['currentLocation']['coordinates'][::-1],
+        'passengers': 0,
+        'ADApassengers': 0
+    }
+    if (
+        'activeRoute' in driver_info
+        and 'stops' in driver_info['activeRoute']
+        and len(driver_info['activeRoute']['stops']) > 0
+    ):
+        old_route = copy.deepcopy(driver_info['activeRoute']['stops'])
+    else:
+        old_route = []
+    route_info = route.preprocess_route(old_route, current_location)
+    stops = route_info['stops']
+    demands = route_info['demands'].tolist()
+
+    passenger_capacity, ada_passenger_capacity = utils.build_capacity(
+        utils.extract_capacity(driver_info)
+    )
+    coordinates = [stop['coordinates'] for stop in stops]
+    max_first_stop_distance_m = feetToMeters(loc_opts['inversionRangeFeet'])
+    keep_first_stop = (
+        len(stops) > 1
+        and utils.calc_dist(coordinates[0], coordinates[1]) <= max_first_stop_distance_m
+    )
+    return {
+        'id': str(driver_info['_id']),
+        'coordinates': coordinates,
+        'demands': demands,
+        'capacity': [loc_opts['concurrentRideLimit'], passenger_capacity, ada_passenger_capacity],
+        'keep_first_stop': keep_first_stop
+    }
+
+
+def evaluate_insertions(driver_routes, request_actions):
+    '''
+    Receives driver routes (see build_driver_route) and the request pickup and dropoff
+    and returns, for each driver, the smallest detour (increase in route distance)
+    of inserting the pickup and then the dropoff anywhere after the current location,
+    keeping the route within ride, passenger and ada passenger capacity.
+    The detour is infinite when no insertion fits the vehicle.
+    When the driver has no unfulfilled stops the detour is the distance to the pickup,
+    as in driver_processing.sort_drivers
+    '''
+    pickup, dropoff = request_actions
+    n_drivers = len(driver_routes)
+    route_length = max(len(driver_route['coordinates']) for driver_route in driver_routes)
+    lengths = np.array([len(driver_route['coordinates']) for driver_route in driver_routes])
+    positions = np.arange(route_length)
+    valid = positions[None, :] < lengths[:, None]
+
+    # Distances along each route and to the request actions, padded to route_length
+    # (geodesic distances are symmetric)
+    # Routes are padded with their last coordinate, so padded legs are null
+    coordinates = np.zeros((n_drivers, route_length, 2))
+    loads = np.zeros((3, n_drivers, route_length))
+    capacity = np.zeros((3, n_drivers, 1, 1))
+    for driver_idx, driver_route in enumerate(driver_routes):
+        route_coordinates = driver_route['coordinates']
+        coordinates[driver_idx, :len(route_coordinates)] = route_coordinates
+        coordinates[driver_idx, len(route_coordinates):] = route_coordinates[-1]
+        loads[:, driver_idx, :len(route_coordinates)] = np.cumsum(
+            driver_route['demands'], axis=0
+        ).T
+        capacity[:, driver_idx, 0, 0] = driver_route['capacity']
+    legs = np.zeros((n_drivers, route_length))
+    legs[:, :-1] = utils.calc_dist_array(coordinates[:, :-1], coordinates[:, 1:])
+    pickup_distances, dropoff_distances = np.moveaxis(
+        utils.calc_dist_array(
+            coordinates[:, :, None, :],
+            np.array([pickup['coordinates'], dropoff['coordinates']])[None, None, :, :]
+        ), 2, 0
+    )
+    pickup_distances = np.where(valid, pickup_distances, 0)
+    dropoff_distances = np.where(valid, dropoff_distances, 0)
+    pickup_to_dropoff = utils.calc_dist(pickup['coordinates'], dropoff['coordinates'])
+
+    # Position idx + 1 exists in route
+    has_next = positions[None, :] + 1 < lengths[:, None]
+    next_from_pickup = np.where(has_next, np.roll(pickup_distances, -1, axis=1) - legs, 0)
+    next_from_dropoff = np.where(has_next, np.roll(dropoff_distances, -1, axis=1) - legs, 0)
+
+    # Detour of inserting the pickup after position i and the dropoff after position j
+    insert_pickup = pickup_distances + next_from_pickup
+    insert_dropoff = dropoff_distances + next_from_dropoff
+    insert_both = pickup_distances + pickup_to_dropoff + next_from_dropoff
+    same_position = positions[:, None] == positions[None, :]
+    detours = np.where(
+        same_position[None, :, :],
+        insert_both[:, :, None],
+        insert_pickup[:, :, None] + insert_dropoff[:, None, :]
+    )
+
+    # Request passengers are inside the vehicle from position i up to position j
+    request_demand = np.array([1, pickup['passengers'], pickup['ADApassengers']])
+    after_pickup = positions[None, :] >= positions[:, None]
+    segment_loads = np.where(after_pickup[None, None, :, :], loads[:, :, None, :], -np.inf)
+    segment_max_loads = np.maximum.accumulate(segment_loads, axis=3)
+    fits = np.all(
+        segment_max_loads + request_demand[:, None, None, None] <= capacity, axis=0
+    )
+
+    keep_first_stop = np.array([driver_route['keep_first_stop'] for driver_route in driver_routes])
+    first_position = np.where(keep_first_stop, 1, 0)
+    feasible = (
+        fits
+        & after_pickup[None, :, :]
+        & valid[:, :, None] & valid[:, None, :]
+        & (positions[None, :, None] >= first_position[:, None, None])
+    )
+    detours = np.where(feasible, detours, np.inf).reshape(n_drivers, -1).min(axis=1)
+
+    # Without unfulfilled stops (old route distance is 0) drivers are ranked by distance to pickup
+    without_route = legs.sum(axis=1) == 0
+    return np.where(without_route & np.isfinite(detours), pickup_distances[:, 0], detours)
+
+
+def rank_drivers(request_actions, driver_infos, loc_opts, with_detours=False):
+    '''
+    Receives request actions, driver infos and location settings
+    and returns the ids of the drivers that can fit the request,
+    sorted by increasing detour distance (and their detours if with_detours)
+    '''
+    if len(driver_infos) == 0:
+        return [[], []] if with_detours else []
+    driver_routes = [
+        build_driver_route(driver_info, loc_opts) for driver_info in driver_infos
+    ]
+    detours = evaluate_insertions(driver_routes, request_actions)
+    ordered_idx = [
+        idx for idx in np.argsort(detours, kind='stable') if np.isfinite(detours[idx])
+    ]
+    driver_ids = [driver_routes[idx]['id'] for idx in ordered_idx]
+    if with_detours:
+        return [driver_ids, [float(detours[idx]) for idx in ordered_idx]]
+    return driver_ids
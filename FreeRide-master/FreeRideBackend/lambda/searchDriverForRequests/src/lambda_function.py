@@ -1,13 +1,16 @@
+import asyncio
 import os
 import traceback
 import logging
 import json
+import time
 from dotenv import load_dotenv, find_dotenv
 from driverfinder import DriverFinder
 from dbaccess import DBAccess
 import sentry_sdk
 from sentry_sdk.integrations.aws_lambda import AwsLambdaIntegration
 from utils import runtime_start, runtime_stop
+from tsp_pool import get_tsp_pool
 
 load_dotenv(find_dotenv())
 
@@ -38,10 +41,36 @@ def set_log():
 
 LOGGER = set_log()
 DB = DBAccess(LOGGER)
+TSP_POOL = get_tsp_pool()
+# Seconds to answer a request when the invocation context has no remaining time
+REQUEST_TIME_BUDGET = float(os.getenv('REQUEST_TIME_BUDGET', '30'))
+# Seconds kept from the invocation remaining time to send the answer
+RESPONSE_MARGIN = 1
+
+
+def get_deadline(context):
+    '''
+    Returns the epoch time by which the invocation should be answered
+    '''
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        return time.time() + context.get_remaining_time_in_millis() / 1000 - RESPONSE_MARGIN
+    return time.time() + REQUEST_TIME_BUDGET
 
 
 def lambda_handler(event, context):
+    '''
+    Runs async_lambda_handler on a new event loop for the invocation,
+    it cannot be called from a running event loop (use async_lambda_handler there)
+    '''
+    return asyncio.run(async_lambda_handler(event, context))
+
+
+async def async_lambda_handler(event, context):
+    '''
+    Same as lambda_handler, for runtimes running an event loop
+    '''
     try:
+        deadline = get_deadline(context)
         body = json.loads(event['body'])
 
         input_json = "-- DATA RECEIVED: {}, {} --".format(body, context)
@@ -49,11 +78,15 @@ def lambda_handler(event, context):
 
         if 'request_id' in body.keys():
             rt_total = runtime_start(LOGGER, 'driver_finder_total')
-            result = DriverFinder(DB, LOGGER).find_drivers(request_id=body['request_id'])
+            result = await DriverFinder(DB, LOGGER, deadline=deadline).find_drivers_async(
+                request_id=body['request_id']
+            )
             runtime_stop(LOGGER, rt_total, {})
         elif 'driver_id' in body.keys() and 'route_stops' in body.keys():
             rt_total = runtime_start(LOGGER, 'route_update_total')
-            result = DriverFinder(DB, LOGGER).update_route(body['driver_id'], body['route_stops'])
+            result = await DriverFinder(DB, LOGGER, deadline=deadline).update_route_async(
+                body['driver_id'], body['route_stops']
+            )
             runtime_stop(LOGGER, rt_total, {})
         else:
             result = None
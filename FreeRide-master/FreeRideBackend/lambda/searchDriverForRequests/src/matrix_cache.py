@@ -0,0 +1,181 @@
+'''
+The Matrix Cache module keeps travel distances and times between coordinates
+fetched from GraphHopper, so matrices only request the cells that were not
+fetched recently for the same vehicle profile and time of day
+'''
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 200000
+DEFAULT_CACHE_TTL_SECONDS = 600
+DEFAULT_BUCKET_MINUTES = 15
+# Coordinates closer than ~0.1 meters share cache cells
+COORDINATE_DECIMALS = 6
+
+
+def coordinate_key(coordinates):
+    '''
+    Returns the hashable cache key of [latitude, longitude] coordinates
+    '''
+    return (
+        round(float(coordinates[0]), COORDINATE_DECIMALS),
+        round(float(coordinates[1]), COORDINATE_DECIMALS)
+    )
+
+
+def time_bucket(now, bucket_seconds):
+    '''
+    Returns the time-of-day bucket of a unix timestamp
+    '''
+    return int(now % (24 * 60 * 60) // bucket_seconds)
+
+
+def missing_blocks(matrix):
+    '''
+    Returns the [rows, columns] rectangles to fetch the None cells of a matrix:
+    the bounding rectangle of the missing cells or, if it has fewer cells,
+    the rows missing every missing column and the bounding rectangle
+    of the other rows' missing cells (new points added to known points)
+    '''
+    missing = [
+        [column for column, cell in enumerate(line) if cell is None] for line in matrix
+    ]
+    rows = [row for row, columns in enumerate(missing) if columns]
+    if not rows:
+        return []
+    columns = sorted({column for row in rows for column in missing[row]})
+
+    full_rows = [row for row in rows if len(missing[row]) == len(columns)]
+    other_rows = [row for row in rows if len(missing[row]) < len(columns)]
+    other_columns = sorted({column for row in other_rows for column in missing[row]})
+    if (
+        other_rows and full_rows
+        and len(full_rows) * len(columns) + len(other_rows) * len(other_columns)
+        < len(rows) * len(columns)
+    ):
+        return [[full_rows, columns], [other_rows, other_columns]]
+    return [[rows, columns]]
+
+
+class MatrixCache:
+    '''
+    MatrixCache stores (distance, time) cells keyed by origin and destination
+    coordinates, vehicle profile and time-of-day bucket.
+    Cells expire after ttl seconds and the least recently used cells
+    are evicted once max_size cells are stored
+    '''
+    def __init__(
+        self, max_size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL_SECONDS,
+        bucket_minutes=DEFAULT_BUCKET_MINUTES
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.bucket_seconds = bucket_minutes * 60
+        self.cells = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __bucket(self, now):
+        return time_bucket(now, self.bucket_seconds)
+
+    def lookup(self, coordinates, vehicle, now=None, record_stats=True):
+        '''
+        Looks up the n x n matrices between coordinates for vehicle
+        (counting hits and misses if record_stats) and returns:
+        - distances and times: matrices with None in cells not found
+        - missing_rows: indexes of coordinates with a missing cell from them
+        - missing_columns: indexes of coordinates with a missing cell
+        from any of the missing rows, so missing_rows x missing_columns
+        is the smallest rectangle covering every missing cell
+        '''
+        now = time.time() if now is None else now
+        bucket = self.__bucket(now)
+        keys = [coordinate_key(coordinate) for coordinate in coordinates]
+        n_nodes = len(keys)
+        distances = [[None] * n_nodes for _ in range(n_nodes)]
+        times = [[None] * n_nodes for _ in range(n_nodes)]
+        missing_rows = []
+        missing_columns = set()
+
+        with self.lock:
+            for from_idx, from_key in enumerate(keys):
+                row_missing = False
+                for to_idx, to_key in enumerate(keys):
+                    cell_key = (from_key, to_key, vehicle, bucket)
+                    cell = self.cells.get(cell_key)
+                    if cell and now - cell[2] <= self.ttl:
+                        self.cells.move_to_end(cell_key)
+                        distances[from_idx][to_idx], times[from_idx][to_idx], _ = cell
+                        if record_stats:
+                            self.hits += 1
+                    else:
+                        if cell:
+                            del self.cells[cell_key]
+                        row_missing = True
+                        missing_columns.add(to_idx)
+                        if record_stats:
+                            self.misses += 1
+                if row_missing:
+                    missing_rows += [from_idx]
+
+        return [distances, times, missing_rows, sorted(missing_columns)]
+
+    def store(self, from_coordinates, to_coordinates, vehicle, distances, times, now=None):
+        '''
+        Stores the distances and times matrices from each of from_coordinates
+        to each of to_coordinates for vehicle
+        '''
+        now = time.time() if now is None else now
+        bucket = self.__bucket(now)
+        from_keys = [coordinate_key(coordinate) for coordinate in from_coordinates]
+        to_keys = [coordinate_key(coordinate) for coordinate in to_coordinates]
+
+        with self.lock:
+            for from_key, distance_line, time_line in zip(from_keys, distances, times):
+                for to_key, distance, travel_time in zip(to_keys, distance_line, time_line):
+                    cell_key = (from_key, to_key, vehicle, bucket)
+                    self.cells[cell_key] = (distance, travel_time, now)
+                    self.cells.move_to_end(cell_key)
+            while len(self.cells) > self.max_size:
+                self.cells.popitem(last=False)
+
+    def stats(self):
+        '''
+        Returns cell hit and miss counts since the cache was created
+        '''
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'cache_hits': self.hits,
+                'cache_misses': self.misses,
+                'cache_hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+                'cache_size': len(self.cells)
+            }
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_matrix_cache():
+    '''
+    Returns the process-wide matrix cache, kept between invocations of a warm process.
+    Size, cell lifetime and time-of-day bucket length can be set with the
+    MATRIX_CACHE_SIZE, MATRIX_CACHE_TTL and MATRIX_CACHE_BUCKET_MINUTES environment variables
+    '''
+    # pylint: disable=global-statement
+    global _CACHE
+    # pylint: enable=global-statement
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = MatrixCache(
+                max_size=int(os.environ.get('MATRIX_CACHE_SIZE', DEFAULT_CACHE_SIZE)),
+                ttl=int(os.environ.get('MATRIX_CACHE_TTL', DEFAULT_CACHE_TTL_SECONDS)),
+                bucket_minutes=int(
+                    os.environ.get('MATRIX_CACHE_BUCKET_MINUTES', DEFAULT_BUCKET_MINUTES)
+                )
+            )
+        return _CACHE
@@ -0,0 +1,197 @@
+'''
+The Matrix Coalescer module merges the matrix requests that threads of the process
+send for the same provider and vehicle profile within a short window into a single request,
+each caller gets its own slice of the merged matrix.
+A merged request is the rectangle between all origins and all destinations, so it also
+fetches (and pays credits for) the cells between points of different callers,
+and its first caller waits the window for others to join. Both only happen while
+another request for the same provider and vehicle profile is in flight
+'''
+import os
+import threading
+import time
+
+from circuit_breaker import is_provider_failure
+from exceptions import MatrixBatchError
+from matrix_cache import coordinate_key
+from matrix_fetch import fetch_matrix
+
+DEFAULT_WINDOW_MS = 5
+
+
+class MatrixBatch:
+    '''
+    MatrixBatch collects the distinct origin and destination points of merged requests
+    '''
+    def __init__(self):
+        self.from_points = {}
+        self.to_points = {}
+        self.deadlines = []
+        self.callers = 0
+        self.cells = 0
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Credits context (credits, credits_remaining) of the merged request
+        self.credits = {}
+
+    def fits(self, from_points, to_points, max_points):
+        '''
+        Checks if adding from_points and to_points keeps the batch within max_points distinct points
+        '''
+        keys = set(self.from_points) | set(self.to_points)
+        keys.update(coordinate_key(point) for point in from_points + to_points)
+        return len(keys) <= max_points
+
+    def add(self, from_points, to_points, deadline):
+        '''
+        Adds a request's points and returns the batch rows and columns of its points
+        '''
+        self.callers += 1
+        self.cells += len(from_points) * len(to_points)
+        if deadline is not None:
+            self.deadlines += [deadline]
+        rows = [
+            self.from_points.setdefault(coordinate_key(point), len(self.from_points))
+            for point in from_points
+        ]
+        columns = [
+            self.to_points.setdefault(coordinate_key(point), len(self.to_points))
+            for point in to_points
+        ]
+        return [rows, columns]
+
+    def caller_credits(self, cells):
+        '''
+        Returns the credits context of a caller with cells requested cells,
+        the merged request's credits are split by the cells each caller requested
+        '''
+        caller_credits = dict(self.credits)
+        if caller_credits.get('credits') is not None and self.cells:
+            caller_credits['credits'] = caller_credits['credits'] * cells / self.cells
+        return caller_credits
+
+
+class MatrixCoalescer:
+    '''
+    MatrixCoalescer batches concurrent requests by provider and vehicle profile.
+    A request is sent right away if no other request for its provider and vehicle profile
+    is in flight, else it starts or joins a batch: the first request of a batch waits
+    window seconds for others to join, up to max_points distinct points,
+    and fetches the merged matrix for every caller
+    '''
+    def __init__(self, window=DEFAULT_WINDOW_MS / 1000):
+        self.window = window
+        self.batches = {}
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def fetch(self, provider, from_points, to_points, vehicle, context, max_points):
+        '''
+        Same as matrix_fetch.fetch_matrix, adding the number of merged requests
+        to the fetch stats. Credits of a merged request are split between the contexts
+        of its callers by the cells each one requested. Provider failures are raised
+        to the request that started the batch, other callers get a MatrixBatchError
+        instead, so the failure is reported once
+        '''
+        if not self.window or not provider.remote:
+            matrix, stats = fetch_matrix(provider, from_points, to_points, vehicle, context)
+            return [matrix, {**stats, 'coalesced_requests': 1}]
+
+        key = (provider.name, vehicle)
+        with self.lock:
+            batch = self.batches.get(key)
+            # Nothing to merge with, the request is sent without waiting
+            alone = batch is None and not self.in_flight.get(key)
+            leader = not alone and (
+                batch is None or not batch.fits(from_points, to_points, max_points)
+            )
+            if alone or leader:
+                self.in_flight[key] = self.in_flight.get(key, 0) + 1
+            if leader:
+                batch = MatrixBatch()
+                self.batches[key] = batch
+            if not alone:
+                rows, columns = batch.add(from_points, to_points, context.get('deadline'))
+
+        if alone:
+            try:
+                matrix, stats = fetch_matrix(provider, from_points, to_points, vehicle, context)
+            finally:
+                self.__done(key)
+            return [matrix, {**stats, 'coalesced_requests': 1}]
+
+        if leader:
+            time.sleep(self.window)
+            with self.lock:
+                if self.batches.get(key) is batch:
+                    del self.batches[key]
+            batch_context = {
+                **context, 'deadline': min(batch.deadlines) if batch.deadlines else None
+            }
+            try:
+                # Points are stored in insertion order, matching their batch indexes
+                batch.result = fetch_matrix(
+                    provider, [list(point) for point in batch.from_points],
+                    [list(point) for point in batch.to_points], vehicle, batch_context
+                )
+            # pylint: disable=broad-exception-caught
+            except Exception as error:
+            # pylint: enable=broad-exception-caught
+                batch.error = error
+            finally:
+                batch.credits = {
+                    name: batch_context[name] for name in ('credits', 'credits_remaining')
+                    if name in batch_context
+                }
+                self.__done(key)
+                batch.done.set()
+            context.update(batch.caller_credits(len(rows) * len(columns)))
+            if batch.error:
+                raise batch.error
+        else:
+            batch.done.wait()
+            context.update(batch.caller_credits(len(rows) * len(columns)))
+            if batch.error and is_provider_failure(batch.error):
+                raise MatrixBatchError(
+                    f'Merged matrix request failed: {batch.error}',
+                    additional_info={'error': type(batch.error).__name__},
+                    tags={'provider': provider.name}
+                ) from batch.error
+            if batch.error:
+                raise batch.error
+
+        [distances, times], stats = batch.result
+        return [
+            [
+                [[distances[row][column] for column in columns] for row in rows],
+                [[times[row][column] for column in columns] for row in rows]
+            ],
+            {**stats, 'coalesced_requests': batch.callers}
+        ]
+
+    def __done(self, key):
+        with self.lock:
+            self.in_flight[key] -= 1
+            if not self.in_flight[key]:
+                del self.in_flight[key]
+
+
+_COALESCER = None
+_COALESCER_LOCK = threading.Lock()
+
+
+def get_matrix_coalescer():
+    '''
+    Returns the process-wide matrix coalescer. The window to collect requests can be set
+    with the MATRIX_COALESCE_WINDOW_MS environment variable, 0 disables coalescing
+    '''
+    # pylint: disable=global-statement
+    global _COALESCER
+    # pylint: enable=global-statement
+    with _COALESCER_LOCK:
+        if _COALESCER is None:
+            _COALESCER = MatrixCoalescer(
+                window=float(os.environ.get('MATRIX_COALESCE_WINDOW_MS', DEFAULT_WINDOW_MS)) / 1000
+            )
+        return _COALESCER
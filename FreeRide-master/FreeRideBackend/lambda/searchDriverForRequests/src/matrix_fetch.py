@@ -0,0 +1,192 @@
+'''
+The Matrix Fetch module sends matrix requests to remote providers with retries and hedging:
+- transient failures (server and connection errors, timeouts) are retried with jittered backoff
+- a duplicate request is sent when a request takes longer than a latency percentile
+of the provider's recent requests, and the first answer is used
+Both stay within the deadline of the request being processed
+'''
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent import futures
+
+from circuit_breaker import is_provider_failure, is_rate_limit
+from http_client import get_http_client
+
+# Percentile of recent latencies after which a request is hedged, 0 disables hedging
+HEDGE_PERCENTILE = float(os.environ.get('MATRIX_HEDGE_PERCENTILE', 95))
+# Retries of a request failing with a transient error
+MATRIX_RETRIES = int(os.environ.get('MATRIX_RETRIES', 2))
+# Seconds of the first retry backoff, doubled on each retry
+MATRIX_RETRY_BACKOFF = float(os.environ.get('MATRIX_RETRY_BACKOFF', 0.2))
+# Recent latencies kept for each provider and least needed to hedge
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+
+
+class LatencyTracker:
+    '''
+    LatencyTracker keeps the latencies of the most recent successful requests of each provider
+    '''
+    def __init__(self, window=LATENCY_WINDOW, min_samples=LATENCY_MIN_SAMPLES):
+        self.window = window
+        self.min_samples = min_samples
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, latency):
+        '''
+        Records the latency of a successful request of provider name
+        '''
+        with self.lock:
+            self.latencies.setdefault(name, deque(maxlen=self.window)).append(latency)
+
+    def percentile(self, name, percentile):
+        '''
+        Returns the latency percentile of provider name,
+        None until min_samples requests were recorded
+        '''
+        with self.lock:
+            latencies = sorted(self.latencies.get(name, []))
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(int(len(latencies) * percentile / 100), len(latencies) - 1)]
+
+
+_TRACKER = LatencyTracker()
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_latency_tracker():
+    '''
+    Returns the process-wide latency tracker
+    '''
+    return _TRACKER
+
+
+def _get_executor():
+    # pylint: disable=global-statement
+    global _EXECUTOR
+    # pylint: enable=global-statement
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            # Room for a hedge of every pooled connection
+            _EXECUTOR = futures.ThreadPoolExecutor(
+                max_workers=2 * get_http_client().pool_size, thread_name_prefix='matrix'
+            )
+        return _EXECUTOR
+
+
+def _remaining(deadline):
+    return None if deadline is None else deadline - time.time()
+
+
+def _send(provider, from_points, to_points, vehicle, request_context):
+    start = time.time()
+    matrix = provider.get_matrix(from_points, to_points, vehicle, request_context)
+    _TRACKER.record(provider.name, time.time() - start)
+    return [matrix, request_context]
+
+
+def _submit(requests, provider, from_points, to_points, vehicle, context):
+    # Each request reports its own credits
+    request_context = dict(context)
+    future = _get_executor().submit(
+        _send, provider, from_points, to_points, vehicle, request_context
+    )
+    requests += [(future, request_context)]
+    return future
+
+
+def _spent_credits(requests, answer_credits):
+    # Requests still in flight are billed as the answered one once they get their answer
+    credits = 0
+    for future, request_context in requests:
+        if request_context.get('credits') is not None:
+            credits += request_context['credits']
+        elif not future.done():
+            credits += answer_credits or 0
+    return credits
+
+
+def _hedged_request(provider, from_points, to_points, vehicle, context, stats, requests):
+    deadline = context.get('deadline')
+    pending = {_submit(requests, provider, from_points, to_points, vehicle, context)}
+
+    hedge_delay = (
+        _TRACKER.percentile(provider.name, HEDGE_PERCENTILE) if HEDGE_PERCENTILE else None
+    )
+    if hedge_delay is not None:
+        remaining = _remaining(deadline)
+        done, pending = futures.wait(
+            pending, timeout=hedge_delay if remaining is None else min(hedge_delay, remaining)
+        )
+        # The duplicate request spends credits too, it is only sent within the credit budget
+        allow_hedge = context.get('allow_hedge')
+        if (
+            not done and (remaining is None or remaining > hedge_delay)
+            and (allow_hedge is None or allow_hedge())
+        ):
+            pending.add(_submit(requests, provider, from_points, to_points, vehicle, context))
+            stats['hedged_requests'] += 1
+        pending |= done
+
+    # First answer wins, an error is only raised if no request answers
+    error = None
+    while pending:
+        done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+        for future in done:
+            try:
+                return future.result()
+            # pylint: disable=broad-exception-caught
+            except Exception as future_error:
+            # pylint: enable=broad-exception-caught
+                error = future_error
+    raise error
+
+
+def fetch_matrix(provider, from_points, to_points, vehicle, context):
+    '''
+    Returns the distances and times matrices of provider.get_matrix and the fetch stats
+    (retries and hedged requests). Remote requests are hedged and retried
+    until context's deadline, errors of the last attempt are raised.
+    Context's credits are set to the credits of every request that got an answer
+    (including failed attempts and hedged duplicates) and its credits_remaining
+    from the request that answered. A hedged duplicate is only sent if
+    context's allow_hedge (optional) returns True
+    '''
+    stats = {'retries': 0, 'hedged_requests': 0}
+    if not provider.remote:
+        return [provider.get_matrix(from_points, to_points, vehicle, context), stats]
+
+    deadline = context.get('deadline')
+    requests = []
+    for attempt in range(MATRIX_RETRIES + 1):
+        try:
+            matrix, request_context = _hedged_request(
+                provider, from_points, to_points, vehicle, context, stats, requests
+            )
+            context.update(request_context)
+            context['credits'] = _spent_credits(requests, request_context.get('credits'))
+            return [matrix, stats]
+        # pylint: disable=broad-exception-caught
+        except Exception as error:
+        # pylint: enable=broad-exception-caught
+            if (
+                attempt == MATRIX_RETRIES
+                or not is_provider_failure(error) or is_rate_limit(error)
+            ):
+                context['credits'] = _spent_credits(requests, None)
+                raise
+            # Full jitter backoff, unless it would not leave time for another attempt
+            backoff = random.uniform(0, MATRIX_RETRY_BACKOFF * 2 ** attempt)
+            remaining = _remaining(deadline)
+            if remaining is not None and remaining <= backoff:
+                context['credits'] = _spent_credits(requests, None)
+                raise
+            time.sleep(backoff)
+            stats['retries'] += 1
+    return None
@@ -0,0 +1,364 @@
+'''
+The Matrix Providers module defines the travel matrix sources a location can use
+(see the matrixProvider location setting). Every provider answers many-to-many
+distance (meters) and time (seconds) queries between [latitude, longitude] points:
+- graphhopper: GraphHopper matrix API, hosted or any compatible self-hosted endpoint
+- osrm: OSRM table service of a self-hosted server
+- local_graph: road graph of the location's service area loaded from disk
+and solved in-process, without any network request
+'''
+import os
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+import numpy as np
+
+from exceptions import (
+    GraphHopperServerError, GraphHopperLimitError, GraphHopperDefaultError,
+    GraphHopperProfileError, GraphHopperMatrixError, MatrixProviderError
+)
+from http_client import get_http_client
+import utils
+
+GH_MATRIX_URL = 'https://graphhopper.com/api/1/matrix'
+MATRIX_PROVIDERS = ['graphhopper', 'osrm', 'local_graph']
+# Speed used to estimate time between a point and its closest road graph node
+SNAP_M_PER_SECOND = 40000 / (60 * 60)
+
+
+class MatrixProvider(ABC):
+    '''
+    MatrixProvider is the interface of travel matrix sources
+    '''
+    name = None
+    # Remote providers' requests are retried and hedged (see matrix_fetch)
+    remote = True
+
+    @abstractmethod
+    def is_available(self):
+        '''
+        Checks if the provider is configured to answer queries
+        '''
+
+    def cache_profile(self, vehicle):
+        '''
+        Returns the profile key of vehicle's matrix cells in the matrix cache
+        '''
+        return f'{self.name}:{vehicle}'
+
+    @abstractmethod
+    def get_matrix(self, from_points, to_points, vehicle, context):
+        '''
+        Returns the distances and times matrices from each of from_points to each of to_points
+        for vehicle, context has the location id (for error reporting), logger
+        and deadline (epoch time) of the request being processed.
+        Providers that report routing credits set context's credits spent by the call
+        and credits_remaining in the account.
+        Raises an exception if the matrix can not be built
+        '''
+
+
+class GraphHopperProvider(MatrixProvider):
+    '''
+    GraphHopperProvider requests matrices from the GraphHopper matrix API.
+    GH_MATRIX_URL points it to a self-hosted compatible endpoint, where GH_API_KEY is optional
+    '''
+    name = 'graphhopper'
+
+    def __init__(self):
+        self.url = os.environ.get('GH_MATRIX_URL', GH_MATRIX_URL)
+        self.api_key = os.environ.get('GH_API_KEY', '')
+
+    def is_available(self):
+        return self.api_key != '' or self.url != GH_MATRIX_URL
+
+    def cache_profile(self, vehicle):
+        return vehicle
+
+    def __header_number(self, headers, header):
+        try:
+            return float(headers[header])
+        except (KeyError, ValueError):
+            return None
+
+    def __reset_time(self, headers):
+        # Both headers are seconds from now
+        for header in ('X-RateLimit-Reset', 'Retry-After'):
+            seconds = self.__header_number(headers, header)
+            if seconds is not None:
+                return time.time() + seconds
+        return None
+
+    def get_matrix(self, from_points, to_points, vehicle, context):
+        logger = context['logger']
+        location_id = context['location']
+        points = {
+            "from_points": [point[::-1] for point in from_points],
+            "to_points": [point[::-1] for point in to_points],
+            "out_arrays": ["times", "distances"],
+            "vehicle": vehicle
+        }
+        params = {"key": self.api_key} if self.api_key else {}
+        headers = {'Content-type': 'application/json'}
+
+        start = time.time()
+        req = get_http_client().post(
+            self.url, deadline=context.get('deadline'),
+            headers=headers, json=points, params=params
+        )
+        gh_time = time.time() - start
+
+        # GRAPHHOPPER REQUEST CREDITS
+        rate_headers = {}
+        if 'X-RateLimit-Limit' in req.headers:
+            rate_headers['GH_X_RateLimit_Limit'] = req.headers['X-RateLimit-Limit']
+        if 'X-RateLimit-Remaining' in req.headers:
+            rate_headers['GH_X_RateLimit_Remaining'] = req.headers['X-RateLimit-Remaining']
+        if 'X-RateLimit-Reset' in req.headers:
+            rate_headers['GH_X_RateLimit_Reset'] = req.headers['X-RateLimit-Reset']
+        if 'X-RateLimit-Credits' in req.headers:
+            rate_headers['GH_X_RateLimit_Credits'] = req.headers['X-RateLimit-Credits']
+        logger.info('GRAPHHOPPER REQUEST CREDITS')
+        logger.info(json.dumps(rate_headers))
+        context['credits'] = self.__header_number(req.headers, 'X-RateLimit-Credits')
+        context['credits_remaining'] = self.__header_number(req.headers, 'X-RateLimit-Remaining')
+
+        if req.status_code >= 500:
+            # Rate limit headers tell when credits reset, not when the server recovers
+            raise GraphHopperServerError(
+                req_info="[" + str(req.status_code) + "] " + req.text,
+                body=points, time=gh_time
+            )
+        if req.status_code == 429:
+            raise GraphHopperLimitError(
+                req_info="[" + str(req.status_code) + "] " + req.text,
+                body=points, time=gh_time, reset_at=self.__reset_time(req.headers)
+            )
+
+        json_response = req.json()
+        tags = {
+            'location': location_id,
+            'vehicle': vehicle
+        }
+
+        if req.status_code == 200:
+            return [json_response['distances'], json_response['times']]
+        if req.status_code == 400 and "profile" in json_response.get('message', ''):
+            additional_info = {
+                'status_code': req.status_code,
+                'message': json_response['message'],
+                'vehicle': vehicle,
+                'location': location_id
+            }
+            message = f"Profile {vehicle} cannot be used with this account"
+            raise GraphHopperProfileError(message, additional_info, tags)
+        if req.status_code == 400 and "hints" in json_response:
+            location_error_info = {
+                'status_code': req.status_code,
+                'message': json_response['message'],
+                'location': location_id,
+                'matrix': points['from_points']
+            }
+            logger.info(json.dumps(location_error_info))
+            raise GraphHopperMatrixError("Could not calculate matrix", location_error_info, tags)
+
+        additional_info = {
+            'status_code': req.status_code,
+            'text': req.text,
+            'points': points,
+            'time': gh_time
+        }
+        raise GraphHopperDefaultError("Default error", additional_info, tags)
+
+
+class OSRMProvider(MatrixProvider):
+    '''
+    OSRMProvider requests matrices from the table service of the OSRM server at OSRM_URL,
+    the vehicle profile is used as the OSRM profile
+    '''
+    name = 'osrm'
+
+    def __init__(self):
+        self.url = os.environ.get('OSRM_URL', '').rstrip('/')
+
+    def is_available(self):
+        return self.url != ''
+
+    def get_matrix(self, from_points, to_points, vehicle, context):
+        points = from_points + to_points
+        coordinates = ';'.join(f'{point[1]},{point[0]}' for point in points)
+        params = {
+            'sources': ';'.join(str(idx) for idx in range(len(from_points))),
+            'destinations': ';'.join(
+                str(idx) for idx in range(len(from_points), len(points))
+            ),
+            'annotations': 'distance,duration'
+        }
+        req = get_http_client().get(
+            f'{self.url}/table/v1/{vehicle}/{coordinates}',
+            deadline=context.get('deadline'), params=params
+        )
+        json_response = req.json() if req.status_code < 500 else {}
+
+        distances = json_response.get('distances')
+        times = json_response.get('durations')
+        # Unroutable cells are null
+        if (
+            req.status_code != 200 or json_response.get('code') != 'Ok'
+            or any(cell is None for line in distances + times for cell in line)
+        ):
+            additional_info = {
+                'status_code': req.status_code,
+                'text': req.text,
+                'points': points
+            }
+            tags = {'location': context['location'], 'vehicle': vehicle}
+            raise MatrixProviderError("Could not calculate OSRM matrix", additional_info, tags)
+        return [distances, times]
+
+
+class LocalGraphProvider(MatrixProvider):
+    '''
+    LocalGraphProvider answers matrix queries on the road graph of a location's service area,
+    a ROAD_GRAPH_DIR/<location_id>.npz file with the preprocessed graph arrays:
+    - coordinates: (n, 2) [latitude, longitude] of each graph node
+    - edges: (m, 2) from and to node indexes of each directed road segment
+    - distances and times: (m,) meters and seconds to travel each segment
+    Routes are the fastest path between the graph nodes closest to each point,
+    plus the straight line between each point and its node.
+    scipy is only imported once a road graph is used
+    '''
+    name = 'local_graph'
+    remote = False
+
+    def __init__(self, location_id):
+        self.path = os.path.join(os.environ.get('ROAD_GRAPH_DIR', ''), f'{location_id}.npz')
+        self.graph = None
+        self.lock = threading.Lock()
+
+    def is_available(self):
+        return os.path.isfile(self.path)
+
+    def __load(self):
+        # pylint: disable=import-outside-toplevel
+        from scipy.sparse import csr_matrix
+        # pylint: enable=import-outside-toplevel
+        with self.lock:
+            if self.graph is None:
+                graph_file = np.load(self.path)
+                coordinates = graph_file['coordinates'].astype(np.float64)
+                edges = graph_file['edges'].astype(np.int64)
+                n_nodes = len(coordinates)
+
+                # Parallel segments would be summed by the sparse matrix, keep the fastest one
+                order = np.lexsort((graph_file['times'], edges[:, 1], edges[:, 0]))
+                edges = edges[order]
+                first = np.ones(len(edges), dtype=bool)
+                first[1:] = np.any(edges[1:] != edges[:-1], axis=1)
+                edges = edges[first]
+                times = graph_file['times'][order][first].astype(np.float64)
+                distances = graph_file['distances'][order][first].astype(np.float64)
+
+                self.graph = {
+                    'coordinates': coordinates,
+                    # Zero-time segments would be dropped as missing edges
+                    'times': csr_matrix(
+                        (np.maximum(times, 1e-6), (edges[:, 0], edges[:, 1])),
+                        shape=(n_nodes, n_nodes)
+                    ),
+                    'distances': {
+                        (from_node, to_node): distance
+                        for (from_node, to_node), distance
+                        in zip(edges.tolist(), distances.tolist())
+                    }
+                }
+        return self.graph
+
+    def __closest_nodes(self, graph, points):
+        points = np.asarray(points, dtype=np.float64)
+        coordinates = graph['coordinates']
+        # Equirectangular distance is enough to compare nodes of a service area
+        lat_scale = np.cos(np.radians(points[:, :1]))
+        squared_distances = (
+            (coordinates[:, 0][None, :] - points[:, :1]) ** 2
+            + ((coordinates[:, 1][None, :] - points[:, 1:]) * lat_scale) ** 2
+        )
+        return np.argmin(squared_distances, axis=1).tolist()
+
+    def __path_distance(self, graph, predecessors, source, target, known):
+        path = []
+        node = target
+        while node != source and node not in known:
+            path += [node]
+            node = int(predecessors[node])
+        distance = known.get(node, 0)
+        for child in reversed(path):
+            distance += graph['distances'][(int(predecessors[child]), child)]
+            known[child] = distance
+        return distance
+
+    def get_matrix(self, from_points, to_points, vehicle, context):
+        # pylint: disable=import-outside-toplevel
+        from scipy.sparse.csgraph import dijkstra
+        # pylint: enable=import-outside-toplevel
+        graph = self.__load()
+        from_nodes = self.__closest_nodes(graph, from_points)
+        to_nodes = self.__closest_nodes(graph, to_points)
+        snap_distances = {
+            tuple(point): utils.calc_dist(point, graph['coordinates'][node].tolist())
+            for point, node in zip(from_points + to_points, from_nodes + to_nodes)
+        }
+
+        sources = sorted(set(from_nodes))
+        source_times, predecessors = dijkstra(
+            graph['times'], indices=sources, return_predecessors=True
+        )
+        source_rows = {source: row for row, source in enumerate(sources)}
+
+        distances = [[0] * len(to_points) for _ in from_points]
+        times = [[0] * len(to_points) for _ in from_points]
+        for from_idx, (from_point, from_node) in enumerate(zip(from_points, from_nodes)):
+            row = source_rows[from_node]
+            known = {}
+            for to_idx, (to_point, to_node) in enumerate(zip(to_points, to_nodes)):
+                if from_node == to_node:
+                    distance = utils.calc_dist(from_point, to_point)
+                    distances[from_idx][to_idx] = distance
+                    times[from_idx][to_idx] = distance / SNAP_M_PER_SECOND
+                    continue
+                if np.isinf(source_times[row][to_node]):
+                    additional_info = {'from_point': from_point, 'to_point': to_point}
+                    tags = {'location': context['location'], 'vehicle': vehicle}
+                    raise MatrixProviderError(
+                        "Points are not connected in the road graph", additional_info, tags
+                    )
+                snap_distance = snap_distances[tuple(from_point)] + snap_distances[tuple(to_point)]
+                distances[from_idx][to_idx] = snap_distance + self.__path_distance(
+                    graph, predecessors[row], from_node, to_node, known
+                )
+                times[from_idx][to_idx] = (
+                    snap_distance / SNAP_M_PER_SECOND + float(source_times[row][to_node])
+                )
+        return [distances, times]
+
+
+_PROVIDERS = {}
+_PROVIDERS_LOCK = threading.Lock()
+
+
+def get_matrix_provider(name, location_id=None):
+    '''
+    Returns the process-wide provider called name (see MATRIX_PROVIDERS),
+    local road graphs are kept for each location
+    '''
+    key = (name, location_id if name == 'local_graph' else None)
+    with _PROVIDERS_LOCK:
+        if key not in _PROVIDERS:
+            if name == 'osrm':
+                _PROVIDERS[key] = OSRMProvider()
+            elif name == 'local_graph':
+                _PROVIDERS[key] = LocalGraphProvider(location_id)
+            else:
+                _PROVIDERS[key] = GraphHopperProvider()
+        return _PROVIDERS[key]
@@ -0,0 +1,137 @@
+'''
+The Multi Vehicle module merges the data models built for each candidate driver
+into a single TSP data model with one vehicle per driver, where each driver's stops
+are pinned to its vehicle and the request actions can go to any vehicle
+'''
+import numpy as np
+
+# Distance between stops of different drivers, above the TSP maximum travel distance
+UNREACHABLE_DISTANCE = 30001
+
+
+def merge_data_models(data_models, request_node_count):
+    '''
+    Receives driver data models (each ending with the same request_node_count request nodes)
+    and builds:
+    - merged data model: each driver's nodes (current location first) followed by
+    the request nodes once, with a vehicle for each driver (see TSP.solve_vehicles).
+    Distances between request nodes are taken from the first driver's model and
+    close nodes involving request nodes are left out, as they only apply to one vehicle
+    - node_maps: for each driver, the merged node index of each of its model's nodes
+    '''
+    own_counts = [len(data_model['nodes']) - request_node_count for data_model in data_models]
+    node_count = sum(own_counts) + request_node_count
+    request_nodes = list(range(node_count - request_node_count, node_count))
+
+    nodes = []
+    node_maps = []
+    for data_model, own_count in zip(data_models, own_counts):
+        node_maps += [list(range(len(nodes), len(nodes) + own_count)) + request_nodes]
+        nodes += data_model['nodes'][:own_count]
+    nodes += data_models[0]['nodes'][own_counts[0]:]
+
+    distance_matrix = np.full((node_count, node_count), UNREACHABLE_DISTANCE, dtype=np.float64)
+    # Reversed so request node distances of the first driver are kept
+    for data_model, node_map in reversed(list(zip(data_models, node_maps))):
+        distance_matrix[np.ix_(node_map, node_map)] = data_model['distance_matrix']
+
+    pickups_deliveries = []
+    close_nodes = []
+    vehicles = []
+    for data_model, node_map, own_count in zip(data_models, node_maps, own_counts):
+        model_node_map = np.array(node_map)
+        for pickup, dropoff in np.asarray(data_model['pickups_deliveries']).reshape(-1, 2):
+            pair = [node_map[pickup], node_map[dropoff]]
+            if pair not in pickups_deliveries:
+                pickups_deliveries += [pair]
+
+        # Rides with a request node among their close nodes are left out
+        close = np.asarray(data_model.get('close_nodes', []), dtype=np.int64).reshape(-1, 3)
+        request_rides = close[(close >= own_count).any(axis=1), 1]
+        close = close[~np.isin(close[:, 1], request_rides)]
+        close_nodes += [np.where(close == -1, -1, model_node_map[close])]
+
+        vehicles += [{
+            'start': node_map[0],
+            'first_stop': node_map[1],
+            'nodes': node_map[1:own_count],
+            'lone_dropoff_count': len(data_model['lone_dropoffs']),
+            'picked_up_passengers': data_model['picked_up_passengers'],
+            'picked_up_ada_passengers': data_model['picked_up_ada_passengers'],
+            'ride_capacity': data_model['ride_capacity'],
+            'passenger_capacity': data_model['passenger_capacity'],
+            'ada_passenger_capacity': data_model['ada_passenger_capacity'],
+            # Without stops of its own the first stop would be a request action
+            'keep_first_stop': own_count > 1 and data_model.get('keep_first_stop', False),
+            'dropoff_stop_limit': {
+                ride_id: [node_map[dropoff], limit]
+                for ride_id, (dropoff, limit) in data_model.get('dropoff_stop_limit', {}).items()
+            }
+        }]
+
+    merged_data_model = {
+        'initial_routes': get_initial_routes(data_models, node_maps, own_counts),
+        'nodes': nodes,
+        'distance_matrix': distance_matrix,
+        'pickups_deliveries': np.array(pickups_deliveries, dtype=np.int32).reshape(-1, 2),
+        'close_nodes': np.concatenate(close_nodes).astype(np.int32),
+        'vehicles': vehicles,
+        'num_vehicles': len(vehicles),
+        'profile': data_models[0]['profile']
+    }
+    return [merged_data_model, node_maps]
+
+
+def get_initial_routes(data_models, node_maps, own_counts):
+    '''
+    Builds the starting routes for the multi-vehicle TSP (merged node indexes
+    without vehicle starts): each driver keeps its current stop order and the request
+    actions go to the driver with the smallest increase in route distance when inserted
+    in its initial route (see route.get_initial_route).
+    Returns None if no driver has an initial route with the request actions
+    '''
+    initial_routes = [node_map[1:own_count] for node_map, own_count in zip(node_maps, own_counts)]
+    best_vehicle, best_detour = None, None
+    for vehicle_id, data_model in enumerate(data_models):
+        if not data_model.get('initial_route'):
+            continue
+        distances = data_model['distance_matrix']
+        current_order = [0] + list(range(1, own_counts[vehicle_id]))
+        new_order = [0] + data_model['initial_route']
+        detour = (
+            sum(distances[from_node][to_node] for from_node, to_node in zip(new_order, new_order[1:]))
+            - sum(
+                distances[from_node][to_node]
+                for from_node, to_node in zip(current_order, current_order[1:])
+            )
+        )
+        if best_detour is None or detour < best_detour:
+            best_vehicle, best_detour = vehicle_id, detour
+    if best_vehicle is None:
+        return None
+
+    node_map = node_maps[best_vehicle]
+    initial_routes[best_vehicle] = [
+        node_map[node] for node in data_models[best_vehicle]['initial_route']
+    ]
+    return initial_routes
+
+
+def get_request_vehicle(routes, node_maps):
+    '''
+    Returns the index of the vehicle (driver) whose route has the request actions
+    '''
+    request_node = node_maps[0][-1]
+    for vehicle_id, vehicle_route in enumerate(routes):
+        if request_node in vehicle_route:
+            return vehicle_id
+    return None
+
+
+def get_vehicle_order(vehicle_route, node_map):
+    '''
+    Translates a vehicle route (merged node indexes) into the order
+    of node indexes of the driver's own data model
+    '''
+    local_nodes = {node: idx for idx, node in enumerate(node_map)}
+    return [local_nodes[node] for node in vehicle_route]
@@ -3,57 +3,79 @@ The Route module provides processing and analysis of driver routes
 for route sorting, data model building and driver evaluation
 '''
 import copy
+from datetime import timezone, timedelta, datetime
+import numpy as np
 
-def get_pickup_idx(dropoff_idx, pickup_dict):
+# Integer codes of stop types and statuses in data models, -1 for any other value
+STOP_TYPE_CODES = {'current_location': 0, 'pickup': 1, 'dropoff': 2}
+STOP_STATUS_CODES = {'waiting': 0, 'done': 1, 'cancelled': 2}
+UNKNOWN_CODE = -1
+# Pickups within this distance of a dropoff are close nodes of its ride
+MAX_CLOSE_STOP_DISTANCE_M = 30
+
+def encode_stops(stops):
     '''
-    Receives a dropoff index and the pickup dictionary in order to find
-    the pickup index from the route that corresponds to the given dropoff index
+    Receives route stops and builds:
+    - stop_types: stop type code of each stop (see STOP_TYPE_CODES)
+    - stop_statuses: status code of each stop (see STOP_STATUS_CODES)
+    - demands: ride, passenger and ada passenger change at each stop,
+    positive for pickups and negative for dropoffs
     '''
-    pickup_idx = -1
-    if dropoff_idx in pickup_dict.keys():
-        pickup_idx = pickup_dict[dropoff_idx]
-    return pickup_idx
+    stop_types = np.array([
+        STOP_TYPE_CODES.get(stop['stopType'], UNKNOWN_CODE) for stop in stops
+    ], dtype=np.int8)
+    stop_statuses = np.array([
+        STOP_STATUS_CODES.get(stop.get('status'), UNKNOWN_CODE) for stop in stops
+    ], dtype=np.int8)
+    signs = (
+        (stop_types == STOP_TYPE_CODES['pickup']).astype(np.int32)
+        - (stop_types == STOP_TYPE_CODES['dropoff']).astype(np.int32)
+    )
+    demands = np.array([
+        [1, stop.get('passengers', 0), stop.get('ADApassengers', 0)] for stop in stops
+    ], dtype=np.int32).reshape(-1, 3) * signs[:, None]
+    return [stop_types, stop_statuses, demands]
 
-def get_close_pickup_stops(ride_indexes, distance_matrix_line, stops):
+def get_demands(data):
     '''
-    Groups pickup stops that are within 30 meters of each other
+    Returns the demands of the data model nodes (see encode_stops), with the
+    picked up rides and passengers as demand of the current location.
+    Built from the nodes for data models without demands
     '''
-    max_close_stop_distance_m = 30
-    close_nodes = []
-    for stop_idx, distance in enumerate(distance_matrix_line):
-        # Is neither the current location (0) of driver
-        # nor the pickup or dropoff of the ride (ride_indexes)
-        if stop_idx in [0, *ride_indexes]:
-            continue
-        if stops[stop_idx]['stopType'] == 'pickup' and distance <= max_close_stop_distance_m:
-            close_nodes += [stop_idx]
-    return close_nodes
+    if 'demands' in data:
+        return data['demands']
+    demands = encode_stops(data['nodes'])[2]
+    demands[0] = [
+        len(data['lone_dropoffs']), data['picked_up_passengers'], data['picked_up_ada_passengers']
+    ]
+    return demands
 
 def group_close_nodes(data):
     '''
-    Create a list of rides from the dropoff actions with:
-    - pickup: index of pickup in route
+    Finds the pickups that are within MAX_CLOSE_STOP_DISTANCE_M meters of each dropoff
+    and builds an array with a [pickup, dropoff, close_node] row for each of them:
+    - pickup: index of the ride's pickup in route, -1 for already picked up rides
     - dropoff: index of dropoff in route
-    - close_nodes: indexes of other pickup actions that are within 30 meters of the dropoff
-    '''
-    close_nodes_list = []
-    stops = data['nodes']
-    for dropoff_idx, stop in enumerate(data['nodes']):
-        if stop['stopType'] == 'dropoff':
-            pickup_idx = get_pickup_idx(dropoff_idx, data['pickup_dict'])
-            ride_indexes = [pickup_idx, dropoff_idx]
-            distance_matrix_line = data['distance_matrix'][dropoff_idx]
-            close_nodes = get_close_pickup_stops(
-                ride_indexes, distance_matrix_line, stops
-            )
-            has_close_stops = len(close_nodes) > 0
-            if has_close_stops:
-                close_nodes_list += [{
-                    'pickup': pickup_idx,
-                    'dropoff': dropoff_idx,
-                    'close_nodes': close_nodes
-                }]
-    return close_nodes_list
+    - close_node: index of another pickup action (neither the current location nor the ride's)
+    Rows are sorted by dropoff and close node
+    '''
+    stop_types = data['stop_types'] if 'stop_types' in data else encode_stops(data['nodes'])[0]
+    dropoffs = np.flatnonzero(stop_types == STOP_TYPE_CODES['dropoff'])
+    pickups = np.array(
+        [data['pickup_dict'].get(int(dropoff), -1) for dropoff in dropoffs], dtype=np.int64
+    )
+
+    rides = np.arange(len(dropoffs))
+    close = np.asarray(data['distance_matrix'])[dropoffs] <= MAX_CLOSE_STOP_DISTANCE_M
+    close &= (stop_types == STOP_TYPE_CODES['pickup'])[None, :]
+    close[:, 0] = False
+    close[rides, dropoffs] = False
+    close[rides[pickups >= 0], pickups[pickups >= 0]] = False
+
+    ride_rows, close_nodes = np.nonzero(close)
+    return np.column_stack(
+        [pickups[ride_rows], dropoffs[ride_rows], close_nodes]
+    ).astype(np.int32).reshape(-1, 3)
 
 def group_pickup_deliveries(stops, active_rides=None):
     '''
@@ -190,6 +212,268 @@ def get_unfulfilled_stops(route_, current_location, request_actions=None):
 
     return [prefix_route, remaining_route, stops]
 
+def index_stops(stops, done_plan=None):
+    '''
+    Receives data model stops (current location first) and fulfilled stops (done_plan)
+    and builds, in a single pass over each with rides indexed by id:
+    - stop_types, stop_statuses: see encode_stops
+    - demands: see encode_stops, with the picked up rides and passengers
+    as demand of the current location (see get_demands)
+    - pickups_deliveries (as an array), pickup_dict, lone_dropoffs, picked_up_passengers,
+    picked_up_ada_passengers: see group_pickup_deliveries
+    - dropoff_stop_limit: see get_stop_limit_for_picked_up
+    Close nodes need the distance matrix and are built by group_close_nodes
+    '''
+    stop_types = np.empty(len(stops), dtype=np.int8)
+    stop_statuses = np.empty(len(stops), dtype=np.int8)
+    demands = np.zeros((len(stops), 3), dtype=np.int32)
+    rides = {}
+    for idx, stop in enumerate(stops):
+        stop_type = stop['stopType']
+        stop_types[idx] = STOP_TYPE_CODES.get(stop_type, UNKNOWN_CODE)
+        stop_statuses[idx] = STOP_STATUS_CODES.get(stop.get('status'), UNKNOWN_CODE)
+        sign = 1 if stop_type == 'pickup' else -1 if stop_type == 'dropoff' else 0
+        if sign == 0:
+            continue
+        demands[idx] = [sign, sign * stop.get('passengers', 0), sign * stop.get('ADApassengers', 0)]
+        if 'ride' in stop:
+            ride_id = str(stop['ride'])
+        elif 'request_id' in stop:
+            ride_id = str(stop['request_id'])
+        else:
+            continue
+        ride = rides.setdefault(ride_id, {})
+        ride[stop_type] = idx
+        ride['passengers'] = stop['passengers']
+        ride['ADApassengers'] = stop['ADApassengers']
+
+    pickups_deliveries = []
+    pickup_dict = {}
+    lone_dropoffs = []
+    picked_up_passengers = 0
+    picked_up_ada_passengers = 0
+    for ride_id, ride in rides.items():
+        if 'pickup' in ride and 'dropoff' in ride:
+            pickups_deliveries += [[ride['pickup'], ride['dropoff']]]
+            pickup_dict[ride['dropoff']] = ride['pickup']
+        elif 'pickup' not in ride:
+            lone_dropoffs += [[ride_id, ride['dropoff']]]
+            picked_up_passengers += ride['passengers']
+            picked_up_ada_passengers += ride['ADApassengers']
+    if len(stops) > 0:
+        demands[0] = [len(lone_dropoffs), picked_up_passengers, picked_up_ada_passengers]
+
+    return {
+        'stop_types': stop_types,
+        'stop_statuses': stop_statuses,
+        'demands': demands,
+        'pickups_deliveries': np.array(pickups_deliveries, dtype=np.int32).reshape(-1, 2),
+        'pickup_dict': pickup_dict,
+        'lone_dropoffs': lone_dropoffs,
+        'picked_up_passengers': picked_up_passengers,
+        'picked_up_ada_passengers': picked_up_ada_passengers,
+        'dropoff_stop_limit': _get_stop_limits(done_plan or [], lone_dropoffs)
+    }
+
+def _get_stop_limits(done_plan, lone_dropoffs):
+    # Same limits as get_stop_limit_for_picked_up: each fixed-stop / stop done
+    # while a ride is inside the vehicle lowers its limit, unless it is a stop of the ride.
+    # Counts of all and of each ride's stops when its pickup was done give them in one pass
+    dropoff_indexes = dict(lone_dropoffs)
+    dropoff_limit = {}
+    pickup_counts = {}
+    ride_counts = {}
+    stop_count = 0
+    curr_fs = False
+    for stop in done_plan:
+        if stop['stopType'] == "current_location":
+            continue
+        ride_id = str(stop.get('ride'))
+        if stop['stopType'] == "dropoff" and ride_id in pickup_counts:
+            start_count, start_ride_count = pickup_counts.pop(ride_id)
+            dropoff_limit[ride_id][1] -= (
+                (stop_count - start_count) - (ride_counts[ride_id] - start_ride_count)
+            )
+
+        is_fs = 'fixedStopId' in stop
+        same_fs = is_fs and stop['fixedStopId'] == curr_fs
+        if stop['status'] == "done" and (not is_fs or not same_fs):
+            stop_count += 1
+            ride_counts[ride_id] = ride_counts.get(ride_id, 0) + 1
+
+        if (
+            stop['stopType'] == "pickup"
+            and ride_id in dropoff_indexes and ride_id not in dropoff_limit
+        ):
+            # At most 2 fixed-stops / stops before dropoff
+            dropoff_limit[ride_id] = [dropoff_indexes[ride_id], 3]
+            pickup_counts[ride_id] = (stop_count, ride_counts.get(ride_id, 0))
+        curr_fs = 'fixedStopId' in stop and stop['fixedStopId']
+
+    # Rides still inside the vehicle
+    for ride_id, (start_count, start_ride_count) in pickup_counts.items():
+        dropoff_limit[ride_id][1] -= (
+            (stop_count - start_count) - (ride_counts.get(ride_id, 0) - start_ride_count)
+        )
+    return dropoff_limit
+
+def preprocess_route(route_, current_location, request_actions=None):
+    '''
+    Single pass preprocessing of a driver's route for its data model and the post-solve
+    filters, giving the same results as the separate helpers:
+    - prefix_route, remaining_route, stops: see get_unfulfilled_stops
+    (route ids are converted to strings in place, as in sort_completed_stops)
+    - completed_fixed_stops, to_do_fixed_stops: see split_fixed_stops_by_status
+    - every item of index_stops for stops, with prefix_route as fulfilled stops
+    '''
+    stops_done = []
+    stops_todo = []
+    first_waiting = None
+    completed_fixed_stops = []
+    to_do_fixed_stops = []
+    for stop in route_:
+        for key in ['_id', 'ride', 'request_id', 'fixedStopId']:
+            if key in stop:
+                stop[key] = str(stop[key])
+        status = stop['status']
+        if stop['stopType'] != "current_location" and status in ["done", "waiting"]:
+            fixed_stops = completed_fixed_stops if status == "done" else to_do_fixed_stops
+            if "fixedStopId" in stop:
+                fixed_stops += [stop['fixedStopId']]
+            elif "ride" in stop:
+                fixed_stops += [stop['ride']]
+
+        if status in ["done", "cancelled"]:
+            stops_done += [copy.deepcopy(stop)]
+        else:
+            if first_waiting is None and status == "waiting":
+                first_waiting = len(stops_todo)
+            stops_todo += [copy.deepcopy(stop)]
+
+    prefix_route = []
+    sufix_route = []
+    remaining_route = []
+    if first_waiting is not None:
+        prefix_route = stops_done + stops_todo[:first_waiting]
+        sufix_route = stops_todo[first_waiting:]
+        remaining_route = [current_location] + sufix_route
+    stops = [current_location] + sufix_route + (request_actions or [])
+
+    return {
+        'prefix_route': prefix_route,
+        'remaining_route': remaining_route,
+        'stops': stops,
+        'completed_fixed_stops': completed_fixed_stops,
+        'to_do_fixed_stops': to_do_fixed_stops,
+        **index_stops(stops, prefix_route)
+    }
+
+def build_plan(data, order, typ):
+    '''
+    Receives the data model, the order of node indexes visited by the driver
+    (starting with the current location) and the matrix type used (typ) and builds:
+    - plan: copies of the visited nodes with the distance from the previous node as cost
+    for distance type, or with the distance from the previous node as distance and
+    the estimated arrival timestamp as cost for time type
+    - route_distance: distance from the previous node for each node
+    '''
+    start_time = datetime.utcnow().replace(tzinfo=timezone.utc)
+    plan = []
+    route_distance = [0]
+    current_time_span = 0
+    for position, node in enumerate(order):
+        plan += [dict(data['nodes'][node])]
+        # Matrix cells are converted to floats as the plan leaves the data model
+        if position > 0:
+            previous_node = order[position - 1]
+            route_distance += [float(data['distance_matrix'][previous_node][node])]
+        if typ == "distance":
+            plan[-1]['cost'] = route_distance[-1]
+        else:
+            plan[-1]['distance'] = route_distance[-1]
+            if position > 0:
+                current_time_span += float(data['time_matrix'][previous_node][node])
+            plan[-1]['cost'] = (start_time + timedelta(seconds=current_time_span)).timestamp()
+    return [plan, route_distance]
+
+def fits_capacity(data, order):
+    '''
+    Checks if visiting nodes in order (without the current location)
+    keeps rides, passengers and ada passengers inside the vehicle within capacity
+    '''
+    if len(order) == 0:
+        return True
+    demands = get_demands(data)
+    # Rides and passengers inside the vehicle before visiting each node
+    loads = np.cumsum(np.vstack([demands[0], demands[order[:-1]]]), axis=0)
+    capacity = [data['ride_capacity'], data['passenger_capacity'], data['ada_passenger_capacity']]
+    return bool((loads <= capacity).all())
+
+def fits_stop_limits(data, order):
+    '''
+    Checks if visiting nodes in order (without the current location) keeps
+    the fixed-stop / stop limits of the TSP: at most 2 fixed-stops / stops within a ride
+    and the dropoff stop limits of already picked up rides
+    '''
+    fixed_stop_ids = [node.get('fixedStopId') for node in data['nodes']]
+    fs_order = {}
+    fs_count = 0
+    path = [0] + order
+    for idx in range(1, len(path)):
+        from_fs, to_fs = fixed_stop_ids[path[idx - 1]], fixed_stop_ids[path[idx]]
+        fs_count += 0 if from_fs is not None and from_fs == to_fs else 1
+        fs_order[path[idx]] = fs_count
+
+    for pickup, dropoff in data['pickups_deliveries']:
+        if fs_order[dropoff] - fs_order[pickup] > 3:
+            return False
+
+    last_dropoff = None
+    # Sorted by increasing margin
+    for dropoff, limit in sorted(data.get('dropoff_stop_limit', {}).values(), key=lambda x: x[1]):
+        if limit <= 1:
+            if last_dropoff is None and order[0] != dropoff:
+                return False
+            if last_dropoff is not None and fs_order[dropoff] - fs_order[last_dropoff] > 1:
+                return False
+            last_dropoff = dropoff
+        elif fs_order[dropoff] > limit:
+            return False
+    return True
+
+def get_initial_route(data, request_node_count=0):
+    '''
+    Builds a starting route for TSP (node indexes without the current location)
+    from the driver's current stop order, with the request pickup and dropoff
+    (the last request_node_count nodes) inserted at the cheapest positions
+    that keep the vehicle within capacity and stop limits and the first stop if it should be kept.
+    Returns None if the request actions cannot be inserted
+    '''
+    node_count = len(data['nodes'])
+    current_order = list(range(1, node_count - request_node_count))
+    if request_node_count == 0:
+        return current_order
+
+    pickup, dropoff = node_count - 2, node_count - 1
+    matrix = np.asarray(data['distance_matrix'], dtype=np.float64)
+    first_pickup_position = 1 if data.get('keep_first_stop') and current_order else 0
+    best_route, best_cost = None, None
+    for pickup_position in range(first_pickup_position, len(current_order) + 1):
+        for dropoff_position in range(pickup_position, len(current_order) + 1):
+            candidate = (
+                current_order[:pickup_position] + [pickup]
+                + current_order[pickup_position:dropoff_position] + [dropoff]
+                + current_order[dropoff_position:]
+            )
+            path = [0] + candidate
+            cost = matrix[path[:-1], path[1:]].sum()
+            if (
+                (best_cost is None or cost < best_cost)
+                and fits_capacity(data, candidate) and fits_stop_limits(data, candidate)
+            ):
+                best_route, best_cost = candidate, cost
+    return best_route
+
 def get_current_plan_distances(route_stops, data_model):
     '''
     Extracts the diagonal from distance matrix that defines the old route's
@@ -198,7 +482,7 @@ def get_current_plan_distances(route_stops, data_model):
     '''
     dist_matrix = data_model['distance_matrix']
     route_distances = [0]
-    route_distances += [dist_matrix[idx][idx + 1] for idx in range(len(route_stops) - 1)]
+    route_distances += [float(dist_matrix[idx][idx + 1]) for idx in range(len(route_stops) - 1)]
 
     return route_distances
 
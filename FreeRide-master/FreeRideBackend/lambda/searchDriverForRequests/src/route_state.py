@@ -0,0 +1,157 @@
+'''
+The Route State module keeps, for each driver with waiting stops, the time matrix
+between the points of those stops as last fetched by update_route or find_drivers,
+so the next refresh or match of the driver only fetches the cells of moved
+or new points (see the known_matrices of DataModel.create_data_model).
+States live as long as matrix cache cells: they expire with the cache's ttl
+and time-of-day bucket, counted from their first fetch
+'''
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+from matrix_cache import (
+    DEFAULT_BUCKET_MINUTES, DEFAULT_CACHE_TTL_SECONDS, coordinate_key, get_matrix_cache, time_bucket
+)
+
+DEFAULT_MAX_DRIVERS = 5000
+
+
+def route_fingerprint(stops, profile):
+    '''
+    Returns the version fingerprint of ordered stops' points and vehicle profile
+    '''
+    points = ';'.join(
+        f'{stop.get("stopType")}:{stop.get("ride", stop.get("request_id"))}:'
+        f'{coordinate_key(stop["coordinates"])}'
+        for stop in stops
+    )
+    return hashlib.sha1(f'{profile}|{points}'.encode()).hexdigest()[:16]
+
+
+class DriverRouteState:
+    '''
+    DriverRouteState has a driver's ordered waiting stops, the fetched matrix
+    between their points (coordinates, distances, times and profile), its fingerprint
+    and when the oldest of its cells was fetched
+    '''
+    def __init__(self, stops, matrix, fingerprint, fetched):
+        self.stops = stops
+        self.matrix = matrix
+        self.fingerprint = fingerprint
+        self.fetched = fetched
+
+
+class RouteStateStore:
+    '''
+    RouteStateStore keeps the route state of up to max_drivers drivers,
+    least recently updated states are evicted first and states expire
+    ttl seconds after their first fetch or once the time-of-day bucket changes
+    '''
+    def __init__(
+        self, max_drivers=DEFAULT_MAX_DRIVERS, ttl=DEFAULT_CACHE_TTL_SECONDS,
+        bucket_minutes=DEFAULT_BUCKET_MINUTES
+    ):
+        self.max_drivers = max_drivers
+        self.ttl = ttl
+        self.bucket_seconds = bucket_minutes * 60
+        self.states = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __get(self, driver_id, now):
+        state = self.states.get(str(driver_id))
+        if state and (
+            now - state.fetched > self.ttl
+            or time_bucket(now, self.bucket_seconds)
+            != time_bucket(state.fetched, self.bucket_seconds)
+        ):
+            del self.states[str(driver_id)]
+            return None
+        return state
+
+    def known_matrices(self, driver_id, now=None):
+        '''
+        Returns the known matrices of driver_id for DataModel.create_data_model
+        '''
+        now = time.time() if now is None else now
+        with self.lock:
+            state = self.__get(driver_id, now)
+            return [state.matrix] if state else []
+
+    def update(self, driver_id, stops, fetched_matrix, now=None):
+        '''
+        Receives the driver's waiting stops and the matrix fetched for a data model
+        of them (see DataModel.create_data_model) and keeps the matrix between
+        the points of those stops. Returns if the state was 'new', 'changed' or 'unchanged'.
+        Matrices built with the known matrices of a state keep its fetch time
+        '''
+        now = time.time() if now is None else now
+        if not fetched_matrix:
+            return 'unchanged'
+
+        keys = {coordinate_key(stop['coordinates']) for stop in stops}
+        indexes = [
+            idx for idx, coordinate in enumerate(fetched_matrix['coordinates'])
+            if coordinate_key(coordinate) in keys
+        ]
+        matrix = {
+            'coordinates': [fetched_matrix['coordinates'][idx] for idx in indexes],
+            'distances': np.asarray(fetched_matrix['distances'])[np.ix_(indexes, indexes)],
+            'times': np.asarray(fetched_matrix['times'])[np.ix_(indexes, indexes)],
+            'profile': fetched_matrix['profile']
+        }
+        fingerprint = route_fingerprint(stops, fetched_matrix['profile'])
+
+        with self.lock:
+            state = self.__get(driver_id, now)
+            status = 'new' if state is None else (
+                'unchanged' if state.fingerprint == fingerprint else 'changed'
+            )
+            self.states[str(driver_id)] = DriverRouteState(
+                stops, matrix, fingerprint, now if state is None else state.fetched
+            )
+            self.states.move_to_end(str(driver_id))
+            while len(self.states) > self.max_drivers:
+                self.states.popitem(last=False)
+        return status
+
+    def evict(self, driver_id):
+        '''
+        Removes the route state of driver_id, once the driver is offline or without waiting stops
+        '''
+        with self.lock:
+            self.states.pop(str(driver_id), None)
+
+    def stats(self):
+        '''
+        Returns the number of drivers with a route state
+        '''
+        with self.lock:
+            return {'route_states': len(self.states)}
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_route_state_store():
+    '''
+    Returns the process-wide route state store. Maximum number of drivers and state lifetime
+    can be set with the ROUTE_STATE_MAX_DRIVERS and ROUTE_STATE_TTL environment variables,
+    states use the lifetime and time-of-day bucket of the matrix cache by default
+    '''
+    # pylint: disable=global-statement
+    global _STORE
+    # pylint: enable=global-statement
+    with _STORE_LOCK:
+        if _STORE is None:
+            matrix_cache = get_matrix_cache()
+            _STORE = RouteStateStore(
+                max_drivers=int(os.environ.get('ROUTE_STATE_MAX_DRIVERS', DEFAULT_MAX_DRIVERS)),
+                ttl=int(os.environ.get('ROUTE_STATE_TTL', matrix_cache.ttl)),
+                bucket_minutes=matrix_cache.bucket_seconds // 60
+            )
+        return _STORE
@@ -0,0 +1,61 @@
+'''
+The Search Profiles module defines the named search budgets and strategies
+that can be used by the TSP solver for each type of run.
+Locations use the default profile for every run unless they opt in to another one
+(distanceSearchProfile, timeSearchProfile and routeUpdateSearchProfile location settings)
+'''
+
+# Each profile has:
+# - first_solution_strategy: ortools FirstSolutionStrategy name
+# - local_search_metaheuristic: ortools LocalSearchMetaheuristic name or None for the default
+# - time_limit_ms: maximum search time in milliseconds or None for no limit
+# - solution_limit: maximum number of solutions found during search or None for no limit
+SEARCH_PROFILES = {
+    # Unbounded search, same as before profiles existed
+    'default': {
+        'first_solution_strategy': 'GLOBAL_CHEAPEST_ARC',
+        'local_search_metaheuristic': None,
+        'time_limit_ms': None,
+        'solution_limit': None
+    },
+    # For driver ranking by detour (distance TSP)
+    'fast': {
+        'first_solution_strategy': 'GLOBAL_CHEAPEST_ARC',
+        'local_search_metaheuristic': None,
+        'time_limit_ms': 300,
+        'solution_limit': 25
+    },
+    # For the final route of the matched driver (time TSP)
+    'quality': {
+        'first_solution_strategy': 'GLOBAL_CHEAPEST_ARC',
+        'local_search_metaheuristic': 'AUTOMATIC',
+        'time_limit_ms': 5000,
+        'solution_limit': None
+    },
+    # Final route improved with guided local search until the time limit is reached
+    'guided': {
+        'first_solution_strategy': 'GLOBAL_CHEAPEST_ARC',
+        'local_search_metaheuristic': 'GUIDED_LOCAL_SEARCH',
+        'time_limit_ms': 1000,
+        'solution_limit': None
+    },
+    # For route ETA refresh (update_route)
+    'eta_refresh': {
+        'first_solution_strategy': 'GLOBAL_CHEAPEST_ARC',
+        'local_search_metaheuristic': None,
+        'time_limit_ms': 1000,
+        'solution_limit': 50
+    }
+}
+
+DEFAULT_SEARCH_PROFILE = 'default'
+
+
+def get_search_profile(name):
+    '''
+    Returns the search profile with the given name or the default profile
+    if name is not set or unknown
+    '''
+    if name in SEARCH_PROFILES:
+        return SEARCH_PROFILES[name]
+    return SEARCH_PROFILES[DEFAULT_SEARCH_PROFILE]
@@ -0,0 +1,77 @@
+import unittest
+import sys
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+from circuit_breaker import CircuitBreaker, is_provider_failure, is_rate_limit
+from exceptions import GraphHopperLimitError, GraphHopperProfileError, MatrixProviderError
+# pylint: enable=wrong-import-position
+
+NOW = 1700000000
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_on_failure_burst(self):
+        breaker = CircuitBreaker('gh', failure_threshold=3, failure_window=10, cooldown=30)
+        breaker.record_failure(now=NOW)
+        breaker.record_failure(now=NOW + 20)
+        breaker.record_failure(now=NOW + 21)
+        self.assertTrue(breaker.allow_request(NOW + 22))
+        breaker.record_failure(now=NOW + 22)
+        self.assertFalse(breaker.allow_request(NOW + 23))
+        self.assertTrue(breaker.is_open(NOW + 51))
+        self.assertFalse(breaker.is_open(NOW + 52))
+
+    def test_rate_limit_open_until_reset(self):
+        breaker = CircuitBreaker('gh', cooldown=30)
+        breaker.record_failure(reset_at=NOW + 300, rate_limited=True, now=NOW)
+        self.assertFalse(breaker.allow_request(NOW + 299))
+        # Calls sent before the limit do not close it
+        breaker.record_success()
+        self.assertFalse(breaker.allow_request(NOW + 299))
+        self.assertEqual(breaker.stats()['breaker_rejected'], 2)
+
+    def test_server_failures_use_cooldown(self):
+        breaker = CircuitBreaker('gh', failure_threshold=3, cooldown=30)
+        for _ in range(3):
+            breaker.record_failure(reset_at=NOW + 6 * 60 * 60, now=NOW)
+        self.assertTrue(breaker.is_open(NOW + 29))
+        self.assertFalse(breaker.is_open(NOW + 30))
+
+    def test_half_open_probes(self):
+        breaker = CircuitBreaker('gh', cooldown=30, half_open_probes=1)
+        breaker.record_failure(rate_limited=True, now=NOW)
+        self.assertTrue(breaker.allow_request(NOW + 30))
+        self.assertFalse(breaker.allow_request(NOW + 30))
+
+        # Failed probe opens it again
+        breaker.record_failure(now=NOW + 31)
+        self.assertFalse(breaker.allow_request(NOW + 60))
+        self.assertTrue(breaker.allow_request(NOW + 61))
+
+        # Released probe lets another one through, successful probe closes it
+        breaker.release()
+        self.assertTrue(breaker.allow_request(NOW + 61))
+        breaker.record_success()
+        self.assertEqual(breaker.stats()['breaker_state'], 'closed')
+        self.assertTrue(breaker.allow_request(NOW + 61))
+
+    def test_provider_failures(self):
+        self.assertTrue(is_rate_limit(GraphHopperLimitError()))
+        self.assertTrue(is_provider_failure(GraphHopperLimitError()))
+        self.assertTrue(is_provider_failure(MatrixProviderError('', {'status_code': 502})))
+        self.assertFalse(is_provider_failure(MatrixProviderError('', {'status_code': 400})))
+        self.assertFalse(is_provider_failure(GraphHopperProfileError('', {'status_code': 400})))
+        if httpx is not None:
+            self.assertTrue(is_provider_failure(httpx.ConnectTimeout('timeout')))
+            self.assertTrue(is_provider_failure(httpx.RemoteProtocolError('reset')))
+
+
+if __name__ == '__main__':
+    unittest.main()
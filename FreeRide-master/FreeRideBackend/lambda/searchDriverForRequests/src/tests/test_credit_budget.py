@@ -0,0 +1,68 @@
+import unittest
+import sys
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+from credit_budget import CreditAccountant
+# pylint: enable=wrong-import-position
+
+NOW = 1700000000
+
+
+class TestCreditBudget(unittest.TestCase):
+    def test_unlimited_budget(self):
+        accountant = CreditAccountant()
+        accountant.record('loc', 'candidate', 1000, now=NOW)
+        self.assertTrue(accountant.allow('loc', 'candidate', 0, NOW))
+
+    def test_downgrades_lower_value_calls_first(self):
+        accountant = CreditAccountant()
+        accountant.record('loc', 'final_match', 70, remaining=500, now=NOW)
+        self.assertFalse(accountant.allow('loc', 'candidate', 100, NOW))
+        self.assertTrue(accountant.allow('loc', 'route_update', 100, NOW))
+        accountant.record('loc', 'route_update', 20, now=NOW)
+        self.assertFalse(accountant.allow('loc', 'route_update', 100, NOW))
+        self.assertTrue(accountant.allow('loc', 'final_match', 100, NOW))
+        accountant.record('loc', 'final_match', 10, now=NOW)
+        self.assertFalse(accountant.allow('loc', 'final_match', 100, NOW))
+
+        stats = accountant.stats('loc', NOW)
+        self.assertEqual(stats['credits_hour'], 100)
+        self.assertEqual(stats['credits_by_type']['final_match'], 80)
+        self.assertEqual(
+            stats['downgraded_by_type'], {'candidate': 1, 'route_update': 1, 'final_match': 1}
+        )
+        self.assertEqual(stats['credits_remaining'], 500)
+
+    def test_budget_per_location_and_hour(self):
+        accountant = CreditAccountant()
+        accountant.record('loc', 'candidate', 100, now=NOW)
+        self.assertTrue(accountant.allow('other', 'candidate', 100, NOW))
+        self.assertTrue(accountant.allow('loc', 'candidate', 100, NOW + 3600))
+        self.assertEqual(accountant.stats('loc', NOW + 3600)['credits_hour'], 0)
+
+    def test_account_reserve_floor(self):
+        # Remaining credits are reported by calls of other locations and processes
+        accountant = CreditAccountant(reserve=1000)
+        accountant.record('other', 'final_match', 10, remaining=300, now=NOW)
+        self.assertFalse(accountant.allow('loc', 'candidate', 0, NOW))
+        self.assertTrue(accountant.allow('loc', 'route_update', 0, NOW))
+        self.assertTrue(accountant.allow('loc', 'final_match', 100, NOW))
+        accountant.record('other', 'final_match', 10, remaining=100, now=NOW)
+        self.assertFalse(accountant.allow('loc', 'route_update', 0, NOW))
+        self.assertTrue(accountant.allow('loc', 'final_match', 0, NOW))
+        self.assertEqual(
+            accountant.stats('loc', NOW)['downgraded_by_type'],
+            {'candidate': 1, 'route_update': 1, 'final_match': 0}
+        )
+
+    def test_account_reserve_ignores_old_remaining(self):
+        accountant = CreditAccountant(reserve=1000)
+        accountant.record('loc', 'final_match', 10, remaining=0, now=NOW)
+        self.assertFalse(accountant.allow('loc', 'candidate', 0, NOW + 60))
+        self.assertTrue(accountant.allow('loc', 'candidate', 0, NOW + 2 * 3600))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import unittest
+import sys
+import logging
+import os
+from unittest.mock import patch
+import numpy as np
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+import utils
+from data import DataModel
+from dbaccess import LOCATION_SCHEMA_DEFAULTS
+# pylint: enable=wrong-import-position
+
+LOC_OPTS = {name: default for name, default, _ in LOCATION_SCHEMA_DEFAULTS}
+CAPACITY_OPTS = {
+    'passenger_capacity': 4, 'ada_passenger_capacity': 1,
+    'hailed_passenger_count': 0, 'hailed_ada_passenger_count': 0
+}
+
+
+def stop(stop_type, coordinates, fixed_stop_id=None):
+    stop_info = {
+        'stopType': stop_type, 'status': 'waiting', 'coordinates': coordinates,
+        'passengers': 1, 'ADApassengers': 0, 'ride': str(coordinates)
+    }
+    if fixed_stop_id:
+        stop_info['fixedStopId'] = fixed_stop_id
+    return stop_info
+
+
+STOPS = [
+    {
+        'stopType': 'current_location', 'status': 'done', 'coordinates': [32.74, -117.10],
+        'passengers': 0, 'ADApassengers': 0
+    },
+    stop('pickup', [32.75, -117.10], 'fs1'),
+    stop('pickup', [32.750001, -117.10], 'fs1'),
+    stop('dropoff', [32.76, -117.09]),
+    stop('dropoff', [32.76, -117.09])
+]
+
+
+class TestDataModel(unittest.TestCase):
+    def setUp(self):
+        # Without a GraphHopper key the matrices are estimated, the key is restored after the test
+        environ = patch.dict(os.environ)
+        environ.start()
+        self.addCleanup(environ.stop)
+        os.environ.pop('GH_API_KEY', None)
+        self.data_model = DataModel(logging.getLogger())
+
+    def test_unique_points_expanded(self):
+        data = self.data_model.create_data_model(
+            STOPS, typ="distance", loc_opts=LOC_OPTS, capacity_opts=CAPACITY_OPTS
+        )
+        matrix = np.asarray(data['distance_matrix'])
+        self.assertEqual(matrix.shape, (5, 5))
+        # Stops at the same coordinates share a point
+        np.testing.assert_array_equal(matrix[3], matrix[4])
+        self.assertEqual(matrix[3][4], 0)
+        # Stops of a fixed stop keep their own coordinates
+        self.assertAlmostEqual(
+            matrix[1][2], utils.calc_dist(STOPS[1]['coordinates'], STOPS[2]['coordinates']), 3
+        )
+        self.assertGreater(matrix[1][2], 0)
+        self.assertAlmostEqual(
+            matrix[1][3], utils.calc_dist(STOPS[1]['coordinates'], STOPS[3]['coordinates']), 3
+        )
+        # Return to depot is instantaneous
+        self.assertTrue(np.all(matrix[:, 0] == 0))
+
+    def test_time_matrix_expanded(self):
+        data = self.data_model.create_data_model(
+            STOPS, typ="time", loc_opts=LOC_OPTS, capacity_opts=CAPACITY_OPTS, location_id='loc'
+        )
+        time_matrix = np.asarray(data['time_matrix'])
+        self.assertEqual(time_matrix.shape, (5, 5))
+        np.testing.assert_array_equal(time_matrix[:, 3], time_matrix[:, 4])
+        self.assertEqual(time_matrix[4][3], 0)
+
+    def test_known_cells_kept_when_estimated(self):
+        known = {
+            'coordinates': [STOPS[0]['coordinates'], STOPS[3]['coordinates']],
+            'distances': [[0, 5000], [4000, 0]],
+            'times': [[0, 500], [400, 0]],
+            'profile': self.data_model.default_vehicle_profile
+        }
+        data = self.data_model.create_data_model(
+            STOPS, typ="time", loc_opts=LOC_OPTS, capacity_opts=CAPACITY_OPTS,
+            location_id='loc', known_matrices=[known]
+        )
+        self.assertEqual(data['profile'], 'euclidean')
+        self.assertEqual(data['distance_matrix'][0][3], 5000)
+        self.assertEqual(data['time_matrix'][0][3], 500)
+        self.assertEqual(data['time_matrix'][4][0], 400)
+        # Cells from unknown points are estimated
+        self.assertGreater(
+            data['distance_matrix'][0][1],
+            utils.calc_dist(STOPS[0]['coordinates'], STOPS[1]['coordinates']) - 1
+        )
+
+    def test_typed_arrays(self):
+        stops = [
+            STOPS[0],
+            {**stop('pickup', [32.75, -117.10]), 'ride': 'r1'},
+            {**stop('dropoff', [32.76, -117.09]), 'ride': 'r1'},
+            {**stop('pickup', [32.7601, -117.09]), 'ride': 'r2'},
+            {**stop('dropoff', [32.78, -117.08]), 'ride': 'r2'},
+            {**stop('dropoff', [32.78, -117.08]), 'ride': 'r0', 'passengers': 2}
+        ]
+        data = self.data_model.create_data_model(
+            stops, typ="distance", loc_opts=LOC_OPTS, capacity_opts=CAPACITY_OPTS
+        )
+        self.assertEqual(data['distance_matrix'].dtype, np.float32)
+        self.assertEqual(data['stop_types'].tolist(), [0, 1, 2, 1, 2, 2])
+        self.assertEqual(data['stop_statuses'].tolist(), [1, 0, 0, 0, 0, 0])
+        self.assertEqual(data['demands'].dtype, np.int32)
+        self.assertEqual(
+            data['demands'].tolist(),
+            [[1, 2, 0], [1, 1, 0], [-1, -1, 0], [1, 1, 0], [-1, -1, 0], [-1, -2, 0]]
+        )
+        self.assertEqual(data['pickups_deliveries'].tolist(), [[1, 2], [3, 4]])
+        # Pickup of r2 is about 11 meters from the dropoff of r1
+        self.assertEqual(data['close_nodes'].tolist(), [[1, 2, 3]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import sys
+import random
+import numpy as np
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+import utils
+# pylint: enable=wrong-import-position
+
+
+def random_coordinates(rand, count):
+    coordinates = [
+        [32.745 + rand.uniform(-0.2, 0.2), -117.10 + rand.uniform(-0.2, 0.2)] for _ in range(count)
+    ]
+    # Repeated points, the equator and other continents
+    return coordinates + [coordinates[0], [0, 0], [0, 10], [60, -117], [-33.9, 151.2]]
+
+
+def geopy_matrix(from_coords, to_coords):
+    return np.array([
+        [utils.calc_dist(coord_a, coord_b) for coord_b in to_coords] for coord_a in from_coords
+    ])
+
+
+class TestDistanceMatrix(unittest.TestCase):
+    def test_ellipsoid_matches_geopy(self):
+        coordinates = random_coordinates(random.Random(1), 30)
+        expected = geopy_matrix(coordinates, coordinates)
+        distances = utils.calc_dist_matrix(coordinates)
+        self.assertEqual(distances.shape, expected.shape)
+        self.assertLess(np.abs(distances - expected).max(), 1e-3)
+        self.assertTrue(np.all(np.diag(distances) == 0))
+
+    def test_haversine_within_half_percent(self):
+        coordinates = random_coordinates(random.Random(2), 30)
+        expected = geopy_matrix(coordinates, coordinates)
+        distances = utils.calc_dist_matrix(coordinates, mode='haversine')
+        self.assertLess((np.abs(distances - expected) / np.maximum(expected, 1)).max(), 0.005)
+
+    def test_rectangular_matrix(self):
+        rand = random.Random(3)
+        from_coords = random_coordinates(rand, 5)
+        to_coords = random_coordinates(rand, 3)
+        distances = utils.calc_dist_matrix(from_coords, to_coords)
+        self.assertEqual(distances.shape, (len(from_coords), len(to_coords)))
+        self.assertLess(np.abs(distances - geopy_matrix(from_coords, to_coords)).max(), 1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
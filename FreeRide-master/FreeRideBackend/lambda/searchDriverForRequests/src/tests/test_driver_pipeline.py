@@ -0,0 +1,65 @@
+import unittest
+import sys
+import asyncio
+import logging
+import threading
+import time
+from unittest.mock import patch
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+import utils
+from driverfinder import DriverFinder
+# pylint: enable=wrong-import-position
+
+# Seconds each driver's data model build waits for its (fake) matrix request
+BUILD_SECONDS = 0.2
+
+
+class ConcurrencyRecorder:
+    '''
+    Stands in for a driver's data model build, recording how many builds run at once
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def build(self, driver_info, request_actions, typ, loc_opts, call_type='final_match'):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(BUILD_SECONDS)
+        with self.lock:
+            self.running -= 1
+        return [{'soft_constraints': []}, [], [], [], driver_info, {}]
+
+
+async def no_route(context, data_model, typ, search_profile=None):
+    return [False, False, False]
+
+
+class TestDriverPipeline(unittest.TestCase):
+    def test_time_pass_overlaps_driver_builds(self):
+        n_drivers = utils.DEFAULT_BLOCKING_POOL_SIZE
+        recorder = ConcurrencyRecorder()
+        driver_dict = {f'd{idx}': {'_id': f'd{idx}'} for idx in range(n_drivers)}
+        finder = DriverFinder(None, logging.getLogger())
+
+        started = time.monotonic()
+        with patch.object(DriverFinder, '_DriverFinder__build_driver_model', recorder.build), \
+                patch.object(DriverFinder, '_DriverFinder__prefetch_matrices'), \
+                patch.object(utils, 'tsp_handler_async', no_route):
+            results = asyncio.run(finder._DriverFinder__tsp(
+                [], driver_dict, list(driver_dict), typ="time", loc_opts={}
+            ))
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(results, [])
+        self.assertEqual(recorder.max_running, n_drivers)
+        self.assertLess(elapsed, 2 * BUILD_SECONDS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+from exceptions import RequestBudgetError
+import http_client
+from http_client import HTTPClient
+# pylint: enable=wrong-import-position
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(0.5)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPClient(unittest.TestCase):
+    def test_timeouts_without_deadline(self):
+        client = HTTPClient(connect_timeout=2, read_timeout=20)
+        self.assertEqual(client.timeouts(), [2, 20])
+
+    def test_timeouts_capped_by_deadline(self):
+        client = HTTPClient(connect_timeout=2, read_timeout=20)
+        connect_timeout, read_timeout = client.timeouts(time.time() + 5)
+        self.assertEqual(connect_timeout, 2)
+        self.assertLessEqual(read_timeout, 5)
+        self.assertGreater(read_timeout, 4)
+        connect_timeout, read_timeout = client.timeouts(time.time() + 1)
+        self.assertLessEqual(connect_timeout, 1)
+
+    def test_exhausted_budget(self):
+        client = HTTPClient()
+        with self.assertRaises(RequestBudgetError):
+            client.get('http://localhost', deadline=time.time() - 1)
+        self.assertEqual(client.stats()['http_requests'], 0)
+
+    def assert_pool_wait_capped_by_deadline(self, http2=False):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_address[1]}/'
+
+        client = HTTPClient(pool_size=1, http2=http2)
+        self.assertEqual(client.http2, http2)
+        first = threading.Thread(target=client.get, args=(url,))
+        first.start()
+        time.sleep(0.1)
+        started = time.monotonic()
+        with self.assertRaises(RequestBudgetError):
+            client.get(url, deadline=time.time() + 0.1)
+        self.assertLess(time.monotonic() - started, 0.3)
+        first.join()
+        self.assertEqual(client.get(url).status_code, 200)
+
+    def test_pool_wait_capped_by_deadline(self):
+        self.assert_pool_wait_capped_by_deadline()
+
+    @unittest.skipIf(http_client.httpx is None or http_client.h2 is None, 'httpx[http2] missing')
+    def test_http2_pool_wait_capped_by_deadline(self):
+        self.assert_pool_wait_capped_by_deadline(http2=True)
+
+    def test_http2_needs_h2(self):
+        with patch.object(http_client, 'h2', None):
+            client = HTTPClient(http2=True)
+        self.assertFalse(client.http2)
+        self.assertIsNotNone(client.adapter)
+
+
+if __name__ == '__main__':
+    unittest.main()
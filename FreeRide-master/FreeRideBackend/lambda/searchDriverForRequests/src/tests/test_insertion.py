@@ -0,0 +1,116 @@
+import unittest
+import sys
+import random
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+import insertion
+import utils
+# pylint: enable=wrong-import-position
+
+LOC_OPTS = {'concurrentRideLimit': 3, 'inversionRangeFeet': 2300}
+
+
+def random_coordinates(rand):
+    return [32.745 + rand.uniform(-0.02, 0.02), -117.10 + rand.uniform(-0.02, 0.02)]
+
+
+def random_driver(seed):
+    rand = random.Random(seed)
+    stops = []
+    for ride_idx in range(rand.randint(0, 3)):
+        ride = {'ride': f'{seed}_{ride_idx}', 'passengers': 1, 'ADApassengers': 0}
+        picked_up = rand.random() < 0.4
+        stops += [dict(
+            ride, stopType='pickup', status='done' if picked_up else 'waiting',
+            coordinates=random_coordinates(rand)
+        )]
+        stops += [dict(ride, stopType='dropoff', status='waiting', coordinates=random_coordinates(rand))]
+    rand.shuffle(stops)
+    # Pickups before dropoffs and completed stops first
+    stops.sort(key=lambda stop: (stop['status'] != 'done', stop['stopType'] == 'dropoff'))
+    current_location = random_coordinates(rand)
+    return {
+        '_id': f'driver_{seed}',
+        'currentLocation': {'coordinates': current_location[::-1]},
+        'activeRoute': {'stops': stops},
+        'pax_capacity': rand.randint(3, 5),
+        'pax_ada_capacity': 0,
+        'hailedRideInfo': {'passengerCount': 0, 'ADApassengerCount': 0}
+    }
+
+
+def brute_force_detour(driver_route, request_actions):
+    coordinates = driver_route['coordinates']
+    demands = driver_route['demands']
+    pickup, dropoff = request_actions
+    request_demand = [1, pickup['passengers'], pickup['ADApassengers']]
+    old_cost = sum(
+        utils.calc_dist(coordinates[idx], coordinates[idx + 1])
+        for idx in range(len(coordinates) - 1)
+    )
+    best = float('inf')
+    first_position = 1 if driver_route['keep_first_stop'] else 0
+    for pickup_position in range(first_position, len(coordinates)):
+        for dropoff_position in range(pickup_position, len(coordinates)):
+            path = list(zip(coordinates, demands))
+            path.insert(dropoff_position + 1, (dropoff['coordinates'], [-d for d in request_demand]))
+            path.insert(pickup_position + 1, (pickup['coordinates'], request_demand))
+            loads = [0, 0, 0]
+            fits = True
+            for _, demand in path:
+                loads = [load + change for load, change in zip(loads, demand)]
+                if any(load > cap for load, cap in zip(loads, driver_route['capacity'])):
+                    fits = False
+            cost = sum(
+                utils.calc_dist(path[idx][0], path[idx + 1][0]) for idx in range(len(path) - 1)
+            )
+            if fits:
+                best = min(best, cost - old_cost)
+    if old_cost == 0 and best < float('inf'):
+        return utils.calc_dist(coordinates[0], pickup['coordinates'])
+    return best
+
+
+class TestInsertion(unittest.TestCase):
+    def test_detours_match_brute_force(self):
+        for seed in range(20):
+            drivers = [random_driver(seed * 10 + idx) for idx in range(6)]
+            rand = random.Random(seed)
+            request_actions = utils.build_request_actions({
+                '_id': f'request_{seed}', 'isADA': False, 'passengers': rand.randint(1, 3),
+                'pickupLatitude': 32.745, 'pickupLongitude': -117.10,
+                'dropoffLatitude': 32.745 + rand.uniform(-0.02, 0.02),
+                'dropoffLongitude': -117.10 + rand.uniform(-0.02, 0.02)
+            })
+            driver_routes = [insertion.build_driver_route(driver, LOC_OPTS) for driver in drivers]
+            detours = insertion.evaluate_insertions(driver_routes, request_actions)
+            for driver_route, detour in zip(driver_routes, detours):
+                self.assertAlmostEqual(
+                    detour, brute_force_detour(driver_route, request_actions), places=3
+                )
+
+    def test_rank_drivers_sorted_by_detour(self):
+        drivers = [random_driver(idx) for idx in range(8)]
+        request_actions = utils.build_request_actions({
+            '_id': 'request', 'isADA': False, 'passengers': 1,
+            'pickupLatitude': 32.75, 'pickupLongitude': -117.09,
+            'dropoffLatitude': 32.74, 'dropoffLongitude': -117.11
+        })
+        ranking = insertion.rank_drivers(request_actions, drivers, LOC_OPTS)
+        driver_routes = {
+            driver['_id']: insertion.build_driver_route(driver, LOC_OPTS) for driver in drivers
+        }
+        detours = [
+            brute_force_detour(driver_routes[driver_id], request_actions) for driver_id in ranking
+        ]
+        self.assertEqual(detours, sorted(detours))
+        self.assertEqual(len(ranking), len(drivers))
+
+    def test_rank_drivers_without_drivers(self):
+        self.assertEqual(insertion.rank_drivers([], [], LOC_OPTS), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import sys
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+from matrix_cache import MatrixCache, missing_blocks
+# pylint: enable=wrong-import-position
+
+COORDINATES = [[32.745, -117.10], [32.75, -117.09], [32.74, -117.11]]
+NOW = 1700000000
+
+
+def square(value, size):
+    return [[value] * size for _ in range(size)]
+
+
+class TestMatrixCache(unittest.TestCase):
+    def test_missing_rectangle(self):
+        cache = MatrixCache()
+        cache.store(COORDINATES[:2], COORDINATES[:2], 'car', square(1, 2), square(2, 2), NOW)
+        distances, times, missing_rows, missing_columns = cache.lookup(
+            COORDINATES, 'car', NOW + 1
+        )
+        self.assertEqual(missing_rows, [0, 1, 2])
+        self.assertEqual(missing_columns, [0, 1, 2])
+        self.assertEqual(distances[0][1], 1)
+        self.assertEqual(times[1][0], 2)
+        self.assertIsNone(distances[0][2])
+
+        cache.store(COORDINATES, COORDINATES[2:], 'car', square(3, 3), square(4, 3), NOW)
+        cache.store(COORDINATES[2:], COORDINATES[:2], 'car', [[5, 5]], [[6, 6]], NOW)
+        distances, times, missing_rows, missing_columns = cache.lookup(
+            COORDINATES, 'car', NOW + 1
+        )
+        self.assertEqual(missing_rows, [])
+        self.assertEqual(missing_columns, [])
+        self.assertEqual(distances[2][0], 5)
+        self.assertEqual(times[0][2], 4)
+
+    def test_vehicle_and_ttl(self):
+        cache = MatrixCache(ttl=60)
+        cache.store(COORDINATES, COORDINATES, 'car', square(1, 3), square(2, 3), NOW)
+        self.assertEqual(cache.lookup(COORDINATES, 'scooter', NOW)[2], [0, 1, 2])
+        self.assertEqual(cache.lookup(COORDINATES, 'car', NOW + 30)[2], [])
+        self.assertEqual(cache.lookup(COORDINATES, 'car', NOW + 61)[2], [0, 1, 2])
+
+    def test_lru_eviction(self):
+        cache = MatrixCache(max_size=4)
+        cache.store(COORDINATES[:2], COORDINATES[:2], 'car', square(1, 2), square(2, 2), NOW)
+        # Cell read last is kept
+        cache.lookup(COORDINATES[:1], 'car', NOW)
+        cache.store(COORDINATES[2:], COORDINATES[2:], 'car', [[0]], [[0]], NOW)
+        # Least recently used cell (0 to 1) was evicted
+        _, _, missing_rows, missing_columns = cache.lookup(COORDINATES[:2], 'car', NOW)
+        self.assertEqual(missing_rows, [0])
+        self.assertEqual(missing_columns, [1])
+        self.assertEqual(cache.stats()['cache_size'], 4)
+
+    def test_missing_blocks(self):
+        self.assertEqual(missing_blocks(square(1, 3)), [])
+        # Known 8 x 8 block, 3 new points: 3 x 11 and 8 x 3 cells instead of 11 x 11
+        matrix = square(None, 11)
+        for row in range(3, 11):
+            for column in range(3, 11):
+                matrix[row][column] = 1
+        self.assertEqual(
+            missing_blocks(matrix),
+            [[[0, 1, 2], list(range(11))], [list(range(3, 11)), [0, 1, 2]]]
+        )
+        # A bounding rectangle without known cells inside is not split
+        matrix = square(1, 3)
+        matrix[0][1] = matrix[0][2] = None
+        self.assertEqual(missing_blocks(matrix), [[[0], [1, 2]]])
+
+
+if __name__ == '__main__':
+    unittest.main()
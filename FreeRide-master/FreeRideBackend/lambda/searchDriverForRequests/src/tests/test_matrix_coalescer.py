@@ -0,0 +1,154 @@
+import unittest
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+from exceptions import GraphHopperProfileError, GraphHopperServerError, MatrixBatchError
+from matrix_coalescer import MatrixCoalescer
+from matrix_providers import MatrixProvider
+# pylint: enable=wrong-import-position
+
+
+class CountingProvider(MatrixProvider):
+    '''
+    Provider answering the sum of latitudes of each cell's points after a delay,
+    each cell spends a credit
+    '''
+    name = 'counting'
+
+    def __init__(self, error=None, delay=0.1):
+        self.requests = []
+        self.error = error
+        self.delay = delay
+
+    def is_available(self):
+        return True
+
+    def get_matrix(self, from_points, to_points, vehicle, context):
+        self.requests += [(len(from_points), len(to_points))]
+        time.sleep(self.delay)
+        context['credits'] = len(from_points) * len(to_points)
+        context['credits_remaining'] = 1000
+        if self.error:
+            raise self.error
+        distances = [
+            [from_point[0] + to_point[0] for to_point in to_points] for from_point in from_points
+        ]
+        return [distances, distances]
+
+
+def fetch_points(coalescer, provider, point_sets, max_points, results, idx, contexts=None):
+    context = {} if contexts is None else contexts[idx]
+    try:
+        results[idx] = coalescer.fetch(
+            provider, point_sets[idx], point_sets[idx], 'car', context, max_points
+        )
+    # pylint: disable=broad-exception-caught
+    except Exception as error:
+    # pylint: enable=broad-exception-caught
+        results[idx] = error
+
+
+def fetch_all(coalescer, provider, point_sets, max_points=80, busy=False, contexts=None):
+    '''
+    Fetches every point set from its own thread at the same time (with its context
+    of contexts, if given). If busy, a first request is in flight while they are fetched
+    '''
+    results = [None] * len(point_sets)
+    barrier = threading.Barrier(len(point_sets))
+    if busy:
+        busy_thread = threading.Thread(target=fetch_points, args=(
+            coalescer, provider, [[[0, 0]]], max_points, [None], 0
+        ))
+        busy_thread.start()
+        time.sleep(0.02)
+
+    def fetch(idx):
+        barrier.wait()
+        fetch_points(coalescer, provider, point_sets, max_points, results, idx, contexts)
+
+    threads = [threading.Thread(target=fetch, args=(idx,)) for idx in range(len(point_sets))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if busy:
+        busy_thread.join()
+        del provider.requests[0]
+    return results
+
+
+class TestMatrixCoalescer(unittest.TestCase):
+    def test_merges_concurrent_requests(self):
+        provider = CountingProvider()
+        point_sets = [[[1, 0], [2, 0]], [[2, 0], [3, 0]], [[4, 0]]]
+        results = fetch_all(MatrixCoalescer(window=0.2), provider, point_sets, busy=True)
+        self.assertEqual(provider.requests, [(4, 4)])
+        self.assertEqual(results[1][0][0], [[4, 5], [5, 6]])
+        self.assertEqual(results[2][0][1], [[8]])
+        self.assertEqual(results[0][1]['coalesced_requests'], 3)
+
+    def test_credits_split_by_cells(self):
+        provider = CountingProvider()
+        point_sets = [[[1, 0], [2, 0]], [[2, 0], [3, 0]], [[4, 0]]]
+        contexts = [{} for _ in point_sets]
+        fetch_all(MatrixCoalescer(window=0.2), provider, point_sets, busy=True, contexts=contexts)
+        # 16 cells merged for 4 + 4 + 1 requested cells
+        self.assertAlmostEqual(sum(context['credits'] for context in contexts), 16)
+        self.assertAlmostEqual(contexts[0]['credits'], 16 * 4 / 9)
+        self.assertAlmostEqual(contexts[2]['credits'], 16 / 9)
+        self.assertTrue(all(context['credits_remaining'] == 1000 for context in contexts))
+
+    def test_max_points(self):
+        provider = CountingProvider()
+        point_sets = [[[1, 0], [2, 0]], [[3, 0], [4, 0]]]
+        results = fetch_all(
+            MatrixCoalescer(window=0.2), provider, point_sets, max_points=3, busy=True
+        )
+        self.assertEqual(provider.requests, [(2, 2), (2, 2)])
+        self.assertEqual(results[1][0][0], [[6, 7], [7, 8]])
+
+    def test_lone_request_is_not_delayed(self):
+        provider = CountingProvider(delay=0)
+        started = time.monotonic()
+        [[_, stats]] = fetch_all(MatrixCoalescer(window=0.2), provider, [[[1, 0], [2, 0]]])
+        self.assertLess(time.monotonic() - started, 0.2)
+        self.assertEqual(provider.requests, [(2, 2)])
+        self.assertEqual(stats['coalesced_requests'], 1)
+
+    @patch('matrix_fetch.MATRIX_RETRIES', 0)
+    def test_provider_failure_reported_once(self):
+        provider = CountingProvider(GraphHopperServerError("Server error"))
+        results = fetch_all(
+            MatrixCoalescer(window=0.2), provider, [[[1, 0]], [[2, 0]], [[3, 0]]], busy=True
+        )
+        self.assertEqual(len(provider.requests), 1)
+        self.assertEqual(
+            sorted(type(result).__name__ for result in results),
+            ['GraphHopperServerError', 'MatrixBatchError', 'MatrixBatchError']
+        )
+        self.assertTrue(all(
+            isinstance(result.__cause__, GraphHopperServerError)
+            for result in results if isinstance(result, MatrixBatchError)
+        ))
+
+    def test_other_errors_reach_every_caller(self):
+        provider = CountingProvider(GraphHopperProfileError("Profile error"))
+        results = fetch_all(
+            MatrixCoalescer(window=0.2), provider, [[[1, 0]], [[2, 0]]], busy=True
+        )
+        self.assertEqual(len(provider.requests), 1)
+        self.assertTrue(all(isinstance(result, GraphHopperProfileError) for result in results))
+
+    def test_disabled(self):
+        provider = CountingProvider()
+        fetch_all(MatrixCoalescer(window=0), provider, [[[1, 0]], [[2, 0]]])
+        self.assertEqual(provider.requests, [(1, 1), (1, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
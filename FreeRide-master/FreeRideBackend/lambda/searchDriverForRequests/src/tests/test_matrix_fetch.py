@@ -0,0 +1,107 @@
+import unittest
+import sys
+import threading
+import time
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+import matrix_fetch
+from exceptions import GraphHopperLimitError, GraphHopperServerError
+from matrix_fetch import LatencyTracker, fetch_matrix
+from matrix_providers import MatrixProvider
+# pylint: enable=wrong-import-position
+
+
+class FakeProvider(MatrixProvider):
+    '''
+    Provider answering each request with the next of answers:
+    an exception to raise or seconds to wait before returning a matrix.
+    Each answer spends as many credits as the request number
+    '''
+    def __init__(self, name, answers):
+        self.name = name
+        self.answers = answers
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def is_available(self):
+        return True
+
+    def get_matrix(self, from_points, to_points, vehicle, context):
+        with self.lock:
+            answer = self.answers[min(self.requests, len(self.answers) - 1)]
+            self.requests += 1
+            request = self.requests
+        if isinstance(answer, Exception):
+            context['credits'] = request
+            raise answer
+        time.sleep(answer)
+        context['credits'] = request
+        return [[[request]], [[request]]]
+
+
+class TestMatrixFetch(unittest.TestCase):
+    def setUp(self):
+        matrix_fetch.MATRIX_RETRY_BACKOFF = 0.01
+        matrix_fetch.MATRIX_RETRIES = 2
+
+    def test_percentile(self):
+        tracker = LatencyTracker(min_samples=3)
+        tracker.record('gh', 1)
+        tracker.record('gh', 3)
+        self.assertIsNone(tracker.percentile('gh', 50))
+        tracker.record('gh', 2)
+        self.assertEqual(tracker.percentile('gh', 50), 2)
+        self.assertEqual(tracker.percentile('gh', 100), 3)
+
+    def test_retries_transient_errors(self):
+        provider = FakeProvider('retry', [GraphHopperServerError(), 0])
+        context = {'deadline': time.time() + 5}
+        [distances, _], stats = fetch_matrix(provider, [[0, 0]], [[0, 0]], 'car', context)
+        self.assertEqual(distances, [[2]])
+        self.assertEqual(stats['retries'], 1)
+        # Credits of the failed attempt are spent too
+        self.assertEqual(context['credits'], 3)
+
+    def test_does_not_retry_rate_limit(self):
+        provider = FakeProvider('limit', [GraphHopperLimitError(), 0])
+        context = {'deadline': time.time() + 5}
+        with self.assertRaises(GraphHopperLimitError):
+            fetch_matrix(provider, [[0, 0]], [[0, 0]], 'car', context)
+        self.assertEqual(provider.requests, 1)
+        self.assertEqual(context['credits'], 1)
+
+    def test_no_retry_after_deadline(self):
+        provider = FakeProvider('deadline', [GraphHopperServerError(), 0])
+        with self.assertRaises(GraphHopperServerError):
+            fetch_matrix(provider, [[0, 0]], [[0, 0]], 'car', {'deadline': time.time()})
+        self.assertEqual(provider.requests, 1)
+
+    def test_hedges_slow_request(self):
+        for _ in range(matrix_fetch.LATENCY_MIN_SAMPLES):
+            matrix_fetch.get_latency_tracker().record('hedge', 0.01)
+        provider = FakeProvider('hedge', [1, 0])
+        start = time.time()
+        context = {'deadline': time.time() + 5}
+        [distances, _], stats = fetch_matrix(provider, [[0, 0]], [[0, 0]], 'car', context)
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(distances, [[2]])
+        self.assertEqual(stats['hedged_requests'], 1)
+        # The slow request is still in flight, it is billed as the answered one
+        self.assertEqual(context['credits'], 4)
+
+    def test_hedge_within_credit_budget(self):
+        for _ in range(matrix_fetch.LATENCY_MIN_SAMPLES):
+            matrix_fetch.get_latency_tracker().record('no_hedge', 0.01)
+        provider = FakeProvider('no_hedge', [0.2, 0])
+        context = {'deadline': time.time() + 5, 'allow_hedge': lambda: False}
+        [distances, _], stats = fetch_matrix(provider, [[0, 0]], [[0, 0]], 'car', context)
+        self.assertEqual(distances, [[1]])
+        self.assertEqual(stats['hedged_requests'], 0)
+        self.assertEqual(provider.requests, 1)
+        self.assertEqual(context['credits'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
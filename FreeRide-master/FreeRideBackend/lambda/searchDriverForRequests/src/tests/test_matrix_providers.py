@@ -0,0 +1,117 @@
+import unittest
+import os
+import sys
+import tempfile
+import numpy as np
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+import utils
+from exceptions import MatrixProviderError
+from matrix_providers import LocalGraphProvider, MatrixProvider
+# pylint: enable=wrong-import-position
+
+GRID_SIZE = 4
+CONTEXT = {'location': 'test_location', 'logger': None}
+
+
+def grid_graph():
+    '''
+    Grid of GRID_SIZE x GRID_SIZE nodes with two-way segments between neighbours,
+    horizontal segments are twice as fast as vertical ones
+    '''
+    coordinates = [
+        [32.74 + row * 0.002, -117.10 + column * 0.002]
+        for row in range(GRID_SIZE) for column in range(GRID_SIZE)
+    ]
+    edges, distances, times = [], [], []
+    for node, (row, column) in enumerate(
+        (row, column) for row in range(GRID_SIZE) for column in range(GRID_SIZE)
+    ):
+        for neighbour_row, neighbour_column, speed in [(row + 1, column, 5), (row, column + 1, 10)]:
+            if neighbour_row < GRID_SIZE and neighbour_column < GRID_SIZE:
+                neighbour = neighbour_row * GRID_SIZE + neighbour_column
+                distance = utils.calc_dist(coordinates[node], coordinates[neighbour])
+                for from_node, to_node in [(node, neighbour), (neighbour, node)]:
+                    edges += [[from_node, to_node]]
+                    distances += [distance]
+                    times += [distance / speed]
+    # Slower parallel segment is ignored
+    edges += [[0, 1]]
+    distances += [1]
+    times += [1000]
+    return coordinates, edges, distances, times
+
+
+def floyd_warshall(n_nodes, edges, distances, times):
+    best = [[(0, 0) if i == j else (float('inf'), 0) for j in range(n_nodes)] for i in range(n_nodes)]
+    for (from_node, to_node), distance, travel_time in zip(edges, distances, times):
+        best[from_node][to_node] = min(best[from_node][to_node], (travel_time, distance))
+    for middle in range(n_nodes):
+        for i in range(n_nodes):
+            for j in range(n_nodes):
+                through = (
+                    best[i][middle][0] + best[middle][j][0], best[i][middle][1] + best[middle][j][1]
+                )
+                if through[0] < best[i][j][0] - 1e-9:
+                    best[i][j] = through
+    return best
+
+
+class TestLocalGraphProvider(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        os.environ['ROAD_GRAPH_DIR'] = self.directory.name
+        self.coordinates, edges, distances, times = grid_graph()
+        np.savez(
+            os.path.join(self.directory.name, 'test_location.npz'),
+            coordinates=np.array(self.coordinates), edges=np.array(edges),
+            distances=np.array(distances), times=np.array(times)
+        )
+        self.expected = floyd_warshall(len(self.coordinates), edges, distances, times)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_matches_shortest_paths(self):
+        provider = LocalGraphProvider('test_location')
+        self.assertTrue(provider.is_available())
+        from_nodes = [0, 5, 15]
+        to_nodes = [0, 3, 10, 12]
+        distances, times = provider.get_matrix(
+            [self.coordinates[node] for node in from_nodes],
+            [self.coordinates[node] for node in to_nodes],
+            'car', CONTEXT
+        )
+        for row, from_node in enumerate(from_nodes):
+            for column, to_node in enumerate(to_nodes):
+                expected_time, expected_distance = self.expected[from_node][to_node]
+                self.assertAlmostEqual(times[row][column], expected_time, places=3)
+                self.assertAlmostEqual(distances[row][column], expected_distance, places=3)
+
+    def test_provider_interface_is_abstract(self):
+        class PartialProvider(MatrixProvider):
+            def is_available(self):
+                return True
+
+        with self.assertRaises(TypeError):
+            PartialProvider()
+
+    def test_unavailable_without_graph(self):
+        self.assertFalse(LocalGraphProvider('other_location').is_available())
+
+    def test_disconnected_points(self):
+        coordinates = self.coordinates + [[33.0, -117.0]]
+        np.savez(
+            os.path.join(self.directory.name, 'test_location.npz'),
+            coordinates=np.array(coordinates), edges=np.array([[0, 1]]),
+            distances=np.array([1.0]), times=np.array([1.0])
+        )
+        provider = LocalGraphProvider('test_location')
+        with self.assertRaises(MatrixProviderError):
+            provider.get_matrix([coordinates[0]], [coordinates[-1]], 'car', CONTEXT)
+
+
+if __name__ == '__main__':
+    unittest.main()
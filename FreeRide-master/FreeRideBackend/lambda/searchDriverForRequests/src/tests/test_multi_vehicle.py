@@ -0,0 +1,108 @@
+import unittest
+import sys
+import random
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+import multi_vehicle
+import route
+import utils
+from tsp import TSP
+# pylint: enable=wrong-import-position
+
+
+def random_coordinates(rand):
+    return [32.745 + rand.uniform(-0.02, 0.02), -117.10 + rand.uniform(-0.02, 0.02)]
+
+
+def driver_data_model(seed, request_actions):
+    rand = random.Random(seed)
+    stops = [{
+        'stopType': 'current_location', 'status': 'done',
+        'coordinates': random_coordinates(rand), 'passengers': 0, 'ADApassengers': 0
+    }]
+    for ride_idx in range(rand.randint(0, 3)):
+        ride = {'ride': f'{seed}_{ride_idx}', 'passengers': 1, 'ADApassengers': 0}
+        for stop_type in ['pickup', 'dropoff']:
+            stops += [dict(
+                ride, stopType=stop_type, status='waiting', coordinates=random_coordinates(rand)
+            )]
+    stops += request_actions
+
+    data = {
+        'nodes': stops,
+        'distance_matrix': [
+            [utils.calc_dist(from_stop['coordinates'], to_stop['coordinates']) for to_stop in stops]
+            for from_stop in stops
+        ],
+        'profile': 'euclidean_dist'
+    }
+    for line in data['distance_matrix']:
+        line[0] = 0
+    [
+        data['pickups_deliveries'],
+        data['pickup_dict'],
+        data['lone_dropoffs'],
+        data['picked_up_passengers'],
+        data['picked_up_ada_passengers'],
+    ] = route.group_pickup_deliveries(stops)
+    data['close_nodes'] = route.group_close_nodes(data)
+    data['num_vehicles'] = 1
+    data['depot'] = 0
+    data['ride_capacity'] = 3
+    data['passenger_capacity'] = 5
+    data['ada_passenger_capacity'] = 0
+    data['keep_first_stop'] = False
+    data['initial_route'] = route.get_initial_route(data, request_node_count=2)
+    return data
+
+
+class TestMultiVehicle(unittest.TestCase):
+    def setUp(self):
+        self.request_actions = utils.build_request_actions({
+            '_id': 'request', 'isADA': False, 'passengers': 1,
+            'pickupLatitude': 32.75, 'pickupLongitude': -117.09,
+            'dropoffLatitude': 32.74, 'dropoffLongitude': -117.11
+        })
+
+    def test_merge_keeps_driver_stops_in_driver_vehicle(self):
+        for seed in range(10):
+            data_models = [
+                driver_data_model(seed * 10 + idx, self.request_actions) for idx in range(4)
+            ]
+            merged_data_model, node_maps = multi_vehicle.merge_data_models(data_models, 2)
+            merged_data_model['search_profile'] = 'fast'
+            assignment, routes, _ = TSP().solve_vehicles(merged_data_model)
+            self.assertTrue(assignment)
+
+            vehicle_id = multi_vehicle.get_request_vehicle(routes, node_maps)
+            self.assertIsNotNone(vehicle_id)
+            for idx, (data_model, node_map) in enumerate(zip(data_models, node_maps)):
+                order = multi_vehicle.get_vehicle_order(routes[idx], node_map)
+                own_count = len(data_model['nodes']) - 2
+                expected_nodes = list(range(len(data_model['nodes'])))
+                if idx != vehicle_id:
+                    expected_nodes = expected_nodes[:own_count]
+                self.assertEqual(sorted(order), expected_nodes)
+                self.assertEqual(order[0], 0)
+
+    def test_initial_routes_insert_request_once(self):
+        data_models = [driver_data_model(idx, self.request_actions) for idx in range(4)]
+        merged_data_model, node_maps = multi_vehicle.merge_data_models(data_models, 2)
+        request_nodes = node_maps[0][-2:]
+        initial_routes = merged_data_model['initial_routes']
+        self.assertEqual(
+            sum(request_nodes[0] in vehicle_route for vehicle_route in initial_routes), 1
+        )
+        self.assertEqual(
+            sorted(node for vehicle_route in initial_routes for node in vehicle_route),
+            sorted(
+                set(range(len(merged_data_model['nodes'])))
+                - {vehicle['start'] for vehicle in merged_data_model['vehicles']}
+            )
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+import unittest
+import sys
+import copy
+import random
+import numpy as np
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+import route
+import utils
+# pylint: enable=wrong-import-position
+
+# Stops are placed around a few points so some pickups are close to dropoffs
+POINTS = [[32.745 + 0.003 * idx, -117.10 + 0.002 * (idx % 3)] for idx in range(6)]
+RIDE_STATUSES = {
+    'done': ['done', 'done'],
+    'picked_up': ['done', 'waiting'],
+    'waiting': ['waiting', 'waiting'],
+    'cancelled': ['cancelled', 'cancelled'],
+    'onboard': [None, 'waiting']
+}
+
+
+def random_coordinates(rand):
+    point = rand.choice(POINTS)
+    return [point[0] + rand.uniform(-0.0001, 0.0001), point[1] + rand.uniform(-0.0001, 0.0001)]
+
+
+def random_route(seed):
+    '''
+    Driver route with rides in every status, interleaved with pickups before dropoffs
+    and ids that are not strings yet, as read from the database
+    '''
+    rand = random.Random(seed)
+    ride_stops = []
+    for ride_idx in range(rand.randint(0, 6)):
+        ride = {'ride': 1000 + ride_idx, 'passengers': rand.randint(1, 3), 'ADApassengers': 0}
+        if rand.random() < 0.2:
+            ride['ADApassengers'] = 1
+        stops = []
+        statuses = RIDE_STATUSES[rand.choice(list(RIDE_STATUSES))]
+        for stop_type, status in zip(['pickup', 'dropoff'], statuses):
+            if status is None:
+                continue
+            stop = dict(
+                ride, _id=rand.randint(0, 10**6), stopType=stop_type, status=status,
+                coordinates=random_coordinates(rand)
+            )
+            if rand.random() < 0.4:
+                stop['fixedStopId'] = rand.randint(0, 3)
+            stops += [stop]
+        ride_stops += [stops]
+    if rand.random() < 0.3:
+        ride_stops += [[{
+            'stopType': 'current_location', 'status': 'done',
+            'coordinates': random_coordinates(rand), 'passengers': 0, 'ADApassengers': 0
+        }]]
+
+    route_ = []
+    while any(ride_stops):
+        stops = rand.choice([stops for stops in ride_stops if stops])
+        route_ += [stops.pop(0)]
+    return route_
+
+
+def random_request_actions(rand):
+    if rand.random() < 0.3:
+        return None
+    request = {'request_id': 'request', 'passengers': rand.randint(1, 2), 'ADApassengers': 0}
+    return [
+        dict(request, stopType=stop_type, status='waiting', coordinates=random_coordinates(rand))
+        for stop_type in ['pickup', 'dropoff']
+    ]
+
+
+def current_location(rand):
+    return {
+        'stopType': 'current_location', 'status': 'done', 'coordinates': random_coordinates(rand),
+        'cost': 0, 'distance': 0, 'passengers': 0, 'ADApassengers': 0
+    }
+
+
+def reference_close_nodes(data):
+    '''
+    Close nodes as pickups within 30 meters of each dropoff, visiting every matrix cell
+    '''
+    close_nodes = []
+    for dropoff, stop in enumerate(data['nodes']):
+        if stop['stopType'] != 'dropoff':
+            continue
+        pickup = data['pickup_dict'].get(dropoff, -1)
+        for node, distance in enumerate(data['distance_matrix'][dropoff]):
+            if (
+                node not in [0, pickup, dropoff]
+                and data['nodes'][node]['stopType'] == 'pickup' and distance <= 30
+            ):
+                close_nodes += [[pickup, dropoff, node]]
+    return close_nodes
+
+
+class TestRoutePreprocessing(unittest.TestCase):
+    def test_matches_route_helpers(self):
+        for seed in range(300):
+            rand = random.Random(seed)
+            route_ = random_route(seed)
+            location = current_location(rand)
+            request_actions = random_request_actions(rand)
+
+            helper_route = copy.deepcopy(route_)
+            prefix_route, remaining_route, stops = route.get_unfulfilled_stops(
+                helper_route, location, request_actions=request_actions
+            )
+            [
+                pickups_deliveries, pickup_dict, lone_dropoffs,
+                picked_up_passengers, picked_up_ada_passengers
+            ] = route.group_pickup_deliveries(stops)
+            stop_types, stop_statuses, _ = route.encode_stops(stops)
+            demands = route.get_demands({
+                'nodes': stops, 'lone_dropoffs': lone_dropoffs,
+                'picked_up_passengers': picked_up_passengers,
+                'picked_up_ada_passengers': picked_up_ada_passengers
+            })
+
+            fused_route = copy.deepcopy(route_)
+            route_info = route.preprocess_route(
+                fused_route, location, request_actions=request_actions
+            )
+
+            self.assertEqual(fused_route, helper_route, seed)
+            self.assertEqual(route_info['prefix_route'], prefix_route, seed)
+            self.assertEqual(route_info['remaining_route'], remaining_route, seed)
+            self.assertEqual(route_info['stops'], stops, seed)
+            self.assertEqual(route_info['pickups_deliveries'].tolist(), pickups_deliveries, seed)
+            self.assertEqual(list(route_info['pickup_dict'].items()), list(pickup_dict.items()))
+            self.assertEqual(route_info['lone_dropoffs'], lone_dropoffs, seed)
+            self.assertEqual(route_info['picked_up_passengers'], picked_up_passengers, seed)
+            self.assertEqual(route_info['picked_up_ada_passengers'], picked_up_ada_passengers)
+            self.assertEqual(
+                route_info['dropoff_stop_limit'],
+                route.get_stop_limit_for_picked_up(prefix_route, lone_dropoffs), seed
+            )
+            self.assertEqual(
+                [route_info['completed_fixed_stops'], route_info['to_do_fixed_stops']],
+                route.split_fixed_stops_by_status(helper_route), seed
+            )
+            np.testing.assert_array_equal(route_info['stop_types'], stop_types)
+            np.testing.assert_array_equal(route_info['stop_statuses'], stop_statuses)
+            np.testing.assert_array_equal(route_info['demands'], demands)
+
+            data = {
+                'nodes': stops, 'stop_types': route_info['stop_types'],
+                'pickup_dict': route_info['pickup_dict'],
+                'distance_matrix': utils.calc_dist_matrix(
+                    [stop['coordinates'] for stop in stops]
+                )
+            }
+            self.assertEqual(
+                route.group_close_nodes(data).tolist(), reference_close_nodes(data), seed
+            )
+
+    def test_stop_limits_of_picked_up_rides(self):
+        done_plan = [
+            {'stopType': 'pickup', 'status': 'done', 'ride': 'a', 'fixedStopId': 'fs1'},
+            {'stopType': 'pickup', 'status': 'done', 'ride': 'b', 'fixedStopId': 'fs1'},
+            {'stopType': 'pickup', 'status': 'done', 'ride': 'c'},
+            {'stopType': 'dropoff', 'status': 'done', 'ride': 'c'},
+        ]
+        stops = [
+            {'stopType': 'current_location', 'status': 'done', 'passengers': 0, 'ADApassengers': 0},
+            {
+                'stopType': 'dropoff', 'status': 'waiting', 'ride': 'a',
+                'passengers': 1, 'ADApassengers': 0
+            },
+            {
+                'stopType': 'dropoff', 'status': 'waiting', 'ride': 'b',
+                'passengers': 2, 'ADApassengers': 1
+            }
+        ]
+        route_info = route.index_stops(stops, done_plan)
+        # Same fixed-stop as the pickup of a does not count, ride c counts twice for a and b
+        self.assertEqual(route_info['dropoff_stop_limit'], {'a': [1, 1], 'b': [2, 1]})
+        self.assertEqual(route_info['demands'][0].tolist(), [2, 3, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
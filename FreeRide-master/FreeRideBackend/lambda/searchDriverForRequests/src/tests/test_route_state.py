@@ -0,0 +1,81 @@
+import unittest
+import sys
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+from route_state import RouteStateStore
+# pylint: enable=wrong-import-position
+
+NOW = 1700000000
+A = [-9.14, 38.71]
+B = [-9.15, 38.72]
+C = [-9.16, 38.73]
+
+
+def stop(ride, stop_type, coordinates):
+    return {'ride': ride, 'stopType': stop_type, 'coordinates': coordinates}
+
+
+def fetched(coordinates):
+    size = len(coordinates)
+    return {
+        'coordinates': coordinates,
+        'distances': [[10 * row + column for column in range(size)] for row in range(size)],
+        'times': [[row + column for column in range(size)] for row in range(size)],
+        'profile': 'car'
+    }
+
+
+class TestRouteState(unittest.TestCase):
+    def test_keeps_matrix_of_waiting_stops(self):
+        store = RouteStateStore()
+        stops = [stop('r1', 'pickup', A), stop('r1', 'dropoff', C)]
+        self.assertEqual(store.update('d1', stops, fetched([A, B, C]), now=NOW), 'new')
+
+        matrix, = store.known_matrices('d1', now=NOW)
+        self.assertEqual(matrix['coordinates'], [A, C])
+        self.assertEqual(matrix['distances'].tolist(), [[0, 2], [20, 22]])
+        self.assertEqual(matrix['times'].tolist(), [[0, 2], [2, 4]])
+        self.assertEqual(matrix['profile'], 'car')
+
+    def test_fingerprint_status(self):
+        store = RouteStateStore()
+        stops = [stop('r1', 'pickup', A), stop('r1', 'dropoff', B)]
+        store.update('d1', stops, fetched([A, B]), now=NOW)
+        self.assertEqual(store.update('d1', stops, fetched([A, B]), now=NOW), 'unchanged')
+        stops[1] = stop('r1', 'dropoff', C)
+        self.assertEqual(store.update('d1', stops, fetched([A, C]), now=NOW), 'changed')
+        self.assertEqual(store.update('d1', stops, None, now=NOW), 'unchanged')
+
+    def test_eviction(self):
+        store = RouteStateStore(max_drivers=2, ttl=60)
+        stops = [stop('r1', 'pickup', A)]
+        for driver_id in ('d1', 'd2', 'd3'):
+            store.update(driver_id, stops, fetched([A]), now=NOW)
+        self.assertEqual(store.known_matrices('d1', now=NOW), [])
+        self.assertEqual(len(store.known_matrices('d2', now=NOW)), 1)
+        self.assertEqual(store.known_matrices('d2', now=NOW + 61), [])
+
+        store.evict('d3')
+        self.assertEqual(store.known_matrices('d3', now=NOW), [])
+        self.assertEqual(store.stats(), {'route_states': 0})
+
+    def test_expires_with_matrix_cache_cells(self):
+        store = RouteStateStore(ttl=600, bucket_minutes=15)
+        stops = [stop('r1', 'pickup', A)]
+        # NOW is 100 seconds before the end of its 15 minute time-of-day bucket
+        store.update('d1', stops, fetched([A]), now=NOW)
+        self.assertEqual(len(store.known_matrices('d1', now=NOW + 99)), 1)
+        self.assertEqual(store.known_matrices('d1', now=NOW + 100), [])
+
+        # Updates built from the known matrix keep the first fetch time
+        store.update('d2', stops, fetched([A]), now=NOW - 500)
+        store.update('d2', stops, fetched([A]), now=NOW - 200)
+        self.assertEqual(len(store.known_matrices('d2', now=NOW + 99)), 1)
+        store.update('d3', stops, fetched([A]), now=NOW - 700)
+        self.assertEqual(store.known_matrices('d3', now=NOW - 99), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
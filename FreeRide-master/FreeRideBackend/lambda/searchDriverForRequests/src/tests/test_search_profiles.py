@@ -0,0 +1,61 @@
+import unittest
+import sys
+from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+from search_profiles import SEARCH_PROFILES, DEFAULT_SEARCH_PROFILE
+from tsp import TSP
+from test_tsp_exact import random_data_model
+# pylint: enable=wrong-import-position
+
+
+def search_parameters(profile_name):
+    # pylint: disable=protected-access
+    return TSP()._TSP__build_search_parameters(profile_name)
+    # pylint: enable=protected-access
+
+
+class TestSearchProfiles(unittest.TestCase):
+    def test_profiles_set_search_parameters(self):
+        defaults = pywrapcp.DefaultRoutingSearchParameters()
+        # pylint: disable=no-member
+        strategies = routing_enums_pb2.FirstSolutionStrategy
+        metaheuristics = routing_enums_pb2.LocalSearchMetaheuristic
+        for name, profile in SEARCH_PROFILES.items():
+            parameters = search_parameters(name)
+            self.assertEqual(
+                parameters.first_solution_strategy,
+                getattr(strategies, profile['first_solution_strategy']),
+                name
+            )
+            metaheuristic = defaults.local_search_metaheuristic
+            if profile['local_search_metaheuristic']:
+                metaheuristic = getattr(metaheuristics, profile['local_search_metaheuristic'])
+            self.assertEqual(parameters.local_search_metaheuristic, metaheuristic, name)
+            self.assertEqual(
+                parameters.time_limit.ToMilliseconds(),
+                profile['time_limit_ms'] or defaults.time_limit.ToMilliseconds(), name
+            )
+            self.assertEqual(
+                parameters.solution_limit, profile['solution_limit'] or defaults.solution_limit,
+                name
+            )
+        # pylint: enable=no-member
+
+    def test_unknown_profile_is_default(self):
+        self.assertEqual(search_parameters('unknown'), search_parameters(DEFAULT_SEARCH_PROFILE))
+        self.assertEqual(search_parameters(None), search_parameters(DEFAULT_SEARCH_PROFILE))
+
+    def test_every_profile_solves(self):
+        for name in SEARCH_PROFILES:
+            data = random_data_model(1)
+            data['search_profile'] = name
+            assignment, order = TSP().solve(data)
+            self.assertTrue(assignment, name)
+            self.assertEqual(sorted(order), list(range(len(data['nodes']))), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+import sys
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+import route
+import utils
+from tsp import TSP
+# pylint: enable=wrong-import-position
+
+
+def data_model(pickup_passengers):
+    '''
+    Driver with a picked up passenger, next stop is the pickup of
+    a waiting ride with pickup_passengers in a vehicle with capacity 3
+    '''
+    stops = [
+        {
+            'stopType': 'current_location', 'status': 'done',
+            'coordinates': [32.745, -117.10], 'passengers': 0, 'ADApassengers': 0
+        },
+        {
+            'stopType': 'pickup', 'status': 'waiting', 'ride': 'waiting',
+            'coordinates': [32.746, -117.10], 'passengers': pickup_passengers, 'ADApassengers': 0
+        },
+        {
+            'stopType': 'dropoff', 'status': 'waiting', 'ride': 'picked',
+            'coordinates': [32.755, -117.10], 'passengers': 1, 'ADApassengers': 0
+        },
+        {
+            'stopType': 'dropoff', 'status': 'waiting', 'ride': 'waiting',
+            'coordinates': [32.765, -117.10], 'passengers': pickup_passengers, 'ADApassengers': 0
+        }
+    ]
+    data = {
+        'nodes': stops,
+        'distance_matrix': [
+            [utils.calc_dist(from_stop['coordinates'], to_stop['coordinates']) for to_stop in stops]
+            for from_stop in stops
+        ]
+    }
+    for line in data['distance_matrix']:
+        line[0] = 0
+    [
+        data['pickups_deliveries'],
+        data['pickup_dict'],
+        data['lone_dropoffs'],
+        data['picked_up_passengers'],
+        data['picked_up_ada_passengers'],
+    ] = route.group_pickup_deliveries(stops)
+    data['close_nodes'] = route.group_close_nodes(data)
+    data['num_vehicles'] = 1
+    data['depot'] = 0
+    data['ride_capacity'] = 3
+    data['passenger_capacity'] = 3
+    data['ada_passenger_capacity'] = 0
+    data['keep_first_stop'] = True
+    data['search_profile'] = 'quality'
+    return data
+
+
+class TestSoftConstraints(unittest.TestCase):
+    def test_infeasible_hard_constraint(self):
+        assignment, _, _ = TSP().solve_vehicles(data_model(3))
+        self.assertFalse(assignment)
+
+    def test_relaxes_only_infeasible_constraint(self):
+        data = data_model(3)
+        data['soft_constraints'] = ['close_nodes', 'keep_first_stop']
+        assignment, routes, relaxed_constraints = TSP().solve_vehicles(data)
+        self.assertTrue(assignment)
+        self.assertEqual(routes[0], [0, 2, 1, 3])
+        self.assertEqual(relaxed_constraints, ['keep_first_stop'])
+
+    def test_feasible_model_relaxes_nothing(self):
+        data = data_model(2)
+        data['soft_constraints'] = ['close_nodes', 'keep_first_stop']
+        assignment, routes, relaxed_constraints = TSP().solve_vehicles(data)
+        self.assertTrue(assignment)
+        self.assertEqual(routes[0][1], 1)
+        self.assertEqual(relaxed_constraints, [])
+
+    def test_hailed_capacity(self):
+        data = data_model(2)
+        data['soft_constraints'] = ['hailed_capacity']
+        data['strict_capacity'] = {'passenger_capacity': 1, 'ada_passenger_capacity': 0}
+        assignment, _, relaxed_constraints = TSP().solve_vehicles(data)
+        self.assertTrue(assignment)
+        self.assertEqual(relaxed_constraints, ['hailed_capacity'])
+
+        data['strict_capacity']['passenger_capacity'] = 3
+        assignment, _, relaxed_constraints = TSP().solve_vehicles(data)
+        self.assertTrue(assignment)
+        self.assertEqual(relaxed_constraints, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
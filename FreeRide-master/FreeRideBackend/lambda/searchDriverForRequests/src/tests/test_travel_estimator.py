@@ -0,0 +1,89 @@
+import unittest
+import sys
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+import utils
+from travel_estimator import (
+    TravelEstimator, shortlist, DEFAULT_M_PER_SECOND, MIN_CALIBRATION_CELLS
+)
+# pylint: enable=wrong-import-position
+
+POINTS = [[32.70 + 0.01 * idx, -117.10 + 0.005 * (idx % 3)] for idx in range(8)]
+
+
+def calibrated_estimator(detour_factor, m_per_second):
+    estimator = TravelEstimator()
+    geodesic = utils.calc_dist_matrix(POINTS)
+    distances = geodesic * detour_factor
+    estimator.calibrate('loc', 'car', POINTS, POINTS, distances, distances / m_per_second)
+    return estimator
+
+
+class TestTravelEstimator(unittest.TestCase):
+    def test_uncalibrated_defaults(self):
+        estimator = TravelEstimator()
+        distances, times = estimator.estimate('loc', 'car', [[0, 1000], [1000, 0]])
+        self.assertEqual(distances[0][1], 1000)
+        self.assertAlmostEqual(times[0][1], 1000 / DEFAULT_M_PER_SECOND)
+        self.assertIsNone(estimator.estimate_detour('loc', 'car', 500))
+
+    def test_calibrated_factors(self):
+        # 56 cells between distinct points
+        self.assertGreaterEqual(len(POINTS) * (len(POINTS) - 1), MIN_CALIBRATION_CELLS)
+        estimator = calibrated_estimator(1.4, 8)
+        distances, times = estimator.estimate('loc', 'car', [[0, 1000]])
+        self.assertAlmostEqual(distances[0][1], 1400)
+        self.assertAlmostEqual(times[0][1], 175)
+        detour, deviation = estimator.estimate_detour('loc', 'car', 1000)
+        self.assertAlmostEqual(detour, 1400)
+        self.assertAlmostEqual(deviation, 0)
+        # Other profiles are not calibrated
+        self.assertEqual(estimator.estimate('loc', 'bike', [[0, 1000]])[0][0][1], 1000)
+
+    def test_calibrated_with_distance_mode(self):
+        # Haversine geodesic distances are shorter than ellipsoid ones at this latitude
+        estimator = TravelEstimator()
+        distances = utils.calc_dist_matrix(POINTS, mode='haversine')
+        estimator.calibrate('loc', 'car', POINTS, POINTS, distances, distances / 8, 'haversine')
+        self.assertAlmostEqual(estimator.factors('loc', 'car')[0], 1)
+        estimator = TravelEstimator()
+        estimator.calibrate('loc', 'car', POINTS, POINTS, distances, distances / 8)
+        self.assertNotAlmostEqual(estimator.factors('loc', 'car')[0], 1, places=4)
+
+    def test_detour_deviation(self):
+        # Cells between points of different index parity take twice the road distance
+        estimator = TravelEstimator()
+        factors = [
+            [1 + (row + column) % 2 for column in range(len(POINTS))] for row in range(len(POINTS))
+        ]
+        distances = utils.calc_dist_matrix(POINTS) * factors
+        estimator.calibrate('loc', 'car', POINTS, POINTS, distances, distances / 8)
+        # 32 of the 56 cells between distinct points have a factor of 2
+        detour, deviation = estimator.estimate_detour('loc', 'car', 1000)
+        self.assertAlmostEqual(detour, 1000 * (1 + 32 / 56))
+        self.assertAlmostEqual(deviation, 1000 * (32 / 56 * 24 / 56) ** 0.5)
+
+    def test_shortlist(self):
+        detours = [[100, 0], [110, 0], [150, 0], [300, 0], [90, 0]]
+        self.assertEqual(shortlist(['a', 'b', 'c', 'd', 'e'], detours, 2), ['e', 'a', 'b', 'c'])
+        self.assertEqual(shortlist(['a', 'b', 'c', 'd', 'e'], detours, 2, 0.2), ['e', 'a', 'b'])
+        self.assertEqual(shortlist(['a', 'b'], detours[:2], 2), ['a', 'b'])
+        # Uncertain estimates keep drivers that may be close to the best ones
+        uncertain = [[detour, detour / 4] for detour, _ in detours]
+        self.assertEqual(
+            shortlist(['a', 'b', 'c', 'd', 'e'], uncertain, 2, 0.2), ['e', 'a', 'b', 'c']
+        )
+        self.assertEqual(
+            shortlist(['a', 'b', 'c', 'd', 'e'], uncertain, 2, 0.2, 0), ['e', 'a', 'b']
+        )
+        # Uncalibrated detours keep every driver
+        detours[3] = None
+        self.assertEqual(
+            shortlist(['a', 'b', 'c', 'd', 'e'], detours, 2), ['a', 'b', 'c', 'd', 'e']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+import sys
+import random
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+import route
+import utils
+from tsp import TSP
+from tsp_exact import ExactTSP
+# pylint: enable=wrong-import-position
+
+
+def random_coordinates(rand):
+    return [32.745 + rand.uniform(-0.02, 0.02), -117.10 + rand.uniform(-0.02, 0.02)]
+
+
+def random_data_model(seed):
+    rand = random.Random(seed)
+    stops = [{
+        'stopType': 'current_location', 'status': 'done',
+        'coordinates': random_coordinates(rand), 'passengers': 0, 'ADApassengers': 0
+    }]
+    for ride_idx in range(rand.randint(0, 2)):
+        stops += [{
+            'stopType': 'dropoff', 'status': 'waiting', 'ride': f'picked_{ride_idx}',
+            'coordinates': random_coordinates(rand), 'passengers': 1, 'ADApassengers': 0
+        }]
+    for ride_idx in range(rand.randint(1, 3)):
+        ride = {'ride': f'waiting_{ride_idx}', 'passengers': rand.randint(1, 2), 'ADApassengers': 0}
+        for stop_type in ['pickup', 'dropoff']:
+            stop = dict(
+                ride, stopType=stop_type, status='waiting', coordinates=random_coordinates(rand)
+            )
+            if rand.random() < 0.3:
+                stop['fixedStopId'] = f'fs_{rand.randint(0, 2)}'
+            stops += [stop]
+
+    data = {
+        'nodes': stops,
+        'distance_matrix': [
+            [utils.calc_dist(from_stop['coordinates'], to_stop['coordinates']) for to_stop in stops]
+            for from_stop in stops
+        ]
+    }
+    for line in data['distance_matrix']:
+        line[0] = 0
+    [
+        data['pickups_deliveries'],
+        data['pickup_dict'],
+        data['lone_dropoffs'],
+        data['picked_up_passengers'],
+        data['picked_up_ada_passengers'],
+    ] = route.group_pickup_deliveries(stops)
+    data['dropoff_stop_limit'] = {
+        ride_id: [dropoff_idx, rand.randint(0, 3)] for ride_id, dropoff_idx in data['lone_dropoffs']
+    }
+    data['close_nodes'] = route.group_close_nodes(data)
+    data['num_vehicles'] = 1
+    data['depot'] = 0
+    data['ride_capacity'] = rand.randint(2, 3)
+    data['passenger_capacity'] = rand.randint(2, 5)
+    data['ada_passenger_capacity'] = 0
+    data['keep_first_stop'] = rand.random() < 0.3
+    data['search_profile'] = 'quality'
+    return data
+
+
+def route_cost(data, order):
+    return sum(
+        int(data['distance_matrix'][from_node][to_node])
+        for from_node, to_node in zip(order, order[1:])
+    )
+
+
+class TestExactTSP(unittest.TestCase):
+    def test_matches_or_improves_ortools(self):
+        for seed in range(30):
+            data = random_data_model(seed)
+            exact_assignment, exact_order = ExactTSP().solve(data)
+            assignment, order = TSP().solve(random_data_model(seed))
+            if assignment:
+                self.assertTrue(exact_assignment)
+                self.assertLessEqual(route_cost(data, exact_order), route_cost(data, order))
+            if exact_assignment:
+                self.assertEqual(exact_order[0], 0)
+                self.assertEqual(sorted(exact_order), list(range(len(data['nodes']))))
+
+    def test_exact_order_is_feasible_for_ortools(self):
+        for seed in range(30):
+            data = random_data_model(seed)
+            exact_assignment, exact_order = ExactTSP().solve(data)
+            if not exact_assignment:
+                continue
+            # Starting from the exact order, ortools can not find a shorter route
+            data['initial_route'] = exact_order[1:]
+            assignment, order = TSP().solve(data)
+            self.assertTrue(assignment)
+            self.assertEqual(route_cost(data, order), route_cost(data, exact_order))
+
+    def test_keep_first_stop(self):
+        for seed in range(30):
+            data = random_data_model(seed)
+            data['keep_first_stop'] = True
+            data['dropoff_stop_limit'] = {}
+            exact_assignment, exact_order = ExactTSP().solve(data)
+            if exact_assignment:
+                self.assertEqual(exact_order[1], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
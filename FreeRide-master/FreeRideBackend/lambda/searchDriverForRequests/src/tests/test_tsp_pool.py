@@ -0,0 +1,147 @@
+import unittest
+import sys
+import asyncio
+import logging
+import subprocess
+import time
+from unittest.mock import patch
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+import tsp_pool
+import utils
+from tsp_pool import TSPWorkerPool
+from test_tsp_exact import random_data_model
+# pylint: enable=wrong-import-position
+
+
+class FakeWorker:
+    '''
+    Stands in for a tsp_runner worker, answering the data model after a delay
+    '''
+    def is_alive(self):
+        return True
+
+    async def run_async(self, data_model, typ, timeout):
+        await asyncio.sleep(0.05)
+        return {'success': True, 'data_model': data_model, 'typ': typ}
+
+    def terminate(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestTSPPoolAsync(unittest.TestCase):
+    def setUp(self):
+        worker_patch = patch.object(tsp_pool, 'TSPWorker', FakeWorker)
+        worker_patch.start()
+        self.addCleanup(worker_patch.stop)
+
+    def test_more_callers_than_workers(self):
+        pool = TSPWorkerPool(size=2)
+
+        async def run_all():
+            return await asyncio.gather(*[
+                pool.run_async(idx, 'time', timeout=5) for idx in range(10)
+            ])
+
+        results = asyncio.run(asyncio.wait_for(run_all(), 5))
+        self.assertEqual([result['data_model'] for result in results], list(range(10)))
+        self.assertEqual(pool.idle_workers.qsize(), 2)
+        self.assertEqual(len(pool.waiters), 0)
+
+    def test_cancelled_callers_pass_workers_on(self):
+        pool = TSPWorkerPool(size=1)
+
+        async def run_all():
+            tasks = [
+                asyncio.create_task(pool.run_async(idx, 'time', timeout=5)) for idx in range(5)
+            ]
+            await asyncio.sleep(0.01)
+            tasks[1].cancel()
+            tasks[2].cancel()
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+        results = asyncio.run(asyncio.wait_for(run_all(), 5))
+        self.assertEqual(results[0]['data_model'], 0)
+        self.assertTrue(all(isinstance(result, asyncio.CancelledError) for result in results[1:3]))
+        self.assertEqual([result['data_model'] for result in results[3:]], [3, 4])
+        self.assertEqual(pool.idle_workers.qsize(), 1)
+        self.assertEqual(len(pool.waiters), 0)
+
+
+class TestTSPWorkerRespawn(unittest.TestCase):
+    def setUp(self):
+        self.pool = TSPWorkerPool(size=1)
+        self.addCleanup(self.pool.close)
+
+    def run_model(self, timeout=30):
+        return asyncio.run(self.pool.run_async(random_data_model(0), 'distance', timeout))
+
+    def idle_worker(self):
+        return self.pool.idle_workers.queue[0]
+
+    def test_solves_on_reused_worker(self):
+        worker = self.idle_worker()
+        for _ in range(3):
+            self.assertTrue(self.run_model()['success'])
+        self.assertIs(self.idle_worker(), worker)
+
+    def test_respawn_after_crash(self):
+        worker = self.idle_worker()
+        worker.process.kill()
+        worker.process.wait()
+        # Crashed while solving: the worker still looks alive when handed out
+        worker.is_alive = lambda: True
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.run_model()
+        self.assertIsNot(self.idle_worker(), worker)
+        self.assertTrue(self.run_model()['success'])
+
+    def test_respawn_of_dead_idle_worker(self):
+        worker = self.idle_worker()
+        worker.process.kill()
+        worker.process.wait()
+        self.assertTrue(self.run_model()['success'])
+        self.assertIsNot(self.idle_worker(), worker)
+
+    def test_respawn_after_timeout(self):
+        worker = self.idle_worker()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            self.run_model(timeout=0.001)
+        self.assertIsNot(self.idle_worker(), worker)
+        self.assertFalse(worker.is_alive())
+        self.assertTrue(self.run_model()['success'])
+
+
+class TestTSPTimeout(unittest.TestCase):
+    def test_profile_time_limit(self):
+        self.assertAlmostEqual(
+            utils.tsp_timeout({'search_profile': 'fast'}), 0.3 + utils.TSP_TIMEOUT_SLACK
+        )
+        self.assertAlmostEqual(
+            utils.tsp_timeout({'search_profile': 'quality'}), 5 + utils.TSP_TIMEOUT_SLACK
+        )
+        self.assertEqual(utils.tsp_timeout({}), utils.TSP_UNLIMITED_TIMEOUT)
+
+    def test_capped_by_deadline(self):
+        timeout = utils.tsp_timeout({'search_profile': 'quality'}, time.time() + 1)
+        self.assertLessEqual(timeout, 1)
+        self.assertGreater(timeout, 0.9)
+
+    def test_past_deadline_skips_pool(self):
+        context = {'location': 'loc', 'logger': logging.getLogger(), 'deadline': time.time() - 1}
+        data_model = {'profile': 'car', 'nodes': list(range(20))}
+        with patch.object(utils, 'get_tsp_pool') as get_pool, \
+                patch.object(utils, 'handle_exception') as handle_exception:
+            result = asyncio.run(utils.tsp_handler_async(context, data_model, 'time'))
+        self.assertEqual(result, [False, False, False])
+        get_pool.assert_not_called()
+        self.assertIsInstance(handle_exception.call_args[0][0], utils.TSPTimeoutError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import sys
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+import route
+from tsp import TSP
+from test_tsp_exact import random_data_model
+# pylint: enable=wrong-import-position
+
+
+def reference_transits(data):
+    '''
+    Transits of the former solver callbacks, node by node
+    '''
+    nodes = data['nodes']
+    size = len(nodes)
+
+    def fs_order(from_node, to_node):
+        if 'fixedStopId' in nodes[from_node] and 'fixedStopId' in nodes[to_node]:
+            if nodes[from_node]['fixedStopId'] == nodes[to_node]['fixedStopId']:
+                return 0
+        return 1
+
+    def demand(from_node, depot_value, key=None):
+        if from_node == 0:
+            return depot_value
+        sign = 1 if nodes[from_node]['stopType'] == 'pickup' else -1
+        return sign * (nodes[from_node][key] if key else 1)
+
+    return {
+        'distance': [
+            [int(data['distance_matrix'][from_node][to_node]) for to_node in range(size)]
+            for from_node in range(size)
+        ],
+        'order': [1] * size,
+        'fs_order': [
+            [fs_order(from_node, to_node) for to_node in range(size)] for from_node in range(size)
+        ],
+        'ride_capacity': [
+            demand(node, len(data['lone_dropoffs'])) for node in range(size)
+        ],
+        'passenger_capacity': [
+            demand(node, data['picked_up_passengers'], 'passengers') for node in range(size)
+        ],
+        'ada_passenger_capacity': [
+            demand(node, data['picked_up_ada_passengers'], 'ADApassengers')
+            for node in range(size)
+        ]
+    }
+
+
+def build_transits(data, switch_count=0):
+    # pylint: disable=protected-access
+    solver = TSP()
+    vehicles = solver._TSP__get_vehicles(data)
+    return solver._TSP__build_transits(data, vehicles, switch_count)
+    # pylint: enable=protected-access
+
+
+class TestTSPTransits(unittest.TestCase):
+    def test_match_callbacks(self):
+        for seed in range(50):
+            data = random_data_model(seed)
+            for node in data['nodes'][1:]:
+                node['ADApassengers'] = seed % 2
+            data['picked_up_ada_passengers'] = seed % 3
+            self.assertEqual(build_transits(data), reference_transits(data), seed)
+            # Same transits from the demands of the data model
+            data['demands'] = route.encode_stops(data['nodes'])[2]
+            self.assertEqual(build_transits(data), reference_transits(data), seed)
+
+    def test_switch_nodes_add_nothing(self):
+        data = random_data_model(3)
+        size = len(data['nodes'])
+        transits = build_transits(data, switch_count=2)
+        reference = reference_transits(data)
+        for name in ['distance', 'fs_order']:
+            self.assertEqual([line[:size] for line in transits[name][:size]], reference[name])
+            self.assertTrue(all(
+                value == 0 for line in transits[name][size:] for value in line
+            ))
+            self.assertTrue(all(line[size:] == [0, 0] for line in transits[name]))
+        for name in ['order', 'ride_capacity', 'passenger_capacity', 'ada_passenger_capacity']:
+            self.assertEqual(transits[name], reference[name] + [0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
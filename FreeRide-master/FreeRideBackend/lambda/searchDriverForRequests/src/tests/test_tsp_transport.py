@@ -0,0 +1,86 @@
+import unittest
+import sys
+import io
+import numpy as np
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+from tsp_transport import (
+    MIN_BUFFER_SIZE, MatrixBuffer, MatrixReader, encode_frame, read_frame
+)
+# pylint: enable=wrong-import-position
+
+
+def data_model(size):
+    return {
+        'nodes': [
+            {
+                'stopType': 'pickup', 'passengers': 1, 'ADApassengers': 0,
+                'coordinates': [32.7, -117.1], 'ride': f'ride_{idx}'
+            }
+            for idx in range(size)
+        ],
+        'distance_matrix': [
+            [float(row * size + column) for column in range(size)] for row in range(size)
+        ],
+        'time_matrix': np.arange(size * size, dtype=np.float64).reshape(size, size) / 2,
+        'close_nodes': np.array([[1, 2, 3]], dtype=np.int32),
+        'demands': np.ones((size, 3), dtype=np.int64),
+        'ride_capacity': 3,
+        'search_profile': 'fast'
+    }
+
+
+class TestTSPTransport(unittest.TestCase):
+    def setUp(self):
+        self.buffer = MatrixBuffer()
+        self.addCleanup(self.buffer.close)
+
+    def test_round_trip(self):
+        model = data_model(5)
+        request = self.buffer.write(model)
+        request = read_frame(io.BytesIO(encode_frame(request)))
+        # Matrices and arrays are not in the JSON header
+        self.assertEqual(
+            sorted(request['matrices']),
+            ['close_nodes', 'demands', 'distance_matrix', 'time_matrix']
+        )
+        self.assertNotIn('distance_matrix', request['data_model'])
+        result = MatrixReader().read(request)
+
+        np.testing.assert_array_equal(result['distance_matrix'], model['distance_matrix'])
+        np.testing.assert_array_equal(result['time_matrix'], model['time_matrix'])
+        np.testing.assert_array_equal(result['close_nodes'], model['close_nodes'])
+        np.testing.assert_array_equal(result['demands'], model['demands'])
+        self.assertEqual(result['distance_matrix'].dtype, np.float64)
+        self.assertEqual(result['close_nodes'].dtype, np.int32)
+        self.assertEqual(result['demands'].dtype, np.int64)
+        self.assertEqual([result['ride_capacity'], result['search_profile']], [3, 'fast'])
+        # Only the node attributes used by the solver are sent
+        self.assertEqual(
+            result['nodes'][0], {'stopType': 'pickup', 'passengers': 1, 'ADApassengers': 0}
+        )
+
+    def test_buffer_grows_and_is_reused(self):
+        reader = MatrixReader()
+        self.buffer.write(data_model(3))
+        self.assertEqual(self.buffer.size, MIN_BUFFER_SIZE)
+
+        model = data_model(100)
+        result = reader.read(self.buffer.write(model))
+        self.assertGreater(self.buffer.size, MIN_BUFFER_SIZE)
+        np.testing.assert_array_equal(result['time_matrix'], model['time_matrix'])
+
+        size = self.buffer.size
+        model = data_model(4)
+        result = reader.read(self.buffer.write(model))
+        self.assertEqual(self.buffer.size, size)
+        np.testing.assert_array_equal(result['distance_matrix'], model['distance_matrix'])
+
+    def test_closed_stream(self):
+        self.assertIsNone(read_frame(io.BytesIO(b'')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import sys
+from unittest.mock import patch
+
+sys.path.append("..")
+
+# pylint: disable=wrong-import-position
+import route
+import search_profiles
+from tsp import TSP
+from test_tsp_exact import random_data_model
+# pylint: enable=wrong-import-position
+
+# Stops at the first solution, which is the initial route when it is accepted
+FIRST_SOLUTION_PROFILE = dict(search_profiles.SEARCH_PROFILES['default'], solution_limit=1)
+
+
+def first_solution_data_model(seed, initial_route=None):
+    data = random_data_model(seed)
+    data['search_profile'] = 'first_solution'
+    if initial_route is not None:
+        data['initial_route'] = initial_route
+    return data
+
+
+class TestWarmStart(unittest.TestCase):
+    def setUp(self):
+        profiles_patch = patch.dict(
+            search_profiles.SEARCH_PROFILES, {'first_solution': FIRST_SOLUTION_PROFILE}
+        )
+        profiles_patch.start()
+        self.addCleanup(profiles_patch.stop)
+
+    def test_feasible_initial_route_is_accepted(self):
+        accepted = 0
+        for seed in range(30):
+            initial_route = route.get_initial_route(first_solution_data_model(seed), 2)
+            if initial_route is None:
+                continue
+            assignment, order = TSP().solve(first_solution_data_model(seed, initial_route))
+            self.assertTrue(assignment)
+            self.assertEqual(order, [0] + initial_route)
+            accepted += 1
+        self.assertGreater(accepted, 0)
+
+    def test_infeasible_initial_route_is_ignored(self):
+        for seed in range(30):
+            assignment, order = TSP().solve(first_solution_data_model(seed))
+            if not assignment:
+                continue
+            # Dropoffs come before their pickups in the reversed route
+            infeasible_route = list(reversed(order[1:]))
+            warm_assignment, warm_order = TSP().solve(
+                first_solution_data_model(seed, infeasible_route)
+            )
+            self.assertTrue(warm_assignment)
+            self.assertEqual(warm_order, order)
+            data = first_solution_data_model(seed)
+            for pickup, dropoff in data['pickups_deliveries']:
+                self.assertLess(warm_order.index(pickup), warm_order.index(dropoff))
+
+    def test_initial_route_without_feasible_insertion(self):
+        data = random_data_model(0)
+        data['passenger_capacity'] = 0
+        self.assertIsNone(route.get_initial_route(data, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
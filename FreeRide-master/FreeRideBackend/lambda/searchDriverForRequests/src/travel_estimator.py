@@ -0,0 +1,208 @@
+'''
+The Travel Estimator module estimates road distances and times from geodesic distances,
+calibrated by location and vehicle profile with the matrices fetched from the providers:
+- detour factor: road distance over geodesic distance of each fetched cell
+- speed: road distance over travel time of the fetched cells
+It replaces the fixed speed of the estimated time matrices and estimates the road detour
+of the drivers ranked by geodesic detour, so only those close enough to the best ones
+need a road matrix (see the tieredMatrixStrategy global setting). The detour factor deviation
+of the location sets how far apart the estimated detours must be to drop a driver
+'''
+import os
+import threading
+import numpy as np
+
+import utils
+
+# Estimates before a location and profile is calibrated
+DEFAULT_DETOUR_FACTOR = 1.0
+DEFAULT_M_PER_SECOND = 40000 / (60 * 60)
+# Cells between closer points are dominated by snapping to the road
+MIN_CALIBRATION_METERS = 100
+# Calibrated cells needed to estimate and weight kept for the cells seen so far
+MIN_CALIBRATION_CELLS = 50
+MAX_CALIBRATION_WEIGHT = 20000
+# Best ranked drivers always kept in the shortlist
+SHORTLIST_MIN_DRIVERS = 3
+# Fraction of the estimated detour of the last of those drivers
+# that other drivers can exceed it by and stay in the shortlist
+SHORTLIST_DETOUR_MARGIN = float(os.environ.get('SHORTLIST_DETOUR_MARGIN', 0.5))
+# Detour factor deviations of the uncertainty band around estimated detours
+SHORTLIST_DEVIATIONS = float(os.environ.get('SHORTLIST_DEVIATIONS', 1))
+
+
+class TravelCalibration:
+    '''
+    TravelCalibration keeps the weighted detour factor mean and variance and the
+    road distance and time sums of the cells seen, older cells weighting less
+    once MAX_CALIBRATION_WEIGHT is reached
+    '''
+    def __init__(self):
+        self.weight = 0
+        self.detour_sum = 0
+        self.detour_square_sum = 0
+        self.distance_sum = 0
+        self.time_sum = 0
+
+    def update(self, geodesic_distances, distances, times):
+        '''
+        Adds the cells of a fetched matrix
+        '''
+        geodesic_distances = np.asarray(geodesic_distances, dtype=np.float64)
+        distances = np.asarray(distances, dtype=np.float64)
+        times = np.asarray(times, dtype=np.float64)
+        valid = (
+            (geodesic_distances >= MIN_CALIBRATION_METERS)
+            & np.isfinite(distances) & np.isfinite(times) & (times > 0)
+        )
+        n_cells = int(valid.sum())
+        if n_cells == 0:
+            return
+
+        if self.weight + n_cells > MAX_CALIBRATION_WEIGHT:
+            decay = max(MAX_CALIBRATION_WEIGHT - n_cells, 0) / self.weight
+            self.weight *= decay
+            self.detour_sum *= decay
+            self.detour_square_sum *= decay
+            self.distance_sum *= decay
+            self.time_sum *= decay
+
+        detours = distances[valid] / geodesic_distances[valid]
+        self.weight += n_cells
+        self.detour_sum += detours.sum()
+        self.detour_square_sum += (detours ** 2).sum()
+        self.distance_sum += distances[valid].sum()
+        self.time_sum += times[valid].sum()
+
+    def is_calibrated(self):
+        '''
+        Checks if enough cells were seen to estimate
+        '''
+        return self.weight >= MIN_CALIBRATION_CELLS
+
+    def detour_factor(self):
+        '''
+        Returns the mean road over geodesic distance factor
+        '''
+        return self.detour_sum / self.weight
+
+    def detour_deviation(self):
+        '''
+        Returns the standard deviation of the detour factor
+        '''
+        variance = self.detour_square_sum / self.weight - self.detour_factor() ** 2
+        return float(np.sqrt(max(variance, 0)))
+
+    def m_per_second(self):
+        '''
+        Returns the mean road speed
+        '''
+        return self.distance_sum / self.time_sum
+
+
+class TravelEstimator:
+    '''
+    TravelEstimator keeps a TravelCalibration by location and vehicle profile
+    '''
+    def __init__(self):
+        self.calibrations = {}
+        self.lock = threading.Lock()
+
+    def calibrate(
+        self, location_id, profile, from_points, to_points, distances, times, mode='ellipsoid'
+    ):
+        '''
+        Adds the distances and times matrices fetched from each of from_points
+        to each of to_points to the calibration of location_id and profile,
+        geodesic distances are calculated with mode, as the matrices estimated from
+        '''
+        geodesic_distances = utils.calc_dist_matrix(from_points, to_points, mode=mode)
+        with self.lock:
+            self.calibrations.setdefault(
+                (str(location_id), profile), TravelCalibration()
+            ).update(geodesic_distances, distances, times)
+
+    def factors(self, location_id, profile):
+        '''
+        Returns the detour factor, its standard deviation (None if unknown)
+        and speed (m/s) of location_id and profile
+        '''
+        with self.lock:
+            calibration = self.calibrations.get((str(location_id), profile))
+            if calibration is None or not calibration.is_calibrated():
+                return [DEFAULT_DETOUR_FACTOR, None, DEFAULT_M_PER_SECOND]
+            return [
+                calibration.detour_factor(), calibration.detour_deviation(),
+                calibration.m_per_second()
+            ]
+
+    def estimate(self, location_id, profile, geodesic_matrix):
+        '''
+        Returns the estimated road distances and times matrices of a geodesic distances matrix
+        '''
+        detour_factor, _, m_per_second = self.factors(location_id, profile)
+        distances = np.asarray(geodesic_matrix, dtype=np.float64) * detour_factor
+        return [distances, distances / m_per_second]
+
+    def estimate_detour(self, location_id, profile, geodesic_detour):
+        '''
+        Returns the estimated road detour of a geodesic detour and its standard deviation,
+        None while location_id and profile is not calibrated
+        '''
+        detour_factor, deviation, _ = self.factors(location_id, profile)
+        if deviation is None:
+            return None
+        geodesic_detour = max(geodesic_detour, 0)
+        return [geodesic_detour * detour_factor, geodesic_detour * deviation]
+
+    def stats(self, location_id, profile):
+        '''
+        Returns the calibrated factors of location_id and profile
+        '''
+        detour_factor, deviation, m_per_second = self.factors(location_id, profile)
+        return {
+            'estimator_detour_factor': round(detour_factor, 4),
+            'estimator_detour_deviation': None if deviation is None else round(deviation, 4),
+            'estimator_m_per_second': round(m_per_second, 4)
+        }
+
+
+def shortlist(
+    driver_ids, detours, min_drivers=SHORTLIST_MIN_DRIVERS, margin=SHORTLIST_DETOUR_MARGIN,
+    deviations=SHORTLIST_DEVIATIONS
+):
+    '''
+    Receives driver ids and their estimated road detours and deviations
+    (see TravelEstimator.estimate_detour) and returns, sorted by estimated detour,
+    the ids of the min_drivers best drivers and of those that may be close to them:
+    the detour minus deviations times its deviation is at most margin above the detour
+    plus deviations times its deviation of the min_drivers-th best.
+    Estimates only rank drivers, every driver is kept if any detour is not estimated
+    '''
+    if len(driver_ids) <= min_drivers or any(detour is None for detour in detours):
+        return list(driver_ids)
+    order = sorted(range(len(driver_ids)), key=lambda idx: detours[idx][0])
+    last_detour, last_deviation = detours[order[min_drivers - 1]]
+    threshold = (last_detour + deviations * last_deviation) * (1 + margin)
+    return [
+        driver_ids[idx] for rank, idx in enumerate(order)
+        if rank < min_drivers or detours[idx][0] - deviations * detours[idx][1] <= threshold
+    ]
+
+
+_ESTIMATOR = None
+_ESTIMATOR_LOCK = threading.Lock()
+
+
+def get_travel_estimator():
+    '''
+    Returns the process-wide travel estimator, calibrated with the matrices
+    fetched since the process started, as the matrix cache
+    '''
+    # pylint: disable=global-statement
+    global _ESTIMATOR
+    # pylint: enable=global-statement
+    with _ESTIMATOR_LOCK:
+        if _ESTIMATOR is None:
+            _ESTIMATOR = TravelEstimator()
+        return _ESTIMATOR
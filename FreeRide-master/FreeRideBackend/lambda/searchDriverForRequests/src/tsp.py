@@ -2,9 +2,22 @@
 The TSP module contains the logic for the TSP (Travelling Salesman Problem) algorithm
 and node distance and cost functions as well as the processing of the result
 '''
-from datetime import timezone, timedelta, datetime
+import numpy as np
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
+import route
+from search_profiles import get_search_profile
+
+# Penalty of relaxing each soft constraint, above any route distance cost.
+# Constraints relaxed first by the retries in DriverFinder have the lowest penalties
+SOFT_CONSTRAINT_PENALTIES = {
+    'keep_first_stop': 10**7,
+    'close_nodes': 10**8,
+    'hailed_capacity': 10**8,
+    'dropoff_stop_limit': 10**9
+}
+# Added to the bound of a relaxed constraint, above any order, fixed-stop or capacity cumul
+RELAXED_BOUND = 1000
 
 
 class TSP:
@@ -13,33 +26,119 @@ class TSP:
     including distance and cost functions, target route cost
     and solution processing
     '''
-    def __process_solution(self, data, manager, routing, assignment, typ):
-        plan, route_distance = self.__get_plan_distance(data, routing, manager, assignment, typ)
-        return [plan, route_distance]
-
-    def __get_plan_distance(self, data, routing, manager, assignment, typ):
-        tsp_vehicle_id = 0
-        index = routing.Start(tsp_vehicle_id)
-        start_time = datetime.utcnow().replace(tzinfo=timezone.utc)
-        route_distance = [0]
-        route_cost = [0]
-        plan = []
-        current_time_span = 0
+    def __get_order(self, manager, routing, assignment, vehicle_id=0):
+        index = routing.Start(vehicle_id)
+        order = []
         while not routing.IsEnd(index):
-            plan += [data['nodes'][manager.IndexToNode(index)]]
-            previous_index = index
+            order += [manager.IndexToNode(index)]
             index = assignment.Value(routing.NextVar(index))
-            from_node = manager.IndexToNode(previous_index)
-            to_node = manager.IndexToNode(index)
-            if typ == "distance":
-                plan[-1]['cost'] = route_distance[-1]
-            else:
-                plan[-1]['distance'] = route_distance[-1]
-                current_time_span += route_cost[-1]
-                plan[-1]['cost'] = (start_time + timedelta(seconds=current_time_span)).timestamp()
-                route_cost += [data['time_matrix'][from_node][to_node]]
-            route_distance += [data['distance_matrix'][from_node][to_node]]
-        return [plan, route_distance[:-1]]
+        return order
+
+    def __build_search_parameters(self, profile_name):
+        profile = get_search_profile(profile_name)
+        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+        # pylint: disable=no-member
+        search_parameters.first_solution_strategy = getattr(
+            routing_enums_pb2.FirstSolutionStrategy, profile['first_solution_strategy']
+        )
+        if profile['local_search_metaheuristic']:
+            search_parameters.local_search_metaheuristic = getattr(
+                routing_enums_pb2.LocalSearchMetaheuristic, profile['local_search_metaheuristic']
+            )
+        # pylint: enable=no-member
+        if profile['time_limit_ms']:
+            search_parameters.time_limit.FromMilliseconds(profile['time_limit_ms'])
+        if profile['solution_limit']:
+            search_parameters.solution_limit = profile['solution_limit']
+        return search_parameters
+
+    def __get_vehicles(self, data):
+        '''
+        Returns the vehicles of data: the ones set in a multi-vehicle model (see multi_vehicle)
+        or the single vehicle of a driver model, starting at the depot
+        '''
+        if 'vehicles' in data:
+            return data['vehicles']
+        return [{
+            'start': data['depot'],
+            'first_stop': 1,
+            'nodes': None,
+            'lone_dropoff_count': len(data['lone_dropoffs']),
+            'picked_up_passengers': data['picked_up_passengers'],
+            'picked_up_ada_passengers': data['picked_up_ada_passengers'],
+            'ride_capacity': data['ride_capacity'],
+            'passenger_capacity': data['passenger_capacity'],
+            'ada_passenger_capacity': data['ada_passenger_capacity'],
+            'keep_first_stop': data.get('keep_first_stop', False),
+            'dropoff_stop_limit': data.get('dropoff_stop_limit', {})
+        }]
+
+    def __relaxation(self, switch_vars, name):
+        '''
+        Returns how much the bound of a soft constraint is raised:
+        RELAXED_BOUND when its switch node is not visited (relaxed), else 0
+        '''
+        return RELAXED_BOUND * (1 - switch_vars[name])
+
+    def __build_transits(self, data, vehicles, switch_count=0):
+        '''
+        Precomputes the integer arc matrices and node vectors of each dimension
+        so the solver evaluates them natively instead of calling back into python:
+        - distance: distance between from and to node, truncated to an integer
+        - order: every node counts as 1 stop (order distance)
+        - fs_order: number of different fixed-stops between from and to node,
+        0 if both nodes have the same fixed-stop id, else 1
+        - ride_capacity: difference in number of rides inside vehicle,
+        1 for pickups, -1 for dropoffs and already picked up rides for the vehicle start
+        - passenger_capacity: difference in number of passengers inside vehicle,
+        ride passengers for pickups, minus ride passengers for dropoffs
+        and already picked up passengers for the vehicle start
+        - ada_passenger_capacity: same as passenger_capacity for ada passengers
+        Soft constraint switch nodes (switch_count, after data nodes) add nothing to any of them
+        '''
+        nodes = data['nodes']
+        demands = np.array(
+            data['demands'] if 'demands' in data else route.encode_stops(nodes)[2], dtype=np.int64
+        )
+
+        ride_capacity, passenger_capacity, ada_passenger_capacity = demands.T.copy()
+        for vehicle in vehicles:
+            ride_capacity[vehicle['start']] = vehicle['lone_dropoff_count']
+            passenger_capacity[vehicle['start']] = vehicle['picked_up_passengers']
+            ada_passenger_capacity[vehicle['start']] = vehicle['picked_up_ada_passengers']
+
+        fixed_stop_ids = [node.get('fixedStopId') for node in nodes]
+        fs_codes = {fs_id: code for code, fs_id in enumerate(set(fixed_stop_ids) - {None})}
+        # Nodes without fixed-stop get unique negative codes so they never match
+        fs_keys = np.array([
+            fs_codes[fs_id] if fs_id is not None else -idx - 1
+            for idx, fs_id in enumerate(fixed_stop_ids)
+        ], dtype=np.int64)
+        fs_order = (fs_keys[:, None] != fs_keys[None, :]).astype(np.int64)
+        # A node without fixed-stop to itself still counts as a different stop
+        no_fs_nodes = np.flatnonzero(fs_keys < 0)
+        fs_order[no_fs_nodes, no_fs_nodes] = 1
+
+        distance = np.trunc(np.asarray(data['distance_matrix'], dtype=np.float64)).astype(np.int64)
+        order = np.ones(len(nodes), dtype=np.int64)
+
+        if switch_count:
+            distance, fs_order = [np.pad(matrix, (0, switch_count)) for matrix in [distance, fs_order]]
+            [
+                order, ride_capacity, passenger_capacity, ada_passenger_capacity
+            ] = [
+                np.pad(vector, (0, switch_count))
+                for vector in [order, ride_capacity, passenger_capacity, ada_passenger_capacity]
+            ]
+
+        return {
+            'distance': distance.tolist(),
+            'order': order.tolist(),
+            'fs_order': fs_order.tolist(),
+            'ride_capacity': ride_capacity.tolist(),
+            'passenger_capacity': passenger_capacity.tolist(),
+            'ada_passenger_capacity': ada_passenger_capacity.tolist()
+        }
 
     def run(self, data, typ="distance"):
         '''
@@ -54,94 +153,80 @@ class TSP:
                 request_id: <ObjectId>
             ],
             distance_matrix: [[<Number>]],
+            demands: [[rides, passengers, ada_passengers]]  # change at each node (optional)
             pickups_deliveries: [[from_node_idx, to_node_idx]],
             dropoff_stop_limit: {ride_id: [dropoff_idx, additional_pickup_ride_limit_for_ride]}
             lone_dropoffs: [<node_index>],
             picked_up_passengers: <Number>
             picked_up_ada_passengers: <Number>,
-            close_nodes: [<Number>]                   # pickup indexes close to a dropoff index
+            close_nodes: [[pickup_idx, dropoff_idx, close_node_idx]]  # pickups close to a dropoff
             ride_capacity: <Number>,                  # concurrent ride capacity
             passenger_capacity: <Number>,             # vehicle ada capacity
             ada_passenger_capacity: <Number>,         # vehicle non-ada capacity
             keep_first_stop: True,
+            search_profile: <String>                  # search profile name (optional)
+            initial_route: [<node_index>]             # route to start search from (optional)
+            vehicles: [<Vehicle>]                     # one per driver (multi-vehicle, see multi_vehicle)
+            initial_routes: [[<node_index>]]          # routes to start search from (multi-vehicle)
+            soft_constraints: [<String>]              # constraints that can be relaxed (optional)
+            strict_capacity: {                        # capacity with hailed rides (soft only)
+                passenger_capacity: <Number>,
+                ada_passenger_capacity: <Number>
+            }
             # Default values for algorithm
-            num_vehicles: <n_vehicles>                # always 1
+            num_vehicles: <n_vehicles>                # 1, except for multi-vehicle
             depot: <index_to_depot>                   # always 0
         }
+        and builds the resulting plan and distances
+        '''
+        assignment, order = self.solve(data)
+
+        plan, total_distance = [[], []]
+        if assignment:
+            plan, total_distance = route.build_plan(data, order, typ)
+        return [assignment, plan, total_distance]
+
+    def solve(self, data):
         '''
+        Runs the TSP algorithm on data (see run) and returns the assignment
+        and the order of node indexes visited, starting with the depot
+        '''
+        assignment, routes, _ = self.solve_vehicles(data)
+        order = routes[0] if assignment else []
+        return [assignment, order]
+
+    def solve_vehicles(self, data):
+        '''
+        Runs the TSP algorithm on data (see run) with one or more vehicles (see multi_vehicle)
+        and returns the assignment, for each vehicle, the order of node indexes visited,
+        starting with the vehicle start, and the soft constraints that had to be relaxed.
+
+        Soft constraints (single driver models only) are relaxed together with
+        a penalty (see SOFT_CONSTRAINT_PENALTIES) instead of making the model infeasible.
+        Each one gets a switch node, an optional node that only an extra switch vehicle
+        can visit at no cost, and is only enforced while its switch node is visited
+        '''
+        vehicles = self.__get_vehicles(data)
+        node_count = len(data['distance_matrix'])
+        soft_constraints = [] if 'vehicles' in data else [
+            name for name in data.get('soft_constraints', []) if name in SOFT_CONSTRAINT_PENALTIES
+        ]
+        switch_nodes = {name: node_count + idx for idx, name in enumerate(soft_constraints)}
+        switch_vehicle = len(vehicles)
+        starts = [vehicle['start'] for vehicle in vehicles]
+        # The switch vehicle starts at the depot, so it takes the capacity of the driver's vehicle
+        capacity_vehicles = vehicles
+        if switch_nodes:
+            starts += [data['depot']]
+            capacity_vehicles = vehicles + vehicles
         manager = pywrapcp.RoutingIndexManager(
-            len(data['distance_matrix']), data['num_vehicles'], data['depot'])
+            node_count + len(switch_nodes), len(starts), starts, starts)
 
         routing = pywrapcp.RoutingModel(manager)
 
-        def distance_callback(from_index, to_index):
-            '''
-            Distance between from and to node is the corresponding cell in the distance matrix.
-            '''
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            return int(data['distance_matrix'][from_node][to_node])
-
-        def order_callback(_from_index, _to_index):
-            '''
-            Distance between any two nodes is 1 (order distance).
-            '''
-            return 1
-
-        def fs_order_callback(from_index, to_index):
-            '''
-            Number of different fixed-stops between from and to node.
-            It is 0 if from and to node have the same fixed-stop if, else 1.
-            '''
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            if (
-                'fixedStopId' in data['nodes'][from_node].keys()
-            ) and 'fixedStopId' in data['nodes'][to_node].keys():
-                if data['nodes'][from_node]['fixedStopId'] == data['nodes'][to_node]['fixedStopId']:
-                    return 0
-            return 1
-
-        def ride_capacity_callback(from_index):
-            '''
-            Difference in number of rides inside vehicle.
-            Increases if it is a pickup and decreases if it is a dropoff.
-            '''
-            from_node = manager.IndexToNode(from_index)
-            if from_node == 0:
-                return len(data['lone_dropoffs'])
-            if data['nodes'][from_node]['stopType'] == 'pickup':
-                return 1
-            if data['nodes'][from_node]['stopType'] == 'dropoff':
-                return -1
-
-        def passenger_capacity_callback(from_index):
-            '''
-            Difference in number of passengers inside vehicles.
-            Increases passengers if it is a pickup and decreases if it is a dropoff.
-            '''
-            from_node = manager.IndexToNode(from_index)
-            if from_node == 0:
-                return data['picked_up_passengers']
-            if data['nodes'][from_node]['stopType'] == 'pickup':
-                return data['nodes'][from_node]['passengers']
-            if data['nodes'][from_node]['stopType'] == 'dropoff':
-                return - data['nodes'][from_node]['passengers']
-
-        def ada_passenger_capacity_callback(from_index):
-            '''
-            Difference in number of ada passengers inside vehicles.
-            Increases passengers if it is a pickup and decreases if it is a dropoff.
-            '''
-            from_node = manager.IndexToNode(from_index)
-            if from_node == 0:
-                return data['picked_up_ada_passengers']
-            if data['nodes'][from_node]['stopType'] == 'pickup':
-                return data['nodes'][from_node]['ADApassengers']
-            if data['nodes'][from_node]['stopType'] == 'dropoff':
-                return - data['nodes'][from_node]['ADApassengers']
-
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+        transits = self.__build_transits(data, vehicles, len(switch_nodes))
+
+        transit_callback_index = routing.RegisterTransitMatrix(transits['distance'])
         routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
 
         # Main dimension for distance constraints
@@ -153,10 +238,13 @@ class TSP:
             True,  # start cumul to zero
             dimension_name)
         distance_dimension = routing.GetDimensionOrDie(dimension_name)
-        distance_dimension.SetGlobalSpanCostCoefficient(100)
+        if len(vehicles) == 1:
+            # Span of the only route is its distance, with more vehicles it would
+            # penalize the longest route instead of the total distance
+            distance_dimension.SetGlobalSpanCostCoefficient(100)
 
         # Dimension for order constraints
-        order_callback_index = routing.RegisterTransitCallback(order_callback)
+        order_callback_index = routing.RegisterUnaryTransitVector(transits['order'])
         dimension_name = 'Order'
         routing.AddDimension(
             order_callback_index,
@@ -167,7 +255,7 @@ class TSP:
         order_dimension = routing.GetDimensionOrDie(dimension_name)
 
         # Dimension for fixed-stop constraints
-        fs_order_callback_index = routing.RegisterTransitCallback(fs_order_callback)
+        fs_order_callback_index = routing.RegisterTransitMatrix(transits['fs_order'])
         dimension_name = 'FsOrder'
         routing.AddDimension(
             fs_order_callback_index,
@@ -178,36 +266,61 @@ class TSP:
         fs_order_dimension = routing.GetDimensionOrDie(dimension_name)
 
         # Dimension for ride capacity constraints
-        ride_capacity_callback_index = routing.RegisterUnaryTransitCallback(ride_capacity_callback)
+        ride_capacity_callback_index = routing.RegisterUnaryTransitVector(
+            transits['ride_capacity']
+        )
         routing.AddDimensionWithVehicleCapacity(
             ride_capacity_callback_index,
             0,  # null capacity slack
-            [data['ride_capacity']],  # vehicle maximum capacities
+            [vehicle['ride_capacity'] for vehicle in capacity_vehicles],  # vehicle maximum capacities
             True,  # start cumul to zero
             'RideCapacity')
 
         # Dimension for passenger capacity constraints
-        passenger_capacity_callback_index = routing.RegisterUnaryTransitCallback(
-            passenger_capacity_callback
+        passenger_capacity_callback_index = routing.RegisterUnaryTransitVector(
+            transits['passenger_capacity']
         )
         routing.AddDimensionWithVehicleCapacity(
             passenger_capacity_callback_index,
             0,  # null capacity slack
-            [data['passenger_capacity']],  # vehicle maximum capacities
+            [vehicle['passenger_capacity'] for vehicle in capacity_vehicles],  # vehicle maximum capacities
             True,  # start cumul to zero
             'PassengerCapacity')
 
         # Dimension for ada passenger capacity constraints
-        ada_passenger_capacity_callback_index = routing.RegisterUnaryTransitCallback(
-            ada_passenger_capacity_callback
+        ada_passenger_capacity_callback_index = routing.RegisterUnaryTransitVector(
+            transits['ada_passenger_capacity']
         )
         routing.AddDimensionWithVehicleCapacity(
             ada_passenger_capacity_callback_index,
             0,  # null capacity slack
-            [data['ada_passenger_capacity']],  # vehicle maximum capacities
+            [vehicle['ada_passenger_capacity'] for vehicle in capacity_vehicles],  # vehicle maximum capacities
             True,  # start cumul to zero
             'ADAPassengerCapacity')
 
+        # Constraint #0 - Stops of a driver's route stay in the driver's vehicle
+        for vehicle_id, vehicle in enumerate(vehicles):
+            for node in vehicle['nodes'] or []:
+                routing.VehicleVar(manager.NodeToIndex(node)).SetValues([vehicle_id])
+
+        # Soft constraint switches, relaxing a constraint costs its penalty
+        switch_vars = {}
+        if switch_nodes:
+            for node in range(node_count):
+                if node != data['depot']:
+                    routing.VehicleVar(manager.NodeToIndex(node)).SetValues([0])
+            for name, switch_node in switch_nodes.items():
+                switch_index = manager.NodeToIndex(switch_node)
+                routing.VehicleVar(switch_index).SetValues([-1, switch_vehicle])
+                routing.AddDisjunction([switch_index], SOFT_CONSTRAINT_PENALTIES[name])
+                switch_vars[name] = routing.ActiveVar(switch_index)
+        dropoff_stop_relaxation = 0
+        if 'dropoff_stop_limit' in switch_vars:
+            dropoff_stop_relaxation = self.__relaxation(switch_vars, 'dropoff_stop_limit')
+        close_nodes_relaxation = 0
+        if 'close_nodes' in switch_vars:
+            close_nodes_relaxation = self.__relaxation(switch_vars, 'close_nodes')
+
         # Constraint #1 - Pickups are required to happen before the corresponding ride's dropoff
         for request in data['pickups_deliveries']:
             pickup_index = manager.NodeToIndex(request[0])
@@ -231,70 +344,128 @@ class TSP:
                 fs_order_dimension.CumulVar(pickup_index) <= 3
             )
 
-        # Constraint #2.2 - Prevent more than 2 fixed-stop stops within a ride
-        # Only dropoffs
-        if 'dropoff_stop_limit' in data.keys():
+        for vehicle in vehicles:
+            # Constraint #2.2 - Prevent more than 2 fixed-stop stops within a ride
+            # Only dropoffs
             last_dropoff_added_to_start_idx = False
             # Sorted by increasing margin
             sorted_dropoff_stop_limit = sorted(
-                data['dropoff_stop_limit'].items(), key=lambda x: x[1][1]
+                vehicle['dropoff_stop_limit'].items(), key=lambda x: x[1][1]
             )
             for _, (dropoff_node, limit) in sorted_dropoff_stop_limit:
                 dropoff_idx = manager.NodeToIndex(dropoff_node)
                 # Exceeded number (< 1) of stops or should be next (== 1)
                 if limit <= 1:
-                    data['keep_first_stop'] = False
+                    vehicle['keep_first_stop'] = False
                     if last_dropoff_added_to_start_idx:
                         routing.solver().Add(
                             fs_order_dimension.CumulVar(dropoff_idx) -
-                            fs_order_dimension.CumulVar(last_dropoff_added_to_start_idx) <= 1
+                            fs_order_dimension.CumulVar(last_dropoff_added_to_start_idx)
+                            <= 1 + dropoff_stop_relaxation
+                        )
+                    elif 'dropoff_stop_limit' in switch_vars:
+                        routing.solver().Add(
+                            order_dimension.CumulVar(dropoff_idx) <= 1 + dropoff_stop_relaxation
                         )
                     else:
                         routing.solver().Add(order_dimension.CumulVar(dropoff_idx) == 1)
                     last_dropoff_added_to_start_idx = dropoff_idx
                 else:
                     routing.solver().Add(
-                        fs_order_dimension.CumulVar(dropoff_idx) <= limit
+                        fs_order_dimension.CumulVar(dropoff_idx) <= limit + dropoff_stop_relaxation
                     )
 
-        # Constraint #3 - Keep first stop
-        if 'keep_first_stop' in data.keys() and data['keep_first_stop']:
-            first_stop_index = manager.NodeToIndex(1)
-            routing.solver().Add(order_dimension.CumulVar(first_stop_index) == 1)
+            # Constraint #3 - Keep first stop
+            if vehicle['keep_first_stop']:
+                first_stop_index = manager.NodeToIndex(vehicle['first_stop'])
+                if 'keep_first_stop' in switch_vars:
+                    routing.solver().Add(
+                        order_dimension.CumulVar(first_stop_index)
+                        <= 1 + self.__relaxation(switch_vars, 'keep_first_stop')
+                    )
+                else:
+                    routing.solver().Add(order_dimension.CumulVar(first_stop_index) == 1)
 
         # Constraint #4 - Prioritize dropoffs over pickups,
         # if dropoffs and pickups in same place
         if 'close_nodes' in data.keys():
-            for nodes in data['close_nodes']:
-                pickup_index = manager.NodeToIndex(nodes['pickup'])
-                dropoff_index = manager.NodeToIndex(nodes['dropoff'])
-                for close_node in nodes['close_nodes']:
-                    close_node_index = manager.NodeToIndex(close_node)
-                    if nodes['pickup'] != -1:
-                        # pylint: disable=line-too-long
-                        routing.solver().Add(
-                            abs(
-                                (
-                                    order_dimension.CumulVar(close_node_index) - order_dimension.CumulVar(pickup_index)
-                                ) - (
-                                    order_dimension.CumulVar(dropoff_index) - order_dimension.CumulVar(close_node_index)
-                                )
-                            ) > (order_dimension.CumulVar(dropoff_index) - order_dimension.CumulVar(pickup_index))
-                        )
-                    else:
-                        routing.solver().Add(order_dimension.CumulVar(dropoff_index) <= order_dimension.CumulVar(close_node_index))
-                        # pylint: enable=line-too-long
+            for pickup, dropoff, close_node in data['close_nodes']:
+                pickup_index = manager.NodeToIndex(pickup)
+                dropoff_index = manager.NodeToIndex(dropoff)
+                close_node_index = manager.NodeToIndex(close_node)
+                if pickup != -1:
+                    # pylint: disable=line-too-long
+                    routing.solver().Add(
+                        abs(
+                            (
+                                order_dimension.CumulVar(close_node_index) - order_dimension.CumulVar(pickup_index)
+                            ) - (
+                                order_dimension.CumulVar(dropoff_index) - order_dimension.CumulVar(close_node_index)
+                            )
+                        ) + close_nodes_relaxation > (order_dimension.CumulVar(dropoff_index) - order_dimension.CumulVar(pickup_index))
+                    )
+                else:
+                    routing.solver().Add(order_dimension.CumulVar(dropoff_index) <= order_dimension.CumulVar(close_node_index) + close_nodes_relaxation)
+                    # pylint: enable=line-too-long
 
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        # pylint: disable=no-member
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.GLOBAL_CHEAPEST_ARC
-        )
-        # pylint: enable=no-member
+        # Constraint #5 - Passengers of hailed rides count towards capacity
+        # Only as a soft constraint, data model capacities already leave them out
+        if 'hailed_capacity' in switch_vars:
+            relaxation = self.__relaxation(switch_vars, 'hailed_capacity')
+            capacity_indexes = [
+                manager.NodeToIndex(node) for node in range(node_count) if node != data['depot']
+            ] + [routing.End(0)]
+            for dimension_name, capacity_key in [
+                ('PassengerCapacity', 'passenger_capacity'),
+                ('ADAPassengerCapacity', 'ada_passenger_capacity')
+            ]:
+                dimension = routing.GetDimensionOrDie(dimension_name)
+                strict_capacity = data['strict_capacity'][capacity_key]
+                for index in capacity_indexes:
+                    routing.solver().Add(dimension.CumulVar(index) <= strict_capacity + relaxation)
 
-        assignment = routing.SolveWithParameters(search_parameters)
+        search_parameters = self.__build_search_parameters(data.get('search_profile'))
 
-        plan, total_distance = [[], []]
+        # Start from the initial routes when they are feasible, otherwise build a first solution
+        initial_routes = data.get('initial_routes')
+        if data.get('initial_route'):
+            initial_routes = [data['initial_route']]
+        initial_assignment = None
+        if initial_routes:
+            routing.CloseModelWithParameters(search_parameters)
+            index_routes = [
+                [manager.NodeToIndex(node) for node in vehicle_route]
+                for vehicle_route in initial_routes
+            ]
+            # With soft constraints, start with all of them enforced or else all relaxed
+            candidate_routes = [index_routes]
+            if switch_nodes:
+                candidate_routes = [
+                    index_routes + [[manager.NodeToIndex(node) for node in switch_nodes.values()]],
+                    index_routes + [[]]
+                ]
+            for candidate in candidate_routes:
+                initial_assignment = routing.ReadAssignmentFromRoutes(candidate, True)
+                if initial_assignment:
+                    break
+        if initial_assignment:
+            assignment = routing.SolveFromAssignmentWithParameters(
+                initial_assignment, search_parameters
+            )
+        else:
+            assignment = routing.SolveWithParameters(search_parameters)
+
+        routes = []
+        relaxed_constraints = []
         if assignment:
-            plan, total_distance = self.__process_solution(data, manager, routing, assignment, typ)
-        return [assignment, plan, total_distance]
+            routes = [
+                self.__get_order(manager, routing, assignment, vehicle_id)
+                for vehicle_id in range(len(vehicles))
+            ]
+            if switch_nodes:
+                enforced_nodes = self.__get_order(manager, routing, assignment, switch_vehicle)
+                relaxed_constraints = [
+                    name for name, switch_node in switch_nodes.items()
+                    if switch_node not in enforced_nodes
+                ]
+        return [assignment, routes, relaxed_constraints]
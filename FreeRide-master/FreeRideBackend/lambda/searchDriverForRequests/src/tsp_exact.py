@@ -0,0 +1,240 @@
+'''
+The Exact TSP module solves small TSP data models to optimality in-process
+with a dynamic-programming search over visited node sets, applying the same
+constraints and objective (truncated distance) as the ortools model in the TSP module
+'''
+import os
+from collections import namedtuple
+import numpy as np
+import route
+
+# Models with up to this many nodes (depot included) are solved exactly, 0 disables it.
+# Routes have at most 8 waiting stops, so with the 2 request actions a model has 11 nodes
+EXACT_TSP_MAX_NODES = int(os.environ.get('EXACT_TSP_MAX_NODES', 11))
+# Same as the Distance dimension capacity of the ortools model
+MAX_ROUTE_DISTANCE = 30000
+# Fixed-stops / stops allowed between a pickup and its dropoff
+RIDE_FS_LIMIT = 3
+
+# Partial route ending at node:
+# - cost: route distance
+# - fs: fixed-stop count (FsOrder cumul) at node
+# - anchors: (node, fs) of visited nodes that later nodes are constrained against
+# - parent: label of the partial route without node
+Label = namedtuple('Label', ['cost', 'fs', 'anchors', 'parent', 'node'])
+
+
+def uses_exact_solver(data):
+    '''
+    Checks if the data model is small enough to be solved by ExactTSP
+    (multi-vehicle models and models with soft constraints are always solved by TSP)
+    '''
+    return (
+        'vehicles' not in data and not data.get('soft_constraints')
+        and len(data['nodes']) <= EXACT_TSP_MAX_NODES
+    )
+
+
+class ExactTSP:
+    '''
+    ExactTSP provides the same run and solve interface as TSP
+    for models small enough to enumerate every feasible visiting order.
+    Partial routes that end at the same node after visiting the same nodes
+    are merged unless none is better in both distance and fixed-stop counts
+    '''
+    def __build_constraints(self, data):
+        nodes = data['nodes']
+        n_nodes = len(nodes)
+
+        demands = [tuple(demand) for demand in route.get_demands(data).tolist()]
+
+        fixed_stop_ids = [node.get('fixedStopId') for node in nodes]
+        fs_order = [
+            [
+                0 if from_fs is not None and from_fs == to_fs else 1
+                for to_fs in fixed_stop_ids
+            ]
+            for from_fs in fixed_stop_ids
+        ]
+
+        # fs(node) - fs(anchor) <= limit, for each node and anchor visited before it
+        fs_differences = [[] for _ in range(n_nodes)]
+        # fs(node) <= limit
+        fs_limits = [None] * n_nodes
+        pickups = [None] * n_nodes
+        # Index arrays as python ints for the bit masks of the search
+        for pickup, dropoff in np.asarray(data['pickups_deliveries']).reshape(-1, 2).tolist():
+            pickups[dropoff] = pickup
+            fs_differences[dropoff] += [(pickup, RIDE_FS_LIMIT)]
+
+        keep_first_stop = data.get('keep_first_stop', False)
+        first_node = None
+        if 'dropoff_stop_limit' in data:
+            previous_dropoff = None
+            # Sorted by increasing margin
+            for dropoff, limit in sorted(data['dropoff_stop_limit'].values(), key=lambda x: x[1]):
+                # Exceeded number (< 1) of stops or should be next (== 1)
+                if limit <= 1:
+                    keep_first_stop = False
+                    if previous_dropoff is not None:
+                        fs_differences[dropoff] += [(previous_dropoff, 1)]
+                    else:
+                        first_node = dropoff
+                    previous_dropoff = dropoff
+                else:
+                    fs_limits[dropoff] = limit if fs_limits[dropoff] is None else min(
+                        fs_limits[dropoff], limit
+                    )
+        if keep_first_stop:
+            first_node = 1
+
+        # Nodes that can only be visited once other nodes were (mask) or were not (forbidden)
+        required = [0] * n_nodes
+        forbidden = [[] for _ in range(n_nodes)]
+        for node, pickup in enumerate(pickups):
+            if pickup is not None:
+                required[node] |= 1 << pickup
+        close_nodes = np.asarray(data.get('close_nodes', []), dtype=np.int64).reshape(-1, 3)
+        for pickup, dropoff, close_node in close_nodes.tolist():
+            if pickup != -1:
+                # Close node is not visited between the pickup and the dropoff
+                forbidden[close_node] += [(pickup, dropoff)]
+            else:
+                # Close node is visited after the dropoff
+                required[close_node] |= 1 << dropoff
+
+        anchor_partners = [0] * n_nodes
+        for node, differences in enumerate(fs_differences):
+            for anchor, _ in differences:
+                anchor_partners[anchor] |= 1 << node
+
+        return {
+            'distance': [[int(cell) for cell in line] for line in data['distance_matrix']],
+            'demands': demands,
+            'capacity': (
+                data['ride_capacity'], data['passenger_capacity'], data['ada_passenger_capacity']
+            ),
+            'fs_order': fs_order,
+            'fs_differences': fs_differences,
+            'fs_limits': fs_limits,
+            'required': required,
+            'forbidden': forbidden,
+            'anchor_partners': anchor_partners,
+            'first_node': first_node
+        }
+
+    def __fits(self, load, capacity):
+        return all(0 <= value <= limit for value, limit in zip(load, capacity))
+
+    def __dominates(self, label, other):
+        if label.cost > other.cost or label.fs > other.fs:
+            return False
+        return all(
+            label.fs - anchor_fs <= other.fs - other_anchor_fs
+            for (_, anchor_fs), (_, other_anchor_fs) in zip(label.anchors, other.anchors)
+        )
+
+    def __add_label(self, labels, key, label):
+        key_labels = labels.setdefault(key, [])
+        if any(self.__dominates(other, label) for other in key_labels):
+            return
+        key_labels[:] = [other for other in key_labels if not self.__dominates(label, other)]
+        key_labels += [label]
+
+    def __extend(self, constraints, mask, label, node):
+        '''
+        Returns the label of visiting node after label's partial route
+        or None if it breaks any constraint
+        '''
+        if constraints['required'][node] & ~mask:
+            return None
+        for pickup, dropoff in constraints['forbidden'][node]:
+            if mask >> pickup & 1 and not mask >> dropoff & 1:
+                return None
+
+        cost = label.cost + constraints['distance'][label.node][node]
+        if cost > MAX_ROUTE_DISTANCE:
+            return None
+
+        fs = label.fs + constraints['fs_order'][label.node][node]
+        fs_limit = constraints['fs_limits'][node]
+        if fs_limit is not None and fs > fs_limit:
+            return None
+        anchor_fs = dict(label.anchors)
+        for anchor, limit in constraints['fs_differences'][node]:
+            if anchor in anchor_fs and fs - anchor_fs[anchor] > limit:
+                return None
+
+        new_mask = mask | 1 << node
+        anchors = tuple(
+            (anchor, value) for anchor, value in label.anchors
+            if constraints['anchor_partners'][anchor] & ~new_mask
+        )
+        if constraints['anchor_partners'][node] & ~new_mask:
+            anchors = tuple(sorted(anchors + ((node, fs),)))
+        return Label(cost, fs, anchors, label, node)
+
+    def solve(self, data):
+        '''
+        Finds the shortest route for data (see TSP.run) and returns
+        if a route was found and the order of node indexes visited, starting with the depot
+        '''
+        constraints = self.__build_constraints(data)
+        n_nodes = len(data['nodes'])
+        capacity = constraints['capacity']
+
+        loads = {1: constraints['demands'][0]}
+        if not self.__fits(loads[1], capacity):
+            return [False, []]
+
+        labels = {(1, 0): [Label(0, 0, (), None, 0)]}
+        for step in range(n_nodes - 1):
+            candidates = range(1, n_nodes)
+            if step == 0 and constraints['first_node'] is not None:
+                candidates = [constraints['first_node']]
+            next_labels = {}
+            for (mask, _), key_labels in labels.items():
+                for node in candidates:
+                    if mask >> node & 1:
+                        continue
+                    new_mask = mask | 1 << node
+                    if new_mask not in loads:
+                        loads[new_mask] = tuple(
+                            value + change
+                            for value, change in zip(loads[mask], constraints['demands'][node])
+                        )
+                    if not self.__fits(loads[new_mask], capacity):
+                        continue
+                    for label in key_labels:
+                        new_label = self.__extend(constraints, mask, label, node)
+                        if new_label:
+                            self.__add_label(next_labels, (new_mask, node), new_label)
+            labels = next_labels
+
+        # Return to depot closes the route
+        final_labels = [
+            (label.cost + constraints['distance'][label.node][0], label)
+            for key_labels in labels.values() for label in key_labels
+        ]
+        final_labels = [item for item in final_labels if item[0] <= MAX_ROUTE_DISTANCE]
+        if not final_labels:
+            return [False, []]
+
+        _, label = min(final_labels, key=lambda item: item[0])
+        order = []
+        while label:
+            order = [label.node] + order
+            label = label.parent
+        return [True, order]
+
+    def run(self, data, typ="distance"):
+        '''
+        Runs the exact search on data (see TSP.run)
+        and builds the resulting plan and distances
+        '''
+        assignment, order = self.solve(data)
+
+        plan, total_distance = [[], []]
+        if assignment:
+            plan, total_distance = route.build_plan(data, order, typ)
+        return [assignment, plan, total_distance]
@@ -0,0 +1,243 @@
+'''
+The TSP pool module keeps a set of long-lived tsp_runner worker processes
+so each TSP run only pays for the solve itself and not for interpreter startup
+and the ortools import, while keeping the crash isolation of a subprocess
+'''
+import os
+import asyncio
+import atexit
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from tsp_transport import FRAME_LENGTH, MatrixBuffer, decode_frame, encode_frame
+
+TSP_RUNNER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tsp_runner.py')
+TSP_WORKER_COMMAND = ['python3', TSP_RUNNER_PATH, '--serve']
+DEFAULT_POOL_SIZE = 10
+
+
+class TSPWorker:
+    '''
+    TSPWorker wraps a single tsp_runner process started in serve mode.
+    Requests and results are exchanged as frames through stdin and stdout,
+    matrices through the worker's own matrix buffer (see tsp_transport),
+    and stderr is kept in a temporary file to report C++ and python crashes
+    '''
+    def __init__(self):
+        self.matrix_buffer = MatrixBuffer()
+        self.stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            TSP_WORKER_COMMAND,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self.stderr,
+            cwd=os.path.dirname(TSP_RUNNER_PATH)
+        )
+
+    def is_alive(self):
+        '''
+        Checks if worker process is still running
+        '''
+        return self.process.poll() is None
+
+    async def run_async(self, data_model, typ, timeout):
+        '''
+        Sends data model and matrix type to the worker and waits for the result
+        on the running event loop.
+        Returns the result dictionary, or None if the worker output is not a valid result.
+        Raises subprocess.TimeoutExpired if no result is received within timeout seconds
+        and subprocess.CalledProcessError if the worker dies while solving
+        '''
+        stderr_offset = self.__send(data_model, typ)
+
+        deadline = time.monotonic() + timeout
+        prefix = await self.__read_async(FRAME_LENGTH.size, deadline, timeout, stderr_offset)
+        [length] = FRAME_LENGTH.unpack(prefix)
+        body = await self.__read_async(length, deadline, timeout, stderr_offset)
+        try:
+            return decode_frame(body)
+        except ValueError:
+            return None
+
+    def terminate(self):
+        '''
+        Kills worker process and releases its pipes and stderr file
+        '''
+        if self.is_alive():
+            self.process.kill()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+        for stream in [self.process.stdin, self.process.stdout, self.stderr, self.matrix_buffer]:
+            try:
+                stream.close()
+            # pylint: disable=broad-exception-caught
+            except Exception:
+            # pylint: enable=broad-exception-caught
+                pass
+
+    def close(self):
+        '''
+        Asks worker process to exit by closing its input
+        '''
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        # pylint: disable=broad-exception-caught
+        except Exception:
+        # pylint: enable=broad-exception-caught
+            pass
+        self.terminate()
+
+    def __send(self, data_model, typ):
+        stderr_offset = self.stderr.seek(0, os.SEEK_END)
+        request = self.matrix_buffer.write(data_model)
+        request['typ'] = typ
+
+        try:
+            self.process.stdin.write(encode_frame(request))
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            self.__raise_crash(b'', stderr_offset)
+        return stderr_offset
+
+    async def __read_async(self, size, deadline, timeout, stderr_offset):
+        loop = asyncio.get_running_loop()
+        output = b''
+        fd = self.process.stdout.fileno()
+        while len(output) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(TSP_WORKER_COMMAND, timeout)
+            readable = loop.create_future()
+            loop.add_reader(fd, lambda: readable.done() or readable.set_result(True))
+            try:
+                await asyncio.wait_for(readable, remaining)
+            except asyncio.TimeoutError:
+                continue
+            finally:
+                loop.remove_reader(fd)
+            chunk = os.read(fd, size - len(output))
+            if not chunk:
+                self.__raise_crash(output, stderr_offset)
+            output += chunk
+        return output
+
+    def __raise_crash(self, output, stderr_offset):
+        try:
+            returncode = self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            returncode = None
+        self.stderr.seek(stderr_offset)
+        stderr = self.stderr.read().decode('utf-8', errors='replace')
+        raise subprocess.CalledProcessError(
+            returncode, TSP_WORKER_COMMAND,
+            output=output.decode('utf-8', errors='replace'), stderr=stderr
+        )
+
+
+class TSPWorkerPool:
+    '''
+    TSPWorkerPool keeps size pre-started TSP workers and hands them out to callers.
+    A worker that times out or crashes is killed and replaced by a new one,
+    leaving the remaining workers untouched.
+    Callers on event loops wait for an idle worker on a future,
+    woken when a worker is handed back
+    '''
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        self.size = size
+        self.idle_workers = queue.Queue()
+        self.waiters = deque()
+        self.waiters_lock = threading.Lock()
+        for _ in range(size):
+            self.idle_workers.put(TSPWorker())
+
+    async def run_async(self, data_model, typ, timeout):
+        '''
+        Runs TSP on an idle worker and returns the worker result,
+        waiting for the worker and for the result on the running event loop
+        '''
+        worker = await self.__get_idle_worker_async()
+        try:
+            if not worker.is_alive():
+                worker.terminate()
+                worker = TSPWorker()
+            return await worker.run_async(data_model, typ, timeout)
+        except (subprocess.TimeoutExpired, subprocess.CalledProcessError, asyncio.CancelledError):
+            # A cancelled run would leave its result unread in the worker output
+            worker.terminate()
+            worker = TSPWorker()
+            raise
+        finally:
+            self.__release(worker)
+
+    def close(self):
+        '''
+        Stops all idle workers
+        '''
+        while True:
+            try:
+                worker = self.idle_workers.get_nowait()
+            except queue.Empty:
+                break
+            worker.close()
+
+    async def __get_idle_worker_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Checked under the waiters lock so a worker handed back meanwhile wakes the waiter
+            with self.waiters_lock:
+                try:
+                    return self.idle_workers.get_nowait()
+                except queue.Empty:
+                    waiter = loop.create_future()
+                    self.waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self.waiters_lock:
+                    if (loop, waiter) in self.waiters:
+                        self.waiters.remove((loop, waiter))
+                    else:
+                        # The wake-up of a handed back worker goes to the next waiter
+                        self.__wake_next_waiter()
+                raise
+
+    def __release(self, worker):
+        with self.waiters_lock:
+            self.idle_workers.put(worker)
+            self.__wake_next_waiter()
+
+    def __wake_next_waiter(self):
+        if self.waiters:
+            loop, waiter = self.waiters.popleft()
+            loop.call_soon_threadsafe(_wake, waiter)
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_tsp_pool():
+    '''
+    Returns the process-wide TSP worker pool, starting its workers on first use.
+    Pool size can be set with the TSP_POOL_SIZE environment variable
+    '''
+    # pylint: disable=global-statement
+    global _POOL
+    # pylint: enable=global-statement
+    with _POOL_LOCK:
+        if _POOL is None:
+            size = int(os.environ.get('TSP_POOL_SIZE', DEFAULT_POOL_SIZE))
+            _POOL = TSPWorkerPool(size=max(size, 1))
+            atexit.register(_POOL.close)
+        return _POOL
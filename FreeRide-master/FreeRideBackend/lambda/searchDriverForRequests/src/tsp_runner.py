@@ -1,13 +1,15 @@
 '''
 This module implements the Traveling Salesman Problem (TSP) algorithm and serves as a 
-subprocess for handling TSP-related computations. It takes input data in JSON format, 
-processes the data to compute optimal routes, and outputs the results in JSON format.
+subprocess for handling TSP-related computations. It runs as a pool worker (see tsp_pool),
+reading one request frame at a time from stdin (see tsp_transport), computing the optimal
+route and writing one result frame to stdout with the order of the visited nodes.
 '''
 
+import os
 import sys
 import traceback
-import json
 from tsp import TSP
+from tsp_transport import MatrixReader, encode_frame, read_frame
 
 def run_tsp(data_model, typ):
     '''
@@ -26,19 +28,28 @@ def run_tsp(data_model, typ):
         - dict: A dictionary containing the results of the TSP computation, including:
             - 'success' (bool): Indicates whether the computation was successful.
             - 'assignment' (bool): Indicates if an assignment was made.
-            - 'new_route' (list): A list of locations representing the computed route.
-            - 'new_route_distances' (list): A list of distances corresponding to the computed route.
+            - 'order' (list): Node indexes in the order of the computed route.
+            - 'routes' (list): Node indexes of each vehicle's route, instead of 'order'
+            for multi-vehicle data models (see multi_vehicle).
+            - 'relaxed_constraints' (list): Soft constraints relaxed to find the route.
             - 'error' (str, optional): An error message if the computation failed.
     '''
     try:
-        assignment_obj, new_route, new_route_distances = TSP().run(data=data_model, typ=typ)
+        assignment_obj, routes, relaxed_constraints = TSP().solve_vehicles(data=data_model)
         assignment = True if assignment_obj else False
-        return json.dumps({
+        if 'vehicles' in data_model:
+            return {
+                'success': True,
+                'assignment': assignment,
+                'routes': routes,
+                'relaxed_constraints': relaxed_constraints
+            }
+        return {
             'success': True,
             'assignment': assignment,
-            'new_route': new_route,
-            'new_route_distances': new_route_distances
-        })
+            'order': routes[0] if assignment else [],
+            'relaxed_constraints': relaxed_constraints
+        }
     # pylint: disable=broad-exception-caught
     except Exception as error:
     # pylint: enable=broad-exception-caught
@@ -48,19 +59,40 @@ def run_tsp(data_model, typ):
         error_traceback =  traceback.format_tb(error.__traceback__)
         if isinstance(error_traceback, list):
             error_traceback = '\n'.join(error_traceback)
-        return json.dumps({
+        return {
             'success': False,
             'error': error_message,
             'traceback': error_traceback
-        })
+        }
 
-if __name__ == '__main__':
-    # Rebuild arguments
-    data_model_param = json.loads(sys.argv[1])
-    typ_param = sys.argv[2]
+def serve():
+    '''
+    Runs TSP for every request frame received in stdin until stdin is closed.
+    Each request has the data model header built by tsp_transport.MatrixBuffer
+    and a "typ" key and gets exactly one result frame written back.
+    Anything else written to stdout (i.e. by the solver) is sent to stderr
+    so it cannot be mistaken for a result.
+    '''
+    result_output = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    matrix_reader = MatrixReader()
 
-    # Run TSP
-    result = run_tsp(data_model_param, typ_param)
+    while True:
+        request = read_frame(sys.stdin.buffer)
+        if request is None:
+            break
+        try:
+            result = run_tsp(matrix_reader.read(request), request['typ'])
+        # pylint: disable=broad-exception-caught
+        except Exception as error:
+        # pylint: enable=broad-exception-caught
+            result = {
+                'success': False,
+                'error': f'Invalid TSP request: {error}',
+                'traceback': traceback.format_exc()
+            }
+        result_output.write(encode_frame(result))
+        result_output.flush()
 
-    # Return result
-    sys.stdout.buffer.write(result.encode('utf-8'))
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,164 @@
+'''
+The TSP transport module defines how data models travel between the driver finder
+and the TSP worker processes:
+- matrices and the other arrays of the data model (demands, index arrays) are written
+with their dtype into a memory mapped buffer file (in /dev/shm when available)
+owned by the driver finder side and read in place by the worker
+- everything else (node and constraint metadata) goes in a small JSON header
+sent as a length-prefixed frame through the worker's stdin/stdout pipes
+'''
+import os
+import mmap
+import json
+import struct
+import tempfile
+import numpy as np
+
+MATRIX_KEYS = ['distance_matrix', 'time_matrix']
+# Node attributes used by the TSP constraints, the rest of the node stays in the driver finder
+NODE_SOLVER_KEYS = ['stopType', 'passengers', 'ADApassengers', 'fixedStopId']
+FRAME_LENGTH = struct.Struct('>I')
+# Arrays start at offsets aligned for any dtype
+ARRAY_ALIGNMENT = 8
+SHARED_MEMORY_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+MIN_BUFFER_SIZE = 64 * 1024
+
+
+def encode_frame(message):
+    '''
+    Encodes a message dictionary as a length-prefixed JSON frame
+    '''
+    body = json.dumps(message).encode('utf-8')
+    return FRAME_LENGTH.pack(len(body)) + body
+
+
+def decode_frame(body):
+    '''
+    Decodes the JSON body of a frame (without the length prefix)
+    '''
+    return json.loads(body.decode('utf-8'))
+
+
+def read_frame(stream):
+    '''
+    Reads a full frame from a blocking binary stream.
+    Returns None if the stream is closed
+    '''
+    prefix = stream.read(FRAME_LENGTH.size)
+    if len(prefix) < FRAME_LENGTH.size:
+        return None
+    [length] = FRAME_LENGTH.unpack(prefix)
+    return decode_frame(stream.read(length))
+
+
+def _aligned(size):
+    return -(-size // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+
+class MatrixBuffer:
+    '''
+    MatrixBuffer owns the memory mapped file where a worker's request matrices are written.
+    It grows as needed and is reused between requests
+    '''
+    def __init__(self):
+        self.file = tempfile.NamedTemporaryFile(prefix='tsp_matrices_', dir=SHARED_MEMORY_DIR)
+        self.size = 0
+        self.buffer = None
+
+    def write(self, data_model):
+        '''
+        Writes data model matrices (float64 unless already arrays) and arrays
+        into the buffer and returns the request header, a copy of the data model
+        without them and with only solver node attributes
+        '''
+        arrays = {
+            key: np.ascontiguousarray(
+                value if isinstance(value, np.ndarray) else np.asarray(value, dtype=np.float64)
+            )
+            for key, value in data_model.items()
+            if key in MATRIX_KEYS or isinstance(value, np.ndarray)
+        }
+        self.__reserve(sum(_aligned(array.nbytes) for array in arrays.values()))
+
+        offset = 0
+        matrix_info = {}
+        for key, array in arrays.items():
+            np.ndarray(
+                array.shape, dtype=array.dtype, buffer=self.buffer, offset=offset
+            )[...] = array
+            matrix_info[key] = {
+                'offset': offset, 'shape': list(array.shape), 'dtype': array.dtype.str
+            }
+            offset += _aligned(array.nbytes)
+
+        model = {
+            key: value for key, value in data_model.items()
+            if key not in arrays and key != 'nodes'
+        }
+        model['nodes'] = [
+            {key: node[key] for key in NODE_SOLVER_KEYS if key in node}
+            for node in data_model['nodes']
+        ]
+        return {
+            'buffer': {'path': self.file.name, 'size': self.size},
+            'matrices': matrix_info,
+            'data_model': model
+        }
+
+    def close(self):
+        '''
+        Unmaps and removes the buffer file
+        '''
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+        self.file.close()
+
+    def __reserve(self, size):
+        if size <= self.size:
+            return
+        new_size = max(size, 2 * self.size, MIN_BUFFER_SIZE)
+        if self.buffer is not None:
+            self.buffer.close()
+        os.ftruncate(self.file.fileno(), new_size)
+        self.buffer = mmap.mmap(self.file.fileno(), new_size)
+        self.size = new_size
+
+
+class MatrixReader:
+    '''
+    MatrixReader maps the driver finder's matrix buffer file in the worker process
+    and rebuilds the data model with matrices as arrays over the mapped memory (no copies)
+    '''
+    def __init__(self):
+        self.path = None
+        self.size = 0
+        self.buffer = None
+
+    def read(self, request):
+        '''
+        Returns the full data model for a request header
+        '''
+        self.__map(request['buffer']['path'], request['buffer']['size'])
+        data_model = request['data_model']
+        for key, info in request['matrices'].items():
+            data_model[key] = np.ndarray(
+                info['shape'], dtype=np.dtype(info['dtype']), buffer=self.buffer,
+                offset=info['offset']
+            )
+        return data_model
+
+    def __map(self, path, size):
+        if path == self.path and size == self.size:
+            return
+        if self.buffer is not None:
+            try:
+                self.buffer.close()
+            except BufferError:
+                # Arrays from a previous request are still alive,
+                # the old mapping is released when they are collected
+                pass
+        with open(path, 'rb') as buffer_file:
+            self.buffer = mmap.mmap(buffer_file.fileno(), size, access=mmap.ACCESS_READ)
+        self.path = path
+        self.size = size
@@ -2,15 +2,40 @@
 Miscelaneous helper functions
 """
 
+import asyncio
+import functools
+import os
+import threading
 import time
 import uuid
 import json
 import subprocess
 import re
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import geopy.distance
 import sentry_sdk
 from sentry_sdk import capture_exception
 from exceptions import TSPTimeoutError, TSPDefaultError, ExceptionWithContext
+from search_profiles import get_search_profile
+from tsp_pool import TSP_WORKER_COMMAND, get_tsp_pool
+from tsp_exact import ExactTSP, uses_exact_solver
+import route
+
+MEAN_EARTH_RADIUS_M = 6371008.8
+WGS84_MAJOR_AXIS_M = 6378137.0
+WGS84_FLATTENING = 1 / 298.257223563
+VINCENTY_MAX_ITERATIONS = 100
+# Threads for the blocking calls of the asyncio pipeline (database queries and data model
+# builds with their matrix requests), as many as the former driver processing thread pool
+DEFAULT_BLOCKING_POOL_SIZE = 10
+# Seconds a TSP run may take past its search profile time limit (model building and transport)
+TSP_TIMEOUT_SLACK = 2
+# Seconds a TSP run of a search profile without time limit may take
+TSP_UNLIMITED_TIMEOUT = 30
+
+_BLOCKING_EXECUTOR = None
+_BLOCKING_EXECUTOR_LOCK = threading.Lock()
 
 def runtime_start(logger, id_label, additional_params = None):
     """
@@ -45,6 +70,85 @@ def calc_dist(coord_a, coord_b):
     """
     return geopy.distance.geodesic(coord_a, coord_b).m
 
+def calc_dist_array(coords_a, coords_b, mode='ellipsoid'):
+    """
+    Calculates distances in meters between coordinates of coords_a and coords_b,
+    arrays (broadcast against each other) with [lat, lon] in the last axis:
+    - haversine: great-circle distance on the mean earth radius sphere (error within 0.5%)
+    - ellipsoid: Vincenty's inverse formula on the WGS-84 ellipsoid,
+    within a millimeter of calc_dist (haversine where it does not converge)
+    """
+    coords_a = np.radians(np.asarray(coords_a, dtype=np.float64))
+    coords_b = np.radians(np.asarray(coords_b, dtype=np.float64))
+    lat_a, lon_a = coords_a[..., 0], coords_a[..., 1]
+    lat_b, lon_b = coords_b[..., 0], coords_b[..., 1]
+
+    haversine = 2 * MEAN_EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(
+        np.sin((lat_b - lat_a) / 2) ** 2
+        + np.cos(lat_a) * np.cos(lat_b) * np.sin((lon_b - lon_a) / 2) ** 2, 0, 1
+    )))
+    if mode == 'haversine':
+        return haversine
+
+    flattening = WGS84_FLATTENING
+    minor_axis = WGS84_MAJOR_AXIS_M * (1 - flattening)
+    reduced_a = np.arctan((1 - flattening) * np.tan(lat_a))
+    reduced_b = np.arctan((1 - flattening) * np.tan(lat_b))
+    sin_a, cos_a = np.sin(reduced_a), np.cos(reduced_a)
+    sin_b, cos_b = np.sin(reduced_b), np.cos(reduced_b)
+    lon_difference = lon_b - lon_a
+    lambda_ = lon_difference
+    converged = np.zeros(np.broadcast(lat_a, lat_b).shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(VINCENTY_MAX_ITERATIONS):
+            sin_lambda, cos_lambda = np.sin(lambda_), np.cos(lambda_)
+            sin_sigma = np.sqrt(
+                (cos_b * sin_lambda) ** 2 + (cos_a * sin_b - sin_a * cos_b * cos_lambda) ** 2
+            )
+            cos_sigma = sin_a * sin_b + cos_a * cos_b * cos_lambda
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            # Coincident points have a null distance
+            sin_alpha = np.where(sin_sigma > 0, cos_a * cos_b * sin_lambda / sin_sigma, 0)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # Points on the equator have no cos_2sigma_m term
+            cos_2sigma_m = np.where(
+                cos2_alpha > 0, cos_sigma - 2 * sin_a * sin_b / cos2_alpha, 0
+            )
+            c_term = flattening / 16 * cos2_alpha * (4 + flattening * (4 - 3 * cos2_alpha))
+            previous_lambda = lambda_
+            lambda_ = lon_difference + (1 - c_term) * flattening * sin_alpha * (
+                sigma + c_term * sin_sigma * (
+                    cos_2sigma_m + c_term * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+                )
+            )
+            converged = np.abs(lambda_ - previous_lambda) < 1e-12
+            if np.all(converged):
+                break
+
+    u2 = cos2_alpha * (WGS84_MAJOR_AXIS_M ** 2 - minor_axis ** 2) / minor_axis ** 2
+    a_term = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    b_term = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = b_term * sin_sigma * (
+        cos_2sigma_m + b_term / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - b_term / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+        )
+    )
+    ellipsoid = minor_axis * a_term * (sigma - delta_sigma)
+    return np.where(converged & np.isfinite(ellipsoid), ellipsoid, haversine)
+
+def calc_dist_matrix(from_coords, to_coords=None, mode='ellipsoid'):
+    """
+    Calculates the matrix of distances in meters from each of from_coords
+    to each of to_coords (from_coords if not given) with calc_dist_array,
+    coordinates in the format [lat, lon]
+    """
+    from_coords = np.asarray(from_coords, dtype=np.float64).reshape(-1, 2)
+    to_coords = from_coords if to_coords is None else np.asarray(
+        to_coords, dtype=np.float64
+    ).reshape(-1, 2)
+    return calc_dist_array(from_coords[:, None, :], to_coords[None, :, :], mode)
+
 def extract_capacity(driver_info, reset_hailed=False):
     '''
     Returns filled vehicle capacity for a driver, taking into account
@@ -197,10 +301,80 @@ def handle_exception(e):
                 scope.set_tag(key, value)
         capture_exception(original_exception)
 
-def tsp_handler(context, data_model, typ):
+def get_blocking_executor():
+    '''
+    Returns the process-wide executor of blocking calls (see run_blocking).
+    Its size can be set with the BLOCKING_POOL_SIZE environment variable
+    '''
+    # pylint: disable=global-statement
+    global _BLOCKING_EXECUTOR
+    # pylint: enable=global-statement
+    with _BLOCKING_EXECUTOR_LOCK:
+        if _BLOCKING_EXECUTOR is None:
+            size = int(os.environ.get('BLOCKING_POOL_SIZE', DEFAULT_BLOCKING_POOL_SIZE))
+            _BLOCKING_EXECUTOR = ThreadPoolExecutor(
+                max_workers=max(size, 1), thread_name_prefix='blocking'
+            )
+        return _BLOCKING_EXECUTOR
+
+async def run_blocking(func, *args, **kwargs):
+    '''
+    Runs a blocking call on the blocking executor and waits for its result
+    on the running event loop
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_blocking_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+def tsp_timeout(data_model, deadline=None):
+    '''
+    Returns the seconds to wait for the TSP run of a data model: the time limit of its
+    search profile plus TSP_TIMEOUT_SLACK (TSP_UNLIMITED_TIMEOUT without a time limit),
+    capped by the seconds left until deadline (epoch time)
     '''
-    Runs TSP on a separate subprocess and handles C++ errors
-    thrown by TSP, translating them into python exceptions
+    time_limit_ms = get_search_profile(data_model.get('search_profile'))['time_limit_ms']
+    if time_limit_ms is None:
+        timeout = TSP_UNLIMITED_TIMEOUT
+    else:
+        timeout = time_limit_ms / 1000 + TSP_TIMEOUT_SLACK
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.time())
+    return timeout
+
+async def tsp_handler_async(context, data_model, typ, search_profile=None):
+    '''
+    Runs TSP on one of the pooled worker subprocesses, waiting for it on the running event loop,
+    and handles C++ errors thrown by TSP, translating them into python exceptions.
+    Small data models (see tsp_exact.EXACT_TSP_MAX_NODES) are solved exactly
+    on the blocking executor instead, so the event loop keeps serving other drivers.
+    Multi-vehicle data models (see multi_vehicle) return each vehicle's route in place of the plan.
+    If search_profile is set, it overrides the data model search profile.
+    Pooled runs time out as set by tsp_timeout with the context's deadline
+    '''
+    if search_profile:
+        data_model['search_profile'] = search_profile
+
+    try:
+        if uses_exact_solver(data_model):
+            return await run_blocking(ExactTSP().run, data_model, typ)
+
+        timeout = tsp_timeout(data_model, context.get('deadline'))
+        if timeout <= 0:
+            raise subprocess.TimeoutExpired(TSP_WORKER_COMMAND, 0)
+        tsp_result = await get_tsp_pool().run_async(data_model, typ, timeout=timeout)
+        return process_tsp_result(context, data_model, typ, tsp_result)
+    # pylint: disable=broad-exception-caught
+    except Exception as error:
+    # pylint: enable=broad-exception-caught
+        handle_tsp_error(context, data_model, typ, error)
+
+    return [False, False, False]
+
+def process_tsp_result(context, data_model, typ, tsp_result):
+    '''
+    Builds the tsp_handler_async output from a worker result,
+    reporting failed runs and returning no assignment for them
     '''
     logger = context['logger']
 
@@ -208,41 +382,51 @@ def tsp_handler(context, data_model, typ):
     tags = {'location': context['location'], 'vehicle': data_model['profile']}
     additional_info = {'data_model': data_model, 'type': typ}
 
-    try:
-        result = subprocess.run(['python3', 'tsp_runner.py', json.dumps(data_model), typ],
-            capture_output=True,
-            check=True,
-            text=True,
-            timeout=30
-        )
-
-        if result.returncode == 0 and result.stdout:
-            tsp_result = json.loads(result.stdout.split('\n')[0])
-            if tsp_result['success']:
-                assignment = tsp_result['assignment']
-                new_route = tsp_result['new_route']
-                new_route_distances = tsp_result['new_route_distances']
-                return [assignment, new_route, new_route_distances]
-            else:
-                # Catches handled python exceptions raised by tsp_runner
-                additional_info['return_code'] = result.returncode
-                additional_info['traceback'] = tsp_result['traceback']
-                message = f"Error running TSP subprocess: {tsp_result['error']}"
-
-                e = TSPDefaultError(message, additional_info, tags)
-                logger.info(e)
-                handle_exception(e)
+    if tsp_result:
+        if tsp_result['success']:
+            assignment = tsp_result['assignment']
+            # Soft constraints the route could only be found without
+            data_model['relaxed_constraints'] = tsp_result.get('relaxed_constraints', [])
+            if 'routes' in tsp_result:
+                # Multi-vehicle models return each vehicle's node order instead of a plan
+                return [assignment, tsp_result['routes'], []]
+            new_route, new_route_distances = [[], []]
+            if assignment:
+                new_route, new_route_distances = route.build_plan(
+                    data_model, tsp_result['order'], typ
+                )
+            return [assignment, new_route, new_route_distances]
         else:
-            # Subprocess tsp_runner ran without errors but returned empty output
-            additional_info['return_code'] = result.returncode
-            additional_info['stdout'] = result.stdout
-            additional_info['stderr'] = result.stderr
-            message = "Error running TSP subprocess: Invalid output"
+            # Catches handled python exceptions raised by tsp_runner
+            additional_info['return_code'] = 0
+            additional_info['traceback'] = tsp_result['traceback']
+            message = f"Error running TSP subprocess: {tsp_result['error']}"
 
             e = TSPDefaultError(message, additional_info, tags)
             logger.info(e)
             handle_exception(e)
-    except subprocess.TimeoutExpired as error:
+    else:
+        # Subprocess tsp_runner ran without errors but returned an invalid result
+        additional_info['return_code'] = 0
+        message = "Error running TSP subprocess: Invalid output"
+
+        e = TSPDefaultError(message, additional_info, tags)
+        logger.info(e)
+        handle_exception(e)
+
+    return [False, False, False]
+
+def handle_tsp_error(context, data_model, typ, error):
+    '''
+    Translates exceptions raised while running TSP into TSP errors and reports them
+    '''
+    logger = context['logger']
+
+    # Error info
+    tags = {'location': context['location'], 'vehicle': data_model['profile']}
+    additional_info = {'data_model': data_model, 'type': typ}
+
+    if isinstance(error, subprocess.TimeoutExpired):
         # Catches subprocess timeout
         additional_info['timeout'] = error.timeout
         message = f'TSP subprocess timed out after {error.timeout} seconds.'
@@ -250,7 +434,7 @@ def tsp_handler(context, data_model, typ):
         e = TSPTimeoutError(message, additional_info, tags).with_traceback(error.__traceback__)
         logger.info(e)
         handle_exception(e)
-    except subprocess.CalledProcessError as error:
+    elif isinstance(error, subprocess.CalledProcessError):
         # Catches any unhandled python and C++ exceptions raised by tsp_runner
         # Or subprocess returned status code other than 0
         additional_info['return_code'] = error.returncode
@@ -271,9 +455,7 @@ def tsp_handler(context, data_model, typ):
 
         logger.info(e)
         handle_exception(e)
-    # pylint: disable=broad-exception-caught
-    except Exception as error:
-    # pylint: enable=broad-exception-caught
+    else:
         # Catches any inner python exceptions
         additional_info['data_model'] = data_model
         additional_info['type'] = typ
@@ -284,5 +466,3 @@ def tsp_handler(context, data_model, typ):
         ).with_traceback(error.__traceback__)
         logger.info(e)
         handle_exception(e)
-
-    return [False, False, False]
@@ -1,6 +1,7 @@
 """
 Validator functions to assertain if value is within expected parameters
 """
+from search_profiles import SEARCH_PROFILES
 
 def valid_boolean(value):
     """
@@ -19,3 +20,32 @@ def valid_sort_option(value):
     if str(value) in ['closest', 'idle']:
         return value
     raise Exception(f'Value {value} not in [\'closest\', \'idle\']')
+
+
+def valid_search_profile(value):
+    """
+    Validates if value is a known TSP search profile name
+    """
+    if str(value) in SEARCH_PROFILES:
+        return value
+    raise Exception(f'Value {value} not in {list(SEARCH_PROFILES.keys())}')
+
+def valid_ranking_engine(value):
+    """
+    Validates if value is 'insertion' or 'tsp'
+    """
+    if str(value) in ['insertion', 'tsp']:
+        return value
+    raise Exception(f'Value {value} not in [\'insertion\', \'tsp\']')
+
+def valid_matrix_provider(value):
+    """
+    Validates if value is a known travel matrix provider name
+    (matrix_providers and its http client are imported on first use)
+    """
+    # pylint: disable=import-outside-toplevel
+    from matrix_providers import MATRIX_PROVIDERS
+    # pylint: enable=import-outside-toplevel
+    if str(value) in MATRIX_PROVIDERS:
+        return value
+    raise Exception(f'Value {value} not in {MATRIX_PROVIDERS}')